@@ -0,0 +1,188 @@
+# Batch annotation of a corpus with the linkers found in it.
+#
+# Input is plain text (one record per line) or JSONL (one object per line,
+# with the text under --field and an optional "id" that is passed through).
+# Every record gets one output line:
+#
+#     {"line": 1, "id": ..., "matches": [{"spans": [[start, end], ...], "units": [507]}],
+#      "units": {"507": {"linker": ..., "semfield": ..., "subfields": [...], "parameters": {...}}}}
+#
+# Contiguous linkers come from spotter.py (longest matches), multi-component
+# ones from discontinuous.py (best analyses). Spans are character offsets.
+#
+# The matchers and a compact table of unit attributes are loaded once in the
+# parent process; the workers are forked afterwards and share them
+# copy-on-write. Records are sent to the workers in batches, at most a few
+# batches per worker in flight, and written back in input order, so memory
+# stays bounded whatever the size of the corpus. A checkpoint file next to
+# the output records how many records and bytes have been written; --resume
+# truncates the output to that point and skips the records already done.
+#
+#     python annotate.py ruslinkers-new4.db corpus.txt -o corpus.jsonl --jobs 8
+#     python annotate.py ruslinkers-new4.db corpus.jsonl --jsonl -o corpus.ann.jsonl --resume
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import multiprocessing
+
+from collections import deque
+from itertools import islice
+
+import spotter
+import discontinuous
+
+KEY_PARAMETERS = ('parts.num', 'parts.order', 'linker_position', 'clause.order', 'dep.clause.type')
+
+BATCH = 1000
+
+# Set in the parent before the workers are forked
+_spotter = _matcher = _units = None
+
+def unit_attributes(conn: sqlite3.Connection, parameters=KEY_PARAMETERS):
+    """{unit id: attributes} with the semfield, subfields and key parameter values"""
+    units = {}
+    for uid, linker, semfield, parametermap in conn.execute('''
+            SELECT u.id, u.linker, s.keyword, u.parametermap
+            FROM units AS u LEFT JOIN semfields AS s ON s.id = u.semfield_id'''):
+        parametermap = json.loads(parametermap) if parametermap else {}
+        units[uid] = {'linker': linker, 'semfield': semfield, 'subfields': [],
+                      'parameters': {p: parametermap[p] for p in parameters if p in parametermap}}
+    # Unit.subfields is stored in meanings_to_subfields
+    for uid, subfield in conn.execute('''
+            SELECT ms.meaning_id, s.keyword FROM meanings_to_subfields AS ms
+            JOIN subfields AS s ON s.id = ms.subfield_id ORDER BY ms.meaning_id, s.id'''):
+        if uid in units:
+            units[uid]['subfields'].append(subfield)
+    return units
+
+def load(path: str, parameters=KEY_PARAMETERS):
+    """Load the matchers and unit attributes of a database for annotate()"""
+    global _spotter, _matcher, _units
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    # Workers only read the database, so a stale spotter is compiled in memory
+    _spotter = spotter.Spotter.load_compiled(path, conn)
+    _matcher = discontinuous.Matcher.compile(conn)
+    _units = unit_attributes(conn, parameters)
+    conn.close()
+
+def annotate(text: str):
+    """(matches, units) of one text"""
+    matches = [{'spans': [[offset, offset + length]], 'units': list(uids)}
+               for offset, length, uids in spotter.longest(_spotter.scan(text))]
+    contiguous = {(m['spans'][0][0], m['spans'][0][1], uid) for m in matches for uid in m['units']}
+    for _, analyses in _matcher.match(text):
+        for a in discontinuous.best(analyses):
+            # затем, чтобы is found by both matchers
+            if (a.spans[0][0], a.spans[-1][0] + a.spans[-1][1], a.unit_id) in contiguous:
+                continue
+            matches.append({'spans': [[o, o + n] for o, n in a.spans], 'units': [a.unit_id], 'score': round(a.score, 2)})
+    matches.sort(key=lambda m: m['spans'][0])
+    units = {str(uid): _units[uid] for m in matches for uid in m['units'] if uid in _units}
+    return matches, units
+
+def annotate_batch(batch):
+    """Output lines of a batch of (line number, id, text) records"""
+    lines = []
+    for number, rid, text in batch:
+        matches, units = annotate(text)
+        record = {'line': number}
+        if rid is not None:
+            record['id'] = rid
+        record['matches'] = matches
+        record['units'] = units
+        lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+    return ''.join(lines)
+
+def records(file, jsonl: bool = False, field: str = 'text', skip: int = 0):
+    """(line number, id, text) of every input record after the first skip ones"""
+    for number, line in enumerate(islice(file, skip, None), skip + 1):
+        if jsonl:
+            obj = json.loads(line)
+            yield number, obj.get('id'), obj.get(field) or ''
+        else:
+            yield number, None, line.rstrip('\n')
+
+def read_checkpoint(path: str):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'records': 0, 'bytes': 0}
+
+def write_checkpoint(path: str, state):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(path + '.tmp', path)
+
+def run(database: str, input_file, output: str, jobs: int = 1, jsonl: bool = False, field: str = 'text',
+        resume: bool = False, batch: int = BATCH, parameters=KEY_PARAMETERS, progress=sys.stderr):
+    """Annotate a corpus into output; returns the number of records written in this run"""
+    checkpoint = output + '.checkpoint'
+    state = read_checkpoint(checkpoint) if resume else {'records': 0, 'bytes': 0}
+    load(database, parameters)
+    out = open(output, 'r+' if resume and os.path.exists(output) else 'w')
+    out.truncate(state['bytes'])
+    out.seek(state['bytes'])
+    source = records(input_file, jsonl, field, state['records'])
+    batches = iter(lambda: list(islice(source, batch)), [])
+    start = last = time.perf_counter()
+    done = nbytes = 0
+
+    def write(text: str, count: int):
+        nonlocal done, nbytes, last
+        out.write(text)
+        out.flush()
+        done += count
+        nbytes += len(text.encode())
+        state['records'] += count
+        state['bytes'] = out.tell()
+        write_checkpoint(checkpoint, state)
+        now = time.perf_counter()
+        if progress is not None and now - last >= 5:
+            last = now
+            print("%d records, %.0f records/s" % (state['records'], done / (now - start)), file=progress)
+
+    if jobs > 1:
+        # Forked workers share the loaded matchers copy-on-write
+        context = multiprocessing.get_context('fork')
+        with context.Pool(jobs) as pool:
+            pending = deque()
+            for items in batches:
+                pending.append((pool.apply_async(annotate_batch, (items,)), len(items)))
+                if len(pending) >= 2 * jobs:
+                    result, count = pending.popleft()
+                    write(result.get(), count)
+            while pending:
+                result, count = pending.popleft()
+                write(result.get(), count)
+    else:
+        for items in batches:
+            write(annotate_batch(items), len(items))
+    out.close()
+    elapsed = time.perf_counter() - start
+    if progress is not None:
+        print("Annotated %d records in %.1fs: %.0f records/s, %.1f MB/s of output" % (
+            done, elapsed, done / elapsed if elapsed else 0, nbytes / 1e6 / elapsed if elapsed else 0), file=progress)
+    return done
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Annotate a corpus with the linkers found in it")
+    argparser.add_argument("database")
+    argparser.add_argument("input", nargs='?', help="text or JSONL file (default: standard input)")
+    argparser.add_argument("-o", "--output", required=True, help="JSONL file to write")
+    argparser.add_argument("--jsonl", action="store_true", help="input is JSONL rather than plain text")
+    argparser.add_argument("--field", default="text", help="text field of JSONL records (default: %(default)s)")
+    argparser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes (default: %(default)s)")
+    argparser.add_argument("--batch", type=int, default=BATCH, help="records per batch (default: %(default)s)")
+    argparser.add_argument("--parameters", default=','.join(KEY_PARAMETERS),
+                           help="unit parameters to include (default: %(default)s)")
+    argparser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    args = argparser.parse_args()
+
+    file = open(args.input) if args.input else sys.stdin
+    run(args.database, file, args.output, args.jobs, args.jsonl, args.field, args.resume, args.batch,
+        args.parameters.split(','))
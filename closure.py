@@ -0,0 +1,117 @@
+# Units by semantic field, through a closure table.
+#
+# A unit belongs to a field as its main field (units.semfield_id), as an
+# extra field (units_to_semfields, from semfield2_ed) or through one of the
+# field's subfields (Unit.subfields, with subfields.semfield_id). The build
+# materializes all of that in unit_fields (see models.py):
+#
+#   semfield_id  subfield_id  unit_id  role
+#   адверсатив   NULL         507      main     one row per unit of a field,
+#   адверсатив   NULL         93       sub      with its strongest role
+#   адверсатив   уступка      93       sub      one row per unit of a subfield
+#
+# so listing the units of a field or subfield is one range scan of the
+# covering index ix_unit_fields_field. Pages are keyset-paginated by unit
+# id: a page ends with the cursor to pass as after= for the next one.
+#
+#     python closure.py ruslinkers-new4.db адверсатив --role main,extra --limit 20
+#     python closure.py ruslinkers-new4.db адверсатив --after 4432512270733155
+
+import sqlite3
+import argparse
+
+from typing import List, Optional, Tuple
+
+# Strongest first
+ROLES = ('main', 'extra', 'sub')
+
+CLOSURE = '''
+    WITH links (semfield_id, subfield_id, unit_id, rank) AS (
+        SELECT semfield_id, NULL, id, 0 FROM units WHERE semfield_id IS NOT NULL
+        UNION ALL
+        SELECT semfield_id, NULL, unit_id, 1 FROM units_to_semfields
+        UNION ALL
+        -- Unit.subfields is stored in meanings_to_subfields
+        SELECT sf.semfield_id, ms.subfield_id, ms.meaning_id, 2
+        FROM meanings_to_subfields AS ms JOIN subfields AS sf ON sf.id = ms.subfield_id
+        WHERE sf.semfield_id IS NOT NULL
+    )
+    SELECT semfield_id, NULL, unit_id, CASE MIN(rank) WHEN 0 THEN 'main' WHEN 1 THEN 'extra' ELSE 'sub' END
+    FROM links GROUP BY semfield_id, unit_id
+    UNION ALL
+    SELECT DISTINCT semfield_id, subfield_id, unit_id, 'sub' FROM links WHERE subfield_id IS NOT NULL
+'''
+
+PAGE = '''
+    SELECT uf.unit_id, u.linker, uf.role FROM unit_fields AS uf INDEXED BY ix_unit_fields_field
+    JOIN units AS u ON u.id = uf.unit_id
+    WHERE uf.semfield_id = ? AND uf.subfield_id IS ? AND uf.unit_id > ?%s
+    ORDER BY uf.unit_id LIMIT ?
+'''
+
+def build(conn: sqlite3.Connection) -> int:
+    """Refill unit_fields; returns the number of rows"""
+    conn.execute('DELETE FROM unit_fields')
+    conn.execute('INSERT INTO unit_fields (semfield_id, subfield_id, unit_id, role) ' + CLOSURE)
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM unit_fields').fetchone()[0]
+
+def build_database(path: str) -> int:
+    conn = sqlite3.connect(path)
+    count = build(conn)
+    conn.close()
+    return count
+
+def resolve(conn: sqlite3.Connection, keyword: str, subfield: bool = False) -> Tuple[int, Optional[int]]:
+    """(semfield id, subfield id or None) of a field keyword; semantic fields are tried first"""
+    if not subfield:
+        row = conn.execute('SELECT id FROM semfields WHERE keyword = ?', (keyword,)).fetchone()
+        if row is not None:
+            return row[0], None
+    row = conn.execute('SELECT semfield_id, id FROM subfields WHERE keyword = ?', (keyword,)).fetchone()
+    if row is None:
+        raise KeyError(keyword)
+    return row[0], row[1]
+
+def page(conn: sqlite3.Connection, semfield_id: int, subfield_id: Optional[int] = None, roles=ROLES,
+         after: int = 0, limit: int = 50) -> Tuple[List[Tuple[int, str, str]], Optional[int]]:
+    """([(unit id, linker, role), ...], cursor of the next page or None)"""
+    roles = [r for r in ROLES if r in roles]
+    if len(roles) == len(ROLES):
+        where, roles = '', []
+    else:
+        where = ' AND uf.role IN (%s)' % ', '.join('?' * len(roles))
+    rows = conn.execute(PAGE % where, [semfield_id, subfield_id, after] + roles + [limit]).fetchall()
+    return rows, rows[-1][0] if len(rows) == limit else None
+
+def units_in_field(conn: sqlite3.Connection, keyword: str, roles=ROLES, after: int = 0, limit: int = 50,
+                   subfield: bool = False):
+    """page() of the units of a semantic field or subfield given by keyword"""
+    return page(conn, *resolve(conn, keyword, subfield), roles=roles, after=after, limit=limit)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="List the units of a semantic field or subfield")
+    argparser.add_argument("database")
+    argparser.add_argument("field", help="keyword of a semantic field or subfield")
+    argparser.add_argument("--subfield", action="store_true", help="the keyword is a subfield")
+    argparser.add_argument("--role", default=','.join(ROLES), help="roles to list (default: %(default)s)")
+    argparser.add_argument("--after", type=int, default=0, help="cursor printed at the end of the previous page")
+    argparser.add_argument("--limit", type=int, default=50)
+    argparser.add_argument("--explain", action="store_true", help="print the query plan")
+    args = argparser.parse_args()
+
+    conn = sqlite3.connect('file:%s?mode=ro' % args.database, uri=True)
+    try:
+        semfield_id, subfield_id = resolve(conn, args.field, args.subfield)
+    except KeyError:
+        argparser.error("no semantic field or subfield %s" % args.field)
+    roles = args.role.split(',')
+    rows, cursor = page(conn, semfield_id, subfield_id, roles, args.after, args.limit)
+    for unit_id, linker, role in rows:
+        print("%d\t%s\t%s" % (unit_id, linker, role))
+    if cursor is not None:
+        print("# next page: --after %d" % cursor)
+    if args.explain:
+        plan = conn.execute('EXPLAIN QUERY PLAN ' + PAGE % '', (semfield_id, subfield_id, args.after, args.limit))
+        for row in plan:
+            print("# %s" % row[3])
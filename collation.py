@@ -0,0 +1,138 @@
+# Alphabetical browsing of the linkers and their forms.
+#
+# sort_key() turns a linker or form into a string that compares in Russian
+# dictionary order with SQLite's default BINARY collation (UTF-8 bytes):
+#
+# * primary level: the words of the text, lowercased, with ё read as е.
+#   Spaces, hyphens, the gap mark "_", "..." and other punctuation separate
+#   words, and a separator sorts before any letter, so the order is word by
+#   word ("а вот" < "а-то" < "абы"). Leading optional particles in parentheses
+#   are skipped: "(а/но) с другой (стороны)" is filed under С;
+# * secondary level: е before ё where the primary keys are equal;
+# * last: the text itself, so the key is deterministic.
+#
+# Lowercase Cyrillic а-я without ё is contiguous in Unicode, and UTF-8 keeps
+# code point order, so the primary level is the normalized text itself. The
+# levels are joined with \x01, which sorts before every character they hold.
+#
+# The build fills browse_keys (see models.py) with one row per linker and per
+# form whose text differs from its linker, keyed by (sort_key, unit_id). A
+# letter jump starts the range at the letter, and every page ends with the
+# cursor of its last row, so "next 50" is one range scan of the primary key:
+#
+#     python collation.py ruslinkers-new4.db --letter Л --limit 20
+#     python collation.py ruslinkers-new4.db --after '["...", 4432512270733155]'
+#     python collation.py ruslinkers-new4.db --letters
+
+import re
+import json
+import shlex
+import sqlite3
+import argparse
+
+from typing import List, Optional, Tuple
+
+WORD = re.compile(r'[^\W_]+')
+LEADING_PARTICLES = re.compile(r'^\W*(?:\([^()]*\)\W*)+')
+LEVELS = '\x01'
+# Entries that do not start with a Cyrillic letter
+OTHER = '#'
+
+PAGE = '''
+    SELECT b.sort_key, b.unit_id, b.form_id, b.text, u.linker FROM browse_keys AS b
+    JOIN units AS u ON u.id = b.unit_id
+    WHERE %s ORDER BY b.sort_key, b.unit_id LIMIT ?
+'''
+
+def _words(text: str) -> List[str]:
+    return WORD.findall(text.lower().replace('ё', 'е'))
+
+def primary(text: str) -> str:
+    """Words of a text without leading optional particles, lowercased, ё as е"""
+    words = _words(LEADING_PARTICLES.sub('', text))
+    return ' '.join(words or _words(text))
+
+def sort_key(text: str) -> str:
+    """Key of a text that sorts in Russian order with the BINARY collation"""
+    key = primary(text)
+    stripped = LEADING_PARTICLES.sub('', text).lower()
+    if not _words(stripped):
+        stripped = text.lower()
+    accents = ''.join('1' if ch == 'ё' else '0' for ch in stripped if ch in 'её')
+    return key + LEVELS + accents + LEVELS + text
+
+def letter(key: str) -> str:
+    """Letter a sort key is filed under"""
+    first = key[:1]
+    return first.upper() if 'а' <= first <= 'я' else OTHER
+
+def entries(conn: sqlite3.Connection):
+    """[(sort key, unit id, form id or None, text), ...] of the linkers and the forms that differ from them"""
+    found = {}
+    for unit_id, linker in conn.execute('SELECT id, linker FROM units ORDER BY id'):
+        if linker:
+            found.setdefault((sort_key(linker), unit_id), None)
+    for form_id, unit_id, text in conn.execute('SELECT id, unit_id, text FROM forms ORDER BY id'):
+        if text:
+            found.setdefault((sort_key(text), unit_id), form_id)
+    return [(key, unit_id, form_id, key.rsplit(LEVELS, 1)[1]) for (key, unit_id), form_id in found.items()]
+
+def build(conn: sqlite3.Connection) -> int:
+    """Refill browse_keys; returns the number of rows"""
+    conn.execute('DELETE FROM browse_keys')
+    rows = entries(conn)
+    conn.executemany('INSERT INTO browse_keys (sort_key, unit_id, form_id, letter, text) VALUES (?, ?, ?, ?, ?)',
+                     [(key, unit_id, form_id, letter(key), text) for key, unit_id, form_id, text in rows])
+    conn.commit()
+    return len(rows)
+
+def build_database(path: str) -> int:
+    conn = sqlite3.connect(path)
+    count = build(conn)
+    conn.close()
+    return count
+
+def letters(conn: sqlite3.Connection) -> List[Tuple[str, int]]:
+    """[(letter, number of entries), ...] in alphabetical order"""
+    return conn.execute('SELECT letter, COUNT(*) FROM browse_keys GROUP BY letter ORDER BY MIN(sort_key)').fetchall()
+
+def page(conn: sqlite3.Connection, letter: Optional[str] = None, after: Optional[Tuple[str, int]] = None,
+         limit: int = 50) -> Tuple[List[Tuple[int, Optional[int], str, str]], Optional[Tuple[str, int]]]:
+    """([(unit id, form id or None, text, linker), ...], cursor of the next page or None)
+
+    The page starts after the cursor if one is given, else at the letter, else at the beginning."""
+    if after is not None:
+        where, params = '(b.sort_key, b.unit_id) > (?, ?)', list(after)
+    elif letter is not None and letter != OTHER:
+        where, params = 'b.sort_key >= ?', [primary(letter)]
+    else:
+        where, params = '1', []
+    rows = conn.execute(PAGE % where, params + [limit]).fetchall()
+    cursor = (rows[-1][0], rows[-1][1]) if len(rows) == limit else None
+    return [row[1:] for row in rows], cursor
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Browse the linkers and their forms in alphabetical order")
+    argparser.add_argument("database")
+    argparser.add_argument("--letter", help="start at this letter")
+    argparser.add_argument("--after", help="cursor printed at the end of the previous page")
+    argparser.add_argument("--limit", type=int, default=50)
+    argparser.add_argument("--letters", action="store_true", help="list the letters with their number of entries")
+    argparser.add_argument("--explain", action="store_true", help="print the query plan")
+    args = argparser.parse_args()
+
+    conn = sqlite3.connect('file:%s?mode=ro' % args.database, uri=True)
+    if args.letters:
+        for name, count in letters(conn):
+            print("%s\t%d" % (name, count))
+        raise SystemExit
+    after = tuple(json.loads(args.after)) if args.after else None
+    rows, cursor = page(conn, args.letter, after, args.limit)
+    for unit_id, form_id, text, linker in rows:
+        print("%d\t%s%s" % (unit_id, text, "" if form_id is None else "\t-> %s" % linker))
+    if cursor is not None:
+        print("# next page: --after %s" % shlex.quote(json.dumps(cursor, ensure_ascii=False)))
+    if args.explain:
+        for where, params in (('b.sort_key >= ?', ['']), ('(b.sort_key, b.unit_id) > (?, ?)', ['', 0])):
+            for row in conn.execute('EXPLAIN QUERY PLAN ' + PAGE % where, params + [args.limit]):
+                print("# %s" % row[3])
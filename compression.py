@@ -0,0 +1,188 @@
+# Optional compressed storage for the long text columns.
+#
+# Each column in COLUMNS gets its own zstd dictionary trained on the column's
+# values at build time. Values are replaced by zstd frames (BLOBs) that refer
+# to the dictionary by its id; values that would not get smaller stay TEXT.
+# The dictionaries are kept in the zstd_dictionaries table. models.py loads
+# them whenever an engine connects to a compressed database, so its
+# CompressedText columns read back as str without any setup; sqlite3 code
+# calls load_dictionaries(conn) before decompress().
+#
+# Full-text search cannot index compressed values, so the plain text is
+# indexed first in contentless FTS5 tables fts_<table>_<column> whose rowid is
+# the id of the row:
+#
+#     SELECT rowid FROM fts_examples_text WHERE fts_examples_text MATCH 'поскольку'
+#
+# ё is indexed as е; search() normalizes queries the same way.
+#
+#     python compression.py compress ruslinkers-new4.db
+#     python compression.py bench ruslinkers-new4.db
+#
+# Requires the zstandard package.
+
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import argparse
+
+import zstandard
+
+COLUMNS = [
+    ('examples', 'text'),
+    ('units', 'sem_comment'),
+    ('comments', 'text'),
+    ('meanings', 'meaning'),
+]
+
+LEVEL = 19
+MAX_DICT_SIZE = 112640
+
+_decompressors = {}
+
+def train(values, dict_size: int = None) -> zstandard.ZstdCompressionDict:
+    samples = [v.encode() for v in values]
+    if dict_size is None:
+        # About a tenth of the sample, which is where the ratio stops improving
+        dict_size = min(MAX_DICT_SIZE, max(4096, sum(map(len, samples)) // 10))
+    return zstandard.train_dictionary(dict_size, samples, level=LEVEL)
+
+def create_fts(conn: sqlite3.Connection, table: str, column: str):
+    fts = 'fts_%s_%s' % (table, column)
+    conn.execute('DROP TABLE IF EXISTS %s' % fts)
+    conn.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, content='', tokenize='unicode61 remove_diacritics 2')" % (fts, column))
+    load_dictionaries(conn)
+    rows = conn.execute('SELECT id, %s FROM %s WHERE %s IS NOT NULL' % (column, table, column)).fetchall()
+    # unicode61 does not fold ё, so it is indexed as е (see search())
+    conn.executemany('INSERT INTO %s (rowid, %s) VALUES (?, ?)' % (fts, column),
+                     [(rowid, decompress(value).replace('ё', 'е').replace('Ё', 'Е')) for rowid, value in rows])
+
+def search(conn: sqlite3.Connection, table: str, column: str, query: str, limit: int = 100):
+    """Ids of rows whose text matches an FTS5 query"""
+    query = query.replace('ё', 'е').replace('Ё', 'Е')
+    return [r[0] for r in conn.execute('SELECT rowid FROM fts_%s_%s WHERE fts_%s_%s MATCH ? LIMIT ?' % (
+        table, column, table, column), (query, limit))]
+
+def compress_database(path: str, fts: bool = True):
+    """Compress COLUMNS of a built database in place; returns {column: (plain bytes, stored bytes)}"""
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS zstd_dictionaries (
+        dict_id INTEGER PRIMARY KEY,
+        "table" TEXT NOT NULL,
+        "column" TEXT NOT NULL,
+        data BLOB NOT NULL)''')
+    stats = {}
+    for table, column in COLUMNS:
+        rows = conn.execute("SELECT id, %s FROM %s WHERE typeof(%s) = 'text' AND %s != ''" % (
+            column, table, column, column)).fetchall()
+        if fts:
+            create_fts(conn, table, column)
+        if len(rows) < 8: # too little to train a dictionary on
+            continue
+        zdict = train([v for _, v in rows])
+        conn.execute('INSERT OR REPLACE INTO zstd_dictionaries VALUES (?, ?, ?, ?)',
+                     (zdict.dict_id(), table, column, zdict.as_bytes()))
+        compressor = zstandard.ZstdCompressor(level=LEVEL, dict_data=zdict, write_content_size=True,
+                                              write_checksum=False, write_dict_id=True)
+        updates = []
+        plain = stored = 0
+        for rowid, value in rows:
+            data = value.encode()
+            frame = compressor.compress(data)
+            plain += len(data)
+            if len(frame) < len(data):
+                updates.append((frame, rowid))
+                stored += len(frame)
+            else:
+                stored += len(data)
+        conn.executemany('UPDATE %s SET %s = ? WHERE id = ?' % (table, column), updates)
+        stats['%s.%s' % (table, column)] = (plain, stored)
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    return stats
+
+def load_dictionaries(conn):
+    """Load the dictionaries of a database (DB-API connection) for decompress()"""
+    try:
+        rows = conn.execute('SELECT dict_id, data FROM zstd_dictionaries').fetchall()
+    except sqlite3.OperationalError: # plain database
+        return
+    for dict_id, data in rows:
+        if dict_id not in _decompressors:
+            zdict = zstandard.ZstdCompressionDict(data, dict_type=zstandard.DICT_TYPE_FULLDICT)
+            _decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=zdict)
+
+def decompress(value):
+    """Return the text of a stored value, whether compressed or not"""
+    if not isinstance(value, bytes):
+        return value
+    dict_id = zstandard.get_frame_parameters(value).dict_id
+    try:
+        return _decompressors[dict_id].decompress(value).decode()
+    except KeyError:
+        raise LookupError("zstd dictionary %d is not loaded; call compression.load_dictionaries(conn)" % dict_id)
+
+# An entry page needs the unit's comment plus the texts of its examples, comments and meanings
+ENTRY_TEXTS = [
+    'SELECT sem_comment FROM units WHERE id = ?',
+    'SELECT e.text FROM examples_to_units AS eu JOIN examples AS e ON e.id = eu.example_id WHERE eu.unit_id = ?',
+    'SELECT e.text FROM examples_to_unit_parametervalues AS ep JOIN examples AS e ON e.id = ep.example_id WHERE ep.unit_id = ?',
+    'SELECT c.text FROM comments_to_units AS cu JOIN comments AS c ON c.id = cu.comment_id WHERE cu.unit_id = ?',
+    'SELECT meaning FROM meanings WHERE unit_id = ?',
+]
+
+def bench_entries(path: str, repeat: int = 3):
+    """Seconds per entry to fetch and decode all texts of every unit"""
+    conn = sqlite3.connect(path)
+    load_dictionaries(conn)
+    units = [r[0] for r in conn.execute('SELECT id FROM units')]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for uid in units:
+            for sql in ENTRY_TEXTS:
+                for value, in conn.execute(sql, (uid,)):
+                    decompress(value)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    conn.close()
+    return best / len(units)
+
+def bench(path: str):
+    workdir = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(workdir, 'plain.db')
+        compressed = os.path.join(workdir, 'compressed.db')
+        shutil.copy(path, plain)
+        conn = sqlite3.connect(plain)
+        conn.execute('VACUUM')
+        conn.close()
+        shutil.copy(plain, compressed)
+        stats = compress_database(compressed, fts=False)
+        for column, (before, after) in stats.items():
+            print("%-20s %9d -> %9d bytes (%.1f%%)" % (column, before, after, 100.0 * after / before))
+        conn = sqlite3.connect(compressed)
+        print("%-20s %9s    %9d bytes" % ('dictionaries', '', conn.execute('SELECT SUM(LENGTH(data)) FROM zstd_dictionaries').fetchone()[0]))
+        conn.close()
+        before, after = os.path.getsize(plain), os.path.getsize(compressed)
+        print("%-20s %9d -> %9d bytes (%.1f%%)" % ('database file', before, after, 100.0 * after / before))
+        t_plain, t_compressed = bench_entries(plain), bench_entries(compressed)
+        print("entry texts: %.1f us plain, %.1f us compressed (+%.1f us per entry)" % (
+            t_plain * 1e6, t_compressed * 1e6, (t_compressed - t_plain) * 1e6))
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Compress long text columns with trained zstd dictionaries")
+    argparser.add_argument("command", choices=["compress", "bench"])
+    argparser.add_argument("database")
+    args = argparser.parse_args()
+
+    if args.command == "compress":
+        for column, (before, after) in compress_database(args.database).items():
+            print("%s: %d -> %d bytes" % (column, before, after))
+    else:
+        bench(args.database)
@@ -0,0 +1,32 @@
+# Read-only sqlite3 connections to built databases, for the tools that query
+# them without SQLAlchemy (export.py, dump.py, memimage.py, loadtest.py).
+#
+# Every connection gets two SQL functions:
+#
+# * plain(value): the text of a stored value, whether the database is
+#   compressed (compression.py) or not;
+# * normalize(text): the text lowercased with ё read as е, as spotter.py
+#   matches it.
+#
+#     conn = db.connect('ruslinkers-new4.db')
+#     conn.execute('SELECT id FROM examples WHERE instr(normalize(plain(text)), ?)', ('потому',))
+
+import sqlite3
+
+import spotter
+
+def register(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Add plain() and normalize() to a connection"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'zstd_dictionaries'").fetchone():
+        import compression
+        compression.load_dictionaries(conn)
+        conn.create_function('plain', 1, compression.decompress, deterministic=True)
+    else:
+        conn.create_function('plain', 1, lambda value: value, deterministic=True)
+    conn.create_function('normalize', 1, lambda text: None if text is None else spotter.normalize(text),
+                         deterministic=True)
+    return conn
+
+def connect(path: str) -> sqlite3.Connection:
+    """Read-only connection to a database file"""
+    return register(sqlite3.connect('file:%s?mode=ro' % path, uri=True))
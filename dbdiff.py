@@ -0,0 +1,292 @@
+# Structural diff between two built databases.
+#
+# Every unit subtree (forms, parameter values, examples, comments, meanings,
+# links, ...) is reduced to one hash per section. Rows are streamed from SQL,
+# written out in terms of content (keywords and texts, never ids, which
+# depend on the CSV order) and folded into an order-independent sum of row
+# hashes, so memory stays proportional to the number of units. Units are
+# matched by linker, semantic field and occurrence; only the sections whose
+# hashes differ are fetched again to list the rows that changed.
+#
+#     python dbdiff.py ruslinkers-old.db ruslinkers-new4.db -o changes.json
+
+import sqlite3
+import hashlib
+import json
+import sys
+import argparse
+
+from collections import defaultdict
+
+# Every query returns the unit id first and then the content of one row of
+# the unit subtree
+SECTIONS = {
+    'unit': '''
+        SELECT u.id, u.linker, u.status, u.style, u.sem_comment, s.keyword
+        FROM units AS u LEFT JOIN semfields AS s ON s.id = u.semfield_id''',
+    'extra_semfields': '''
+        SELECT us.unit_id, s.keyword
+        FROM units_to_semfields AS us JOIN semfields AS s ON s.id = us.semfield_id''',
+    # Unit.subfields is mapped onto the meanings_to_subfields table
+    'subfields': '''
+        SELECT ms.meaning_id, s.keyword
+        FROM meanings_to_subfields AS ms JOIN subfields AS s ON s.id = ms.subfield_id''',
+    'sources': '''
+        SELECT su.unit_id, s.keyword
+        FROM sources_to_units AS su JOIN sources AS s ON s.id = su.source_id''',
+    'parametervalues': '''
+        SELECT up.unit_id, p.keyword, pv.keyword
+        FROM units_to_parametervalues AS up
+        JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id''',
+    'parametervalue_examples': '''
+        SELECT ep.unit_id, p.keyword, pv.keyword, e.text
+        FROM examples_to_unit_parametervalues AS ep
+        JOIN examples AS e ON e.id = ep.example_id
+        JOIN parametervalues AS pv ON pv.id = ep.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id''',
+    'parametervalue_comments': '''
+        SELECT cp.unit_id, p.keyword, pv.keyword, c.text, c.hidden
+        FROM comments_to_unit_parametervalues AS cp
+        JOIN comments AS c ON c.id = cp.comment_id
+        JOIN parametervalues AS pv ON pv.id = cp.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id''',
+    'textparameters': '''
+        SELECT ut.unit_id, t.keyword, ut.value
+        FROM units_to_textparametervalues AS ut JOIN textparameters AS t ON t.id = ut.parameter_id''',
+    'examples': '''
+        SELECT eu.unit_id, e.text
+        FROM examples_to_units AS eu JOIN examples AS e ON e.id = eu.example_id''',
+    'comments': '''
+        SELECT cu.unit_id, c.text, c.hidden
+        FROM comments_to_units AS cu JOIN comments AS c ON c.id = cu.comment_id''',
+    'meanings': '''
+        SELECT m.unit_id, s.keyword, m.meaning, m.pos, m.pos_type, m.other_senses, m.other_pos
+        FROM meanings AS m LEFT JOIN sources AS s ON s.id = m.source_id''',
+    'links': '''
+        SELECT l.source_id, lt.keyword, t.linker, s.keyword
+        FROM units_to_units AS l
+        JOIN unitlinktypes AS lt ON lt.id = l.unitlinktype_id
+        JOIN units AS t ON t.id = l.target_id
+        LEFT JOIN semfields AS s ON s.id = t.semfield_id''',
+    'forms': '''
+        SELECT f.unit_id, ft.keyword, f.text
+        FROM forms AS f JOIN formtypes AS ft ON ft.id = f.formtype_id''',
+    'form_parametervalues': '''
+        SELECT f.unit_id, ft.keyword, f.text, p.keyword, pv.keyword
+        FROM forms_to_parametervalues AS fp
+        JOIN forms AS f ON f.id = fp.form_id
+        JOIN formtypes AS ft ON ft.id = f.formtype_id
+        JOIN parametervalues AS pv ON pv.id = fp.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id''',
+    'form_parametervalue_examples': '''
+        SELECT f.unit_id, ft.keyword, f.text, p.keyword, pv.keyword, e.text
+        FROM examples_to_form_parametervalues AS ep
+        JOIN examples AS e ON e.id = ep.example_id
+        JOIN forms AS f ON f.id = ep.form_id
+        JOIN formtypes AS ft ON ft.id = f.formtype_id
+        JOIN parametervalues AS pv ON pv.id = ep.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id''',
+    'form_parametervalue_comments': '''
+        SELECT f.unit_id, ft.keyword, f.text, p.keyword, pv.keyword, c.text, c.hidden
+        FROM comments_to_form_parametervalues AS cp
+        JOIN comments AS c ON c.id = cp.comment_id
+        JOIN forms AS f ON f.id = cp.form_id
+        JOIN formtypes AS ft ON ft.id = f.formtype_id
+        JOIN parametervalues AS pv ON pv.id = cp.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id''',
+    'form_textparameters': '''
+        SELECT f.unit_id, ft.keyword, f.text, t.keyword, ftp.value
+        FROM forms_to_textparametervalues AS ftp
+        JOIN forms AS f ON f.id = ftp.form_id
+        JOIN formtypes AS ft ON ft.id = f.formtype_id
+        JOIN textparameters AS t ON t.id = ftp.parameter_id''',
+    'form_examples': '''
+        SELECT f.unit_id, ft.keyword, f.text, e.text
+        FROM examples_to_forms AS ef
+        JOIN examples AS e ON e.id = ef.example_id
+        JOIN forms AS f ON f.id = ef.form_id
+        JOIN formtypes AS ft ON ft.id = f.formtype_id''',
+}
+
+# Vocabularies that are not part of any unit subtree
+VOCABULARIES = {
+    'semfields': 'SELECT keyword, name FROM semfields',
+    'subfields': '''SELECT sf.keyword, sf.name, s.keyword
+                    FROM subfields AS sf LEFT JOIN semfields AS s ON s.id = sf.semfield_id''',
+    'sources': 'SELECT keyword, biblio FROM sources',
+    'parameters': 'SELECT keyword, name, hidden, singleval, semantic, target FROM parameters',
+    'parametervalues': '''SELECT p.keyword, pv.keyword, pv.name
+                          FROM parametervalues AS pv JOIN parameters AS p ON p.id = pv.parameter_id''',
+    'textparameters': 'SELECT keyword, name, hidden, target FROM textparameters',
+    'formtypes': 'SELECT keyword, name FROM formtypes',
+    'unitlinktypes': 'SELECT keyword, name FROM unitlinktypes',
+}
+
+MASK = (1 << 64) - 1
+
+def _plain(row):
+    """Decode texts stored compressed (see compression.py)"""
+    if any(isinstance(v, bytes) for v in row):
+        import compression
+        return [compression.decompress(v) for v in row]
+    return row
+
+def _load_dictionaries(conn: sqlite3.Connection):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'zstd_dictionaries'").fetchone():
+        import compression
+        compression.load_dictionaries(conn)
+
+def _row_hash(row) -> int:
+    data = json.dumps(row, ensure_ascii=False, separators=(',', ':')).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+def unit_keys(conn: sqlite3.Connection):
+    """Map unit ids to content keys (linker, semantic field, occurrence)"""
+    keys = {}
+    seen = defaultdict(int)
+    # Units sharing a linker and field are told apart by their subfields first, as in stable_ids.py
+    for uid, linker, semfield, _ in conn.execute('''
+            SELECT u.id, u.linker, s.keyword, (
+                SELECT group_concat(v, '; ') FROM (
+                    SELECT sf.keyword AS v FROM meanings_to_subfields AS ms JOIN subfields AS sf ON sf.id = ms.subfield_id
+                    WHERE ms.meaning_id = u.id ORDER BY sf.keyword)) AS subfields
+            FROM units AS u LEFT JOIN semfields AS s ON s.id = u.semfield_id ORDER BY subfields, u.id'''):
+        seen[(linker, semfield)] += 1
+        keys[uid] = (linker, semfield, seen[(linker, semfield)])
+    return keys
+
+def section_hashes(conn: sqlite3.Connection):
+    """Stream every section and return {unit_id: {section: hash}}"""
+    hashes = defaultdict(dict)
+    for section, sql in SECTIONS.items():
+        cur = conn.execute(sql)
+        while True:
+            rows = cur.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                h = hashes[row[0]]
+                # A sum of row hashes does not depend on the order of the rows
+                h[section] = (h.get(section, 0) + _row_hash(_plain(row[1:]))) & MASK
+    return hashes
+
+def _section_rows(conn: sqlite3.Connection, section: str, unit_ids):
+    """Content rows of one section for a batch of units"""
+    rows = defaultdict(list)
+    unit_ids = list(unit_ids)
+    for i in range(0, len(unit_ids), 500):
+        batch = unit_ids[i:i+500]
+        # The filter on the unit id column is pushed down into the joins
+        cur = conn.execute('SELECT * FROM (%s) AS q WHERE q.%s IN (%s)' % (
+            SECTIONS[section], _first_column(conn, section), ', '.join('?' * len(batch))), batch)
+        for row in cur:
+            rows[row[0]].append(list(_plain(row[1:])))
+    return rows
+
+_first_columns = {}
+
+def _first_column(conn: sqlite3.Connection, section: str) -> str:
+    if section not in _first_columns:
+        cur = conn.execute('SELECT * FROM (%s) LIMIT 0' % SECTIONS[section])
+        _first_columns[section] = cur.description[0][0]
+    return _first_columns[section]
+
+def _multiset_diff(old, new):
+    """Rows removed from old and added in new, respecting duplicates"""
+    count = defaultdict(int)
+    for row in old:
+        count[json.dumps(row, ensure_ascii=False)] += 1
+    added = []
+    for row in new:
+        k = json.dumps(row, ensure_ascii=False)
+        if count[k] > 0:
+            count[k] -= 1
+        else:
+            added.append(row)
+    removed = [json.loads(k) for k, n in count.items() for _ in range(n)]
+    return removed, added
+
+def diff_vocabularies(old: sqlite3.Connection, new: sqlite3.Connection):
+    report = {}
+    for name, sql in VOCABULARIES.items():
+        removed, added = _multiset_diff([list(r) for r in old.execute(sql)], [list(r) for r in new.execute(sql)])
+        if removed or added:
+            report[name] = {'removed': removed, 'added': added}
+    return report
+
+def diff(old: sqlite3.Connection, new: sqlite3.Connection, rows: bool = True):
+    """Compare two databases and return a change report"""
+    _load_dictionaries(old)
+    _load_dictionaries(new)
+    old_keys, new_keys = unit_keys(old), unit_keys(new)
+    old_ids = {k: i for i, k in old_keys.items()}
+    new_ids = {k: i for i, k in new_keys.items()}
+    old_hashes, new_hashes = section_hashes(old), section_hashes(new)
+
+    def entry(key, status, old_id=None, new_id=None):
+        e = {'linker': key[0], 'semfield': key[1], 'occurrence': key[2], 'status': status}
+        if old_id is not None: e['old_id'] = old_id
+        if new_id is not None: e['new_id'] = new_id
+        return e
+
+    units = []
+    changed = defaultdict(list) # section -> [(key, old_id, new_id)]
+    for key, old_id in old_ids.items():
+        if key not in new_ids:
+            units.append(entry(key, 'removed', old_id=old_id))
+            continue
+        new_id = new_ids[key]
+        oh, nh = old_hashes.get(old_id, {}), new_hashes.get(new_id, {})
+        sections = sorted(s for s in SECTIONS if oh.get(s) != nh.get(s))
+        if sections:
+            e = entry(key, 'changed', old_id, new_id)
+            e['sections'] = {s: {} for s in sections}
+            units.append(e)
+            for s in sections:
+                changed[s].append(e)
+    for key, new_id in new_ids.items():
+        if key not in old_ids:
+            units.append(entry(key, 'added', new_id=new_id))
+
+    # Drill down only into the sections that differ
+    if rows:
+        for section, entries in changed.items():
+            old_rows = _section_rows(old, section, [e['old_id'] for e in entries])
+            new_rows = _section_rows(new, section, [e['new_id'] for e in entries])
+            for e in entries:
+                removed, added = _multiset_diff(old_rows.get(e['old_id'], []), new_rows.get(e['new_id'], []))
+                e['sections'][section] = {'removed': removed, 'added': added}
+
+    summary = defaultdict(int)
+    for e in units:
+        summary[e['status']] += 1
+    sections = {s: len(entries) for s, entries in sorted(changed.items())}
+    return {
+        'summary': {'units_old': len(old_keys), 'units_new': len(new_keys),
+                    'added': summary['added'], 'removed': summary['removed'], 'changed': summary['changed'],
+                    'sections': sections},
+        'vocabularies': diff_vocabularies(old, new),
+        'units': units,
+    }
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Report structural changes between two built databases")
+    argparser.add_argument("old", help="previous build")
+    argparser.add_argument("new", help="new build")
+    argparser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    argparser.add_argument("--summary", action="store_true", help="only report which units and sections changed")
+    args = argparser.parse_args()
+
+    old = sqlite3.connect('file:%s?mode=ro' % args.old, uri=True)
+    new = sqlite3.connect('file:%s?mode=ro' % args.new, uri=True)
+    report = diff(old, new, rows=not args.summary)
+    report = {'old': args.old, 'new': args.new, **report}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=1)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+    s = report['summary']
+    print("%d units added, %d removed, %d changed" % (s['added'], s['removed'], s['changed']), file=sys.stderr)
@@ -0,0 +1,195 @@
+# Discontinuous matching of multi-component linkers (если... то, не только...
+# но и, чем... тем).
+#
+# Every unit gets one or more templates, each a sequence of components that
+# must occur in that order within one sentence:
+#
+# * the components of its linker and phonvars (если... то, и... и... и);
+# * its mainpart followed by each of its correlatives. Correlatives with
+#   correl.position=free may also come first, and дублирование repeats the
+#   mainpart;
+# * for units with parts.order=discont, the mainpart words on their own
+#   (если он бы знал), with and without the correlative.
+#
+# All components are compiled into one word-level Aho-Corasick automaton
+# (spotter.Automaton), so a sentence is read once to find every component
+# occurrence. Occurrences are then swept left to right, keeping for every
+# template only the latest partial match per component index; this keeps
+# matching linear in the length of the sentence. Complete matches are ranked
+# by a score that prefers more matched words, a correlative at the start of a
+# clause when correl.position says so, unsplit mainparts and short gaps.
+#
+#     python discontinuous.py ruslinkers-new4.db corpus.txt
+
+import re
+import sys
+import sqlite3
+import argparse
+
+from collections import namedtuple
+from typing import Iterator, List, Tuple
+
+from spotter import Automaton, Spotter, expand, NOT_PATTERNS
+
+Analysis = namedtuple('Analysis', 'unit_id spans score')
+
+SENTENCE = re.compile(r'[^.!?…]+[.!?…]*')
+CLAUSE_START = re.compile(r'(?:^|[,:;—–(-])\s*$')
+
+# Gaps are measured in characters; matches longer than this are not reported
+WINDOW = 300
+
+def _correlatives(text: str):
+    # Correlatives list alternatives with commas as well (такой, так)
+    text = text.replace('и др.', '')
+    return [v for part in text.split(',') for v in expand(part)]
+
+def templates(conn: sqlite3.Connection):
+    """(unit id, components, flags) for every way a unit can be split"""
+    order = dict(conn.execute('''
+        SELECT up.unit_id, pv.keyword FROM units_to_parametervalues AS up
+        JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id WHERE p.keyword = 'parts.order' '''))
+    forms = {}
+    for uid, formtype, text, position in conn.execute('''
+            SELECT f.unit_id, ft.keyword, f.text,
+                   (SELECT pv.keyword FROM forms_to_parametervalues AS fp
+                    JOIN parametervalues AS pv ON pv.id = fp.parametervalue_id
+                    JOIN parameters AS p ON p.id = pv.parameter_id
+                    WHERE fp.form_id = f.id AND p.keyword = 'correl.position')
+            FROM forms AS f JOIN formtypes AS ft ON ft.id = f.formtype_id
+            ORDER BY f.id'''):
+        if text is not None:
+            forms.setdefault(uid, []).append((formtype, text.strip(), position))
+    for uid, linker in conn.execute('SELECT id, linker FROM units ORDER BY id'):
+        texts = [linker] + [text for formtype, text, _ in forms.get(uid, ()) if formtype == 'phonvar']
+        for text in texts:
+            for variant in expand(text):
+                if len(variant) > 1:
+                    yield uid, tuple(variant), {}
+        mainparts = [v[0] for formtype, text, _ in forms.get(uid, ()) if formtype == 'mainpart'
+                     for v in expand(text) if len(v) == 1]
+        for formtype, text, position in forms.get(uid, ()):
+            if formtype != 'correl':
+                continue
+            for mainpart in mainparts:
+                correls = [(mainpart,)] if text in NOT_PATTERNS else _correlatives(text)
+                for correl in correls:
+                    if len(correl) != 1:
+                        continue
+                    yield uid, (mainpart, correl[0]), {'correl': 1, 'position': position}
+                    if position == 'free':
+                        yield uid, (correl[0], mainpart), {'correl': 0, 'position': position}
+                    if order.get(uid) == 'discont' and len(mainpart) > 1:
+                        yield uid, tuple((w,) for w in mainpart) + (correl[0],), \
+                            {'correl': len(mainpart), 'position': position, 'split': True}
+        if order.get(uid) == 'discont':
+            for mainpart in mainparts:
+                if len(mainpart) > 1:
+                    yield uid, tuple((w,) for w in mainpart), {'split': True}
+
+class Matcher:
+    def __init__(self, templates, window: int = WINDOW):
+        self.window = window
+        self.templates = []
+        components = {}
+        postings = {} # component id -> [(template, index)], last index first
+        seen = set()
+        for uid, sequence, flags in templates:
+            key = (uid, sequence, flags.get('correl'), flags.get('split'))
+            if key in seen:
+                continue
+            seen.add(key)
+            t = len(self.templates)
+            self.templates.append((uid, sequence, flags))
+            for i, component in enumerate(sequence):
+                cid = components.setdefault(component, len(components))
+                postings.setdefault(cid, []).append((t, i))
+        for plist in postings.values():
+            plist.sort(key=lambda p: -p[1])
+        automaton = Automaton()
+        for component, cid in components.items():
+            automaton.add(component, cid)
+        automaton.finalize()
+        self.spotter = Spotter(automaton, max(map(len, components), default=1))
+        self.postings = postings
+
+    @classmethod
+    def compile(cls, conn: sqlite3.Connection, window: int = WINDOW):
+        return cls(templates(conn), window)
+
+    def _score(self, sentence: str, base: int, t: int, spans) -> float:
+        uid, sequence, flags = self.templates[t]
+        # Every matched word outweighs the position bonus and penalties
+        score = 2.0 * sum(map(len, sequence))
+        if flags.get('position') == 'initial':
+            start = spans[flags['correl']][0] - base
+            if CLAUSE_START.search(sentence[:start]):
+                score += 1
+        if flags.get('split'):
+            score -= 0.5
+        gap = spans[-1][0] + spans[-1][1] - spans[0][0] - sum(length for _, length in spans)
+        return score - gap / self.window
+
+    def match_sentence(self, sentence: str, base: int = 0) -> List[Analysis]:
+        """All analyses of one sentence, best first"""
+        occurrences = sorted(((base + offset, length, cid) for offset, length, cid in self.spotter.scan(sentence)),
+                             key=lambda o: (o[0], -o[1]))
+        partial = {} # (template, next index) -> spans so far
+        found = {}
+        templates, postings, window = self.templates, self.postings, self.window
+        for offset, length, cid in occurrences:
+            for t, i in postings[cid]:
+                if i == 0:
+                    # The latest start gives the shortest match
+                    partial[(t, 1)] = ((offset, length),)
+                    continue
+                spans = partial.get((t, i))
+                if spans is None or spans[-1][0] + spans[-1][1] > offset or offset - spans[0][0] > window:
+                    continue
+                spans += ((offset, length),)
+                if i + 1 < len(templates[t][1]):
+                    partial[(t, i + 1)] = spans
+                    continue
+                score = self._score(sentence, base, t, spans)
+                key = (templates[t][0], spans)
+                if found.get(key, float('-inf')) < score:
+                    found[key] = score
+        analyses = [Analysis(uid, spans, score) for (uid, spans), score in found.items()]
+        return sorted(analyses, key=lambda a: (-a.score, a.spans, a.unit_id))
+
+    def match(self, text: str) -> Iterator[Tuple[Tuple[int, int], List[Analysis]]]:
+        """((offset, length) of a sentence, its analyses) for sentences with any"""
+        for m in SENTENCE.finditer(text):
+            analyses = self.match_sentence(m.group(), m.start())
+            if analyses:
+                yield (m.start(), m.end() - m.start()), analyses
+
+def best(analyses: List[Analysis]) -> List[Analysis]:
+    """Highest scoring analyses whose components do not overlap"""
+    taken = []
+    chosen = []
+    for a in analyses:
+        if any(s < e2 and s2 < e for s, e in ((o, o + n) for o, n in a.spans) for s2, e2 in taken):
+            continue
+        chosen.append(a)
+        taken.extend((o, o + n) for o, n in a.spans)
+    return chosen
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Find multi-component linkers in running text")
+    argparser.add_argument("database")
+    argparser.add_argument("text", nargs='?', help="text file to scan (default: standard input)")
+    argparser.add_argument("--all", action="store_true", help="list every analysis, not only the best ones")
+    argparser.add_argument("--window", type=int, default=WINDOW, help="longest match in characters (default: %(default)s)")
+    args = argparser.parse_args()
+
+    conn = sqlite3.connect('file:%s?mode=ro' % args.database, uri=True)
+    matcher = Matcher.compile(conn, args.window)
+    linkers = dict(conn.execute('SELECT id, linker FROM units'))
+    text = open(args.text).read() if args.text else sys.stdin.read()
+    for (offset, length), analyses in matcher.match(text):
+        print(text[offset:offset + length].strip())
+        for a in (analyses if args.all else best(analyses)):
+            print("  %6.2f  %d %s: %s" % (a.score, a.unit_id, linkers[a.unit_id],
+                                          ' ... '.join(text[o:o + n] for o, n in a.spans)))
@@ -0,0 +1,258 @@
+# Full dump of a built database as one JSON document per unit (NDJSON).
+#
+# Every document holds the whole unit subtree:
+#
+#   {"id": ..., "linker": ..., "status": ..., "style": ..., "sem_comment": ...,
+#    "semfield": ..., "extra_semfields": [...], "subfields": [...], "sources": [...],
+#    "parameters": [{"parameter", "value", "examples", "comments"}, ...],
+#    "textparameters": {keyword: value},
+#    "forms": [{"id", "type", "text", "parameters", "textparameters", "examples"}, ...],
+#    "examples": [{"id", "text"}, ...], "comments": [{"id", "text", "hidden"}, ...],
+#    "meanings": {source: [{"id", "meaning", "pos", ...}, ...]},
+#    "links": [{"type", "target", "linker"}, ...]}
+#
+# Units are dumped in batches: the ids of the next batch go into a temporary
+# table and every section below is one query joining it to the unit-side
+# indexes (see models.py), so memory is bounded by the batch size and the
+# cost of a unit does not grow with the size of the database. Hidden comments
+# are left out unless --hidden is given.
+#
+# The output is compressed by its suffix: .gz with gzip, .zst with zstandard.
+# With --since-build only the units added or changed since an earlier build
+# are written, as matched by dbdiff.py, followed by {"id": ..., "deleted": true}
+# for every unit of the earlier build that is gone.
+#
+#     python dump.py ruslinkers-new4.db -o ruslinkers.ndjson.gz
+#     python dump.py ruslinkers-new4.db --since-build ruslinkers-old.db -o changes.ndjson
+
+import io
+import sys
+import json
+import time
+import gzip
+import sqlite3
+import argparse
+
+import db
+import dbdiff
+
+BATCH = 500
+
+# Every query returns the unit id first; {hidden} filters out hidden comments.
+# CROSS JOIN keeps the batch as the outer loop, which SQLite would otherwise
+# not know to be small
+SECTIONS = {
+    'unit': '''
+        SELECT u.id, u.linker, u.status, u.style, plain(u.sem_comment), s.keyword
+        FROM temp.dump_units AS b CROSS JOIN units AS u ON u.id = b.id
+        LEFT JOIN semfields AS s ON s.id = u.semfield_id''',
+    'extra_semfields': '''
+        SELECT us.unit_id, s.keyword
+        FROM temp.dump_units AS b CROSS JOIN units_to_semfields AS us ON us.unit_id = b.id
+        JOIN semfields AS s ON s.id = us.semfield_id ORDER BY b.id, s.keyword''',
+    # Unit.subfields is mapped onto the meanings_to_subfields table
+    'subfields': '''
+        SELECT ms.meaning_id, s.keyword
+        FROM temp.dump_units AS b CROSS JOIN meanings_to_subfields AS ms ON ms.meaning_id = b.id
+        JOIN subfields AS s ON s.id = ms.subfield_id ORDER BY b.id, s.keyword''',
+    'sources': '''
+        SELECT su.unit_id, s.keyword
+        FROM temp.dump_units AS b CROSS JOIN sources_to_units AS su ON su.unit_id = b.id
+        JOIN sources AS s ON s.id = su.source_id ORDER BY b.id, s.keyword''',
+    'parametervalues': '''
+        SELECT up.unit_id, up.parametervalue_id, p.keyword, pv.keyword
+        FROM temp.dump_units AS b CROSS JOIN units_to_parametervalues AS up ON up.unit_id = b.id
+        JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id ORDER BY b.id, p.keyword, pv.keyword''',
+    'parametervalue_examples': '''
+        SELECT ep.unit_id, ep.parametervalue_id, e.id, plain(e.text)
+        FROM temp.dump_units AS b CROSS JOIN examples_to_unit_parametervalues AS ep ON ep.unit_id = b.id
+        JOIN examples AS e ON e.id = ep.example_id ORDER BY b.id, e.id''',
+    'parametervalue_comments': '''
+        SELECT cp.unit_id, cp.parametervalue_id, c.id, plain(c.text), c.hidden
+        FROM temp.dump_units AS b CROSS JOIN comments_to_unit_parametervalues AS cp ON cp.unit_id = b.id
+        JOIN comments AS c ON c.id = cp.comment_id{hidden} ORDER BY b.id, c.id''',
+    'textparameters': '''
+        SELECT ut.unit_id, t.keyword, ut.value
+        FROM temp.dump_units AS b CROSS JOIN units_to_textparametervalues AS ut ON ut.unit_id = b.id
+        JOIN textparameters AS t ON t.id = ut.parameter_id ORDER BY b.id, t.keyword''',
+    'examples': '''
+        SELECT eu.unit_id, e.id, plain(e.text)
+        FROM temp.dump_units AS b CROSS JOIN examples_to_units AS eu ON eu.unit_id = b.id
+        JOIN examples AS e ON e.id = eu.example_id ORDER BY b.id, e.id''',
+    'comments': '''
+        SELECT cu.unit_id, c.id, plain(c.text), c.hidden
+        FROM temp.dump_units AS b CROSS JOIN comments_to_units AS cu ON cu.unit_id = b.id
+        JOIN comments AS c ON c.id = cu.comment_id{hidden} ORDER BY b.id, c.id''',
+    'meanings': '''
+        SELECT m.unit_id, s.keyword, m.id, plain(m.meaning), m.pos, m.pos_type, m.other_senses, m.other_pos
+        FROM temp.dump_units AS b CROSS JOIN meanings AS m ON m.unit_id = b.id
+        LEFT JOIN sources AS s ON s.id = m.source_id ORDER BY b.id, m.id''',
+    'links': '''
+        SELECT l.source_id, lt.keyword, l.target_id, t.linker
+        FROM temp.dump_units AS b CROSS JOIN units_to_units AS l ON l.source_id = b.id
+        JOIN unitlinktypes AS lt ON lt.id = l.unitlinktype_id
+        JOIN units AS t ON t.id = l.target_id ORDER BY b.id, lt.keyword, t.linker''',
+    'forms': '''
+        SELECT f.unit_id, f.id, ft.keyword, f.text
+        FROM temp.dump_units AS b CROSS JOIN forms AS f ON f.unit_id = b.id
+        JOIN formtypes AS ft ON ft.id = f.formtype_id ORDER BY b.id, f.id''',
+    'form_parametervalues': '''
+        SELECT f.unit_id, fp.form_id, fp.parametervalue_id, p.keyword, pv.keyword
+        FROM temp.dump_units AS b CROSS JOIN forms AS f ON f.unit_id = b.id
+        CROSS JOIN forms_to_parametervalues AS fp ON fp.form_id = f.id
+        JOIN parametervalues AS pv ON pv.id = fp.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id ORDER BY b.id, f.id, p.keyword, pv.keyword''',
+    'form_parametervalue_examples': '''
+        SELECT f.unit_id, ep.form_id, ep.parametervalue_id, e.id, plain(e.text)
+        FROM temp.dump_units AS b CROSS JOIN forms AS f ON f.unit_id = b.id
+        CROSS JOIN examples_to_form_parametervalues AS ep ON ep.form_id = f.id
+        JOIN examples AS e ON e.id = ep.example_id ORDER BY b.id, f.id, e.id''',
+    'form_parametervalue_comments': '''
+        SELECT f.unit_id, cp.form_id, cp.parametervalue_id, c.id, plain(c.text), c.hidden
+        FROM temp.dump_units AS b CROSS JOIN forms AS f ON f.unit_id = b.id
+        CROSS JOIN comments_to_form_parametervalues AS cp ON cp.form_id = f.id
+        JOIN comments AS c ON c.id = cp.comment_id{hidden} ORDER BY b.id, f.id, c.id''',
+    'form_textparameters': '''
+        SELECT f.unit_id, ftp.form_id, t.keyword, ftp.value
+        FROM temp.dump_units AS b CROSS JOIN forms AS f ON f.unit_id = b.id
+        CROSS JOIN forms_to_textparametervalues AS ftp ON ftp.form_id = f.id
+        JOIN textparameters AS t ON t.id = ftp.parameter_id ORDER BY b.id, f.id, t.keyword''',
+    'form_examples': '''
+        SELECT f.unit_id, ef.form_id, e.id, plain(e.text)
+        FROM temp.dump_units AS b CROSS JOIN forms AS f ON f.unit_id = b.id
+        CROSS JOIN examples_to_forms AS ef ON ef.form_id = f.id
+        JOIN examples AS e ON e.id = ef.example_id ORDER BY b.id, f.id, e.id''',
+}
+
+def _sections(hidden: bool = False):
+    where = '' if hidden else ' AND NOT c.hidden'
+    return {name: sql.replace('{hidden}', where) for name, sql in SECTIONS.items()}
+
+def batches(conn: sqlite3.Connection, size: int = BATCH, only=None):
+    """Fill temp.dump_units with successive batches of unit ids and yield each batch"""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS dump_units (id INTEGER PRIMARY KEY)')
+    if only is not None:
+        only = sorted(only)
+    last, start = None, 0
+    while True:
+        if only is None:
+            ids = [i for i, in conn.execute('SELECT id FROM units WHERE id > ? ORDER BY id LIMIT ?',
+                                            (-1 if last is None else last, size))]
+        else:
+            ids, start = only[start:start + size], start + size
+        if not ids:
+            break
+        conn.execute('DELETE FROM temp.dump_units')
+        conn.executemany('INSERT INTO temp.dump_units VALUES (?)', ((i,) for i in ids))
+        yield ids
+        last = ids[-1]
+
+def documents(conn: sqlite3.Connection, sections):
+    """Documents of the units in temp.dump_units, in id order"""
+    docs = {}
+    for uid, linker, status, style, sem_comment, semfield in conn.execute(sections['unit']):
+        docs[uid] = {'id': uid, 'linker': linker, 'status': bool(status), 'style': style,
+                     'sem_comment': sem_comment, 'semfield': semfield, 'extra_semfields': [], 'subfields': [],
+                     'sources': [], 'parameters': [], 'textparameters': {}, 'forms': [], 'examples': [],
+                     'comments': [], 'meanings': {}, 'links': []}
+    for name in ('extra_semfields', 'subfields', 'sources'):
+        for uid, keyword in conn.execute(sections[name]):
+            docs[uid][name].append(keyword)
+
+    values = {} # (unit id, parameter value id) -> entry of parameters
+    for uid, pv_id, parameter, value in conn.execute(sections['parametervalues']):
+        values[uid, pv_id] = {'parameter': parameter, 'value': value, 'examples': [], 'comments': []}
+        docs[uid]['parameters'].append(values[uid, pv_id])
+    for uid, pv_id, eid, text in conn.execute(sections['parametervalue_examples']):
+        values[uid, pv_id]['examples'].append({'id': eid, 'text': text})
+    for uid, pv_id, cid, text, hidden in conn.execute(sections['parametervalue_comments']):
+        values[uid, pv_id]['comments'].append({'id': cid, 'text': text, 'hidden': bool(hidden)})
+    for uid, keyword, value in conn.execute(sections['textparameters']):
+        docs[uid]['textparameters'][keyword] = value
+    for uid, eid, text in conn.execute(sections['examples']):
+        docs[uid]['examples'].append({'id': eid, 'text': text})
+    for uid, cid, text, hidden in conn.execute(sections['comments']):
+        docs[uid]['comments'].append({'id': cid, 'text': text, 'hidden': bool(hidden)})
+    for uid, source, mid, meaning, pos, pos_type, other_senses, other_pos in conn.execute(sections['meanings']):
+        docs[uid]['meanings'].setdefault(source, []).append({
+            'id': mid, 'meaning': meaning, 'pos': pos, 'pos_type': pos_type,
+            'other_senses': other_senses, 'other_pos': other_pos})
+    for uid, linktype, target, linker in conn.execute(sections['links']):
+        docs[uid]['links'].append({'type': linktype, 'target': target, 'linker': linker})
+
+    forms = {}
+    for uid, fid, formtype, text in conn.execute(sections['forms']):
+        forms[fid] = {'id': fid, 'type': formtype, 'text': text, 'parameters': [], 'textparameters': {},
+                      'examples': []}
+        docs[uid]['forms'].append(forms[fid])
+    values = {}
+    for _, fid, pv_id, parameter, value in conn.execute(sections['form_parametervalues']):
+        values[fid, pv_id] = {'parameter': parameter, 'value': value, 'examples': [], 'comments': []}
+        forms[fid]['parameters'].append(values[fid, pv_id])
+    for _, fid, pv_id, eid, text in conn.execute(sections['form_parametervalue_examples']):
+        values[fid, pv_id]['examples'].append({'id': eid, 'text': text})
+    for _, fid, pv_id, cid, text, hidden in conn.execute(sections['form_parametervalue_comments']):
+        values[fid, pv_id]['comments'].append({'id': cid, 'text': text, 'hidden': bool(hidden)})
+    for _, fid, keyword, value in conn.execute(sections['form_textparameters']):
+        forms[fid]['textparameters'][keyword] = value
+    for _, fid, eid, text in conn.execute(sections['form_examples']):
+        forms[fid]['examples'].append({'id': eid, 'text': text})
+    return [docs[uid] for uid in sorted(docs)]
+
+def changes_since(old: sqlite3.Connection, new: sqlite3.Connection):
+    """(ids of the units of new added or changed since old, removed units of old as tombstones)"""
+    report = dbdiff.diff(old, new, rows=False)
+    changed = [u['new_id'] for u in report['units'] if u['status'] != 'removed']
+    removed = [{'id': u['old_id'], 'linker': u['linker'], 'semfield': u['semfield'], 'deleted': True}
+               for u in report['units'] if u['status'] == 'removed']
+    return changed, sorted(removed, key=lambda u: u['id'])
+
+def dump(conn: sqlite3.Connection, out, size: int = BATCH, only=None, hidden: bool = False) -> int:
+    """Write the documents of all units, or of the ids in only, to a text stream; returns their number"""
+    sections = _sections(hidden)
+    count = 0
+    for _ in batches(conn, size, only):
+        for doc in documents(conn, sections):
+            out.write(json.dumps(doc, ensure_ascii=False))
+            out.write('\n')
+            count += 1
+    return count
+
+def open_output(path: str):
+    """Text stream for path, compressed according to its suffix; stdout for None or -"""
+    if path is None or path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if path.endswith('.zst'):
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, 'wb')), encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Dump every unit of a built database as one JSON document per line")
+    argparser.add_argument("database")
+    argparser.add_argument("-o", "--output", help="output file, compressed if it ends in .gz or .zst (default: stdout)")
+    argparser.add_argument("--since-build", metavar="OLD", help="only dump the units added or changed since this build")
+    argparser.add_argument("--hidden", action="store_true", help="include hidden comments")
+    argparser.add_argument("--batch", type=int, default=BATCH, help="units per batch (default: %(default)s)")
+    args = argparser.parse_args()
+
+    conn = db.connect(args.database)
+    only, removed = None, []
+    if args.since_build:
+        old = sqlite3.connect('file:%s?mode=ro' % args.since_build, uri=True)
+        only, removed = changes_since(old, conn)
+        old.close()
+    start = time.perf_counter()
+    out = open_output(args.output)
+    count = dump(conn, out, args.batch, only, args.hidden)
+    for tombstone in removed:
+        out.write(json.dumps(tombstone, ensure_ascii=False))
+        out.write('\n')
+    if out is not sys.stdout:
+        out.close()
+    elapsed = time.perf_counter() - start
+    print("%d units, %d deleted in %.2f s (%.0f units/s)" % (count, len(removed), elapsed, count / elapsed if elapsed else 0),
+          file=sys.stderr)
@@ -0,0 +1,364 @@
+# Batched edits of a built database.
+#
+# Editing through the ORM changes one row at a time: every mapping row fires
+# the validation triggers of models.py (single-valued parameters, unit and
+# form targets, form types) and the parametermap triggers, and every change
+# is committed on its own. apply() takes a whole batch instead. The changes
+# are staged in temp tables, the rules of the triggers are checked for all of
+# them with a few set-based queries, and the batch is applied in one
+# transaction with the triggers dropped (stable_ids.without_triggers), after
+# which the parameter maps of the touched units and forms are recomputed in
+# one statement each.
+#
+# A change is a dict (a JSON line on the command line):
+#
+#   {"op": "set", "unit": 507, "parameter": "parts.order", "value": "fixed"}
+#   {"op": "remove", "form": 9001, "parameter": "correl.position", "value": "pre"}
+#   {"op": "add_example", "unit": 507, "text": "...", "parameter": "parts.order", "value": "fixed"}
+#   {"op": "retarget", "unit": 507, "target": 93, "new_target": 94}
+#   {"op": "add_form", "unit": 507, "formtype": "correl", "text": "то", "values": {"correl.position": ["pre"]}}
+#
+# set replaces the value of a single-valued parameter and adds a value to a
+# multi-valued one. remove drops a value, or every value of the parameter if
+# "value" is left out; the examples and comments attached to a dropped value
+# are detached from it. add_example can attach the new example to a value of
+# the unit. retarget moves a link of the unit ("type", a hyperlink by
+# default) to another unit. New forms and examples get ids derived from their
+# content as in stable_ids.py if the database has stable ids.
+#
+# The report has one error per rejected change, by its index in the batch.
+# A batch with errors is not applied at all, unless partial=True, which
+# applies the other changes. Derived tables (example_highlights, unit_fields,
+# browse_keys, example_duplicates, comment_duplicates) are left as they
+# are; compressed databases are not edited.
+#
+#     python edits.py apply ruslinkers-new4.db changes.jsonl --partial
+#     python edits.py bench ruslinkers-new4.db --parameter parts.order
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+from typing import List, Tuple
+
+from models import parametermap_select
+from releases import KEYS
+from stable_ids import ID_BASE, ID_LIMIT, _hash_id, without_triggers
+
+# owner table: (mapping table, owner column, parameter target, tables attaching examples and comments to a value)
+OWNERS = {
+    'units': ('units_to_parametervalues', 'unit_id', 1,
+              ('examples_to_unit_parametervalues', 'comments_to_unit_parametervalues')),
+    'forms': ('forms_to_parametervalues', 'form_id', 2,
+              ('examples_to_form_parametervalues', 'comments_to_form_parametervalues')),
+}
+
+STAGING = '''
+CREATE TEMP TABLE IF NOT EXISTS edit_values (
+    n INTEGER NOT NULL, owner TEXT NOT NULL, owner_id INTEGER, form_n INTEGER, parameter TEXT NOT NULL, value TEXT,
+    remove INTEGER NOT NULL, parameter_id INTEGER, parametervalue_id INTEGER, singleval INTEGER, target INTEGER);
+CREATE TEMP TABLE IF NOT EXISTS edit_examples (
+    n INTEGER PRIMARY KEY, unit_id INTEGER NOT NULL, text TEXT NOT NULL, parameter TEXT, value TEXT,
+    parametervalue_id INTEGER, example_id INTEGER);
+CREATE TEMP TABLE IF NOT EXISTS edit_links (
+    n INTEGER PRIMARY KEY, source_id INTEGER NOT NULL, target_id INTEGER NOT NULL, new_target_id INTEGER NOT NULL,
+    type TEXT NOT NULL, unitlinktype_id INTEGER);
+CREATE TEMP TABLE IF NOT EXISTS edit_forms (
+    n INTEGER PRIMARY KEY, unit_id INTEGER NOT NULL, formtype TEXT NOT NULL, text TEXT NOT NULL,
+    formtype_id INTEGER, form_id INTEGER);
+CREATE TEMP TABLE IF NOT EXISTS edit_errors (n INTEGER NOT NULL, message TEXT NOT NULL);
+CREATE TEMP TABLE IF NOT EXISTS edit_removed (
+    owner TEXT NOT NULL, owner_id INTEGER NOT NULL, parametervalue_id INTEGER NOT NULL,
+    PRIMARY KEY (owner, owner_id, parametervalue_id));
+'''
+
+RESOLVE = [
+    '''UPDATE temp.edit_values SET (parameter_id, singleval, target) =
+       (SELECT id, singleval, CAST(target AS INTEGER) FROM parameters WHERE keyword = parameter)''',
+    '''UPDATE temp.edit_values SET parametervalue_id =
+       (SELECT id FROM parametervalues WHERE parameter_id = edit_values.parameter_id AND keyword = value)''',
+    '''UPDATE temp.edit_examples SET parametervalue_id =
+       (SELECT pv.id FROM parametervalues AS pv JOIN parameters AS p ON p.id = pv.parameter_id
+        WHERE p.keyword = parameter AND pv.keyword = value)''',
+    '''UPDATE temp.edit_links SET unitlinktype_id = (SELECT id FROM unitlinktypes WHERE keyword = type)''',
+    '''UPDATE temp.edit_forms SET formtype_id = (SELECT id FROM formtypes WHERE keyword = formtype)''',
+]
+
+# Every query gives (change, message); the rules of the triggers are the last ones
+CHECKS = [
+    '''SELECT n, 'no unit ' || owner_id FROM temp.edit_values
+       WHERE owner = 'units' AND owner_id NOT IN (SELECT id FROM units)''',
+    '''SELECT n, 'no form ' || owner_id FROM temp.edit_values
+       WHERE owner = 'forms' AND form_n IS NULL AND owner_id NOT IN (SELECT id FROM forms)''',
+    '''SELECT n, 'no unit ' || unit_id FROM temp.edit_examples WHERE unit_id NOT IN (SELECT id FROM units)''',
+    '''SELECT n, 'no unit ' || unit_id FROM temp.edit_forms WHERE unit_id NOT IN (SELECT id FROM units)''',
+    '''SELECT n, 'no unit ' || new_target_id FROM temp.edit_links WHERE new_target_id NOT IN (SELECT id FROM units)''',
+    '''SELECT n, 'no parameter ' || parameter FROM temp.edit_values WHERE parameter_id IS NULL''',
+    '''SELECT n, 'no value ' || value || ' of parameter ' || parameter FROM temp.edit_values
+       WHERE parameter_id IS NOT NULL AND value IS NOT NULL AND parametervalue_id IS NULL''',
+    '''SELECT n, 'no value ' || value || ' of parameter ' || parameter FROM temp.edit_examples
+       WHERE parameter IS NOT NULL AND parametervalue_id IS NULL''',
+    '''SELECT n, 'no link type ' || type FROM temp.edit_links WHERE unitlinktype_id IS NULL''',
+    '''SELECT n, 'no form type ' || formtype FROM temp.edit_forms WHERE formtype_id IS NULL''',
+    '''SELECT l.n, 'no ' || l.type || ' from unit ' || l.source_id || ' to unit ' || l.target_id FROM temp.edit_links AS l
+       WHERE l.unitlinktype_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM units_to_units AS uu
+           WHERE uu.source_id = l.source_id AND uu.target_id = l.target_id AND uu.unitlinktype_id = l.unitlinktype_id)''',
+    '''SELECT l.n, 'unit ' || l.source_id || ' already has a ' || l.type || ' to unit ' || l.new_target_id
+       FROM temp.edit_links AS l WHERE EXISTS (SELECT 1 FROM units_to_units AS uu
+           WHERE uu.source_id = l.source_id AND uu.target_id = l.new_target_id AND uu.unitlinktype_id = l.unitlinktype_id)''',
+    '''SELECT l.n, 'another change retargets the same ' || l.type || ' or to the same unit' FROM temp.edit_links AS l
+       WHERE EXISTS (SELECT 1 FROM temp.edit_links AS o WHERE o.n != l.n AND o.source_id = l.source_id
+           AND o.unitlinktype_id = l.unitlinktype_id AND (o.target_id = l.target_id OR o.new_target_id = l.new_target_id))''',
+    '''SELECT v.n, 'parameter ' || v.parameter || ' does not classify units' FROM temp.edit_values AS v
+       WHERE v.owner = 'units' AND v.target != 1''',
+    '''SELECT v.n, 'parameter ' || v.parameter || ' does not classify forms' FROM temp.edit_values AS v
+       WHERE v.owner = 'forms' AND v.target != 2''',
+    '''SELECT v.n, 'parameter ' || v.parameter || ' does not apply to the form type' FROM temp.edit_values AS v
+       WHERE v.owner = 'forms' AND NOT v.remove AND v.parameter_id IS NOT NULL AND NOT EXISTS (
+           SELECT 1 FROM parameters_to_formtypes AS pft WHERE pft.parameter_id = v.parameter_id AND pft.formtype_id IN (
+               SELECT formtype_id FROM forms WHERE id = v.owner_id UNION ALL
+               SELECT formtype_id FROM temp.edit_forms WHERE n = v.form_n))''',
+    '''SELECT v.n, 'more than one value of the single-valued parameter ' || v.parameter FROM temp.edit_values AS v
+       WHERE NOT v.remove AND v.singleval AND EXISTS (SELECT 1 FROM temp.edit_values AS o
+           WHERE o.owner = v.owner AND o.owner_id IS v.owner_id AND o.form_n IS v.form_n AND NOT o.remove
+           AND o.parameter_id = v.parameter_id AND o.parametervalue_id != v.parametervalue_id)''',
+] + [
+    '''SELECT v.n, v.parameter || ' ' || IFNULL(v.value, '') || ' is not set' FROM temp.edit_values AS v
+       WHERE v.owner = '%s' AND v.remove AND v.parameter_id IS NOT NULL AND NOT EXISTS (
+           SELECT 1 FROM %s AS m JOIN parametervalues AS pv ON pv.id = m.parametervalue_id
+           WHERE m.%s = v.owner_id AND pv.parameter_id = v.parameter_id
+           AND (v.parametervalue_id IS NULL OR m.parametervalue_id = v.parametervalue_id))''' % (owner, mapping, column)
+    for owner, (mapping, column, _, _) in OWNERS.items()
+]
+
+OK = 'n NOT IN (SELECT n FROM temp.edit_errors)'
+
+# Values dropped by the accepted changes: removed, or replaced in a single-valued parameter
+REMOVED = '''
+    INSERT OR IGNORE INTO temp.edit_removed
+    SELECT '%s', m.%s, m.parametervalue_id FROM %s AS m
+    JOIN parametervalues AS pv ON pv.id = m.parametervalue_id
+    JOIN temp.edit_values AS v ON v.owner = '%s' AND v.owner_id = m.%s AND v.parameter_id = pv.parameter_id
+    WHERE v.n NOT IN (SELECT n FROM temp.edit_errors)
+    AND (v.remove AND (v.parametervalue_id IS NULL OR v.parametervalue_id = m.parametervalue_id)
+         OR NOT v.remove AND v.singleval AND m.parametervalue_id != v.parametervalue_id)'''
+
+# A value an example is attached to has to be set on the unit once the batch is applied
+EXAMPLE_VALUES = '''
+    SELECT e.n, e.parameter || ' ' || e.value || ' is not set on unit ' || e.unit_id FROM temp.edit_examples AS e
+    WHERE e.parametervalue_id IS NOT NULL AND e.n NOT IN (SELECT n FROM temp.edit_errors) AND NOT (
+        EXISTS (SELECT 1 FROM units_to_parametervalues AS m WHERE m.unit_id = e.unit_id AND m.parametervalue_id = e.parametervalue_id)
+        AND NOT EXISTS (SELECT 1 FROM temp.edit_removed AS r
+                        WHERE r.owner = 'units' AND r.owner_id = e.unit_id AND r.parametervalue_id = e.parametervalue_id)
+        OR EXISTS (SELECT 1 FROM temp.edit_values AS v WHERE v.owner = 'units' AND v.owner_id = e.unit_id AND NOT v.remove
+                   AND v.parametervalue_id = e.parametervalue_id AND v.n NOT IN (SELECT n FROM temp.edit_errors)))'''
+
+def _stage(conn: sqlite3.Connection, changes) -> List[Tuple[int, str]]:
+    """Fill the temp tables; returns the errors of malformed changes"""
+    errors = []
+    values, examples, links, forms = [], [], [], []
+    for n, change in enumerate(changes):
+        op = change.get('op') if isinstance(change, dict) else None
+        try:
+            if op in ('set', 'remove'):
+                owner = 'units' if 'unit' in change else 'forms'
+                owner_id = int(change['unit'] if 'unit' in change else change['form'])
+                value = change.get('value') if op == 'remove' else change['value']
+                values.append((n, owner, owner_id, None, change['parameter'], value, op == 'remove'))
+            elif op == 'add_example':
+                if not change['text'].strip():
+                    raise ValueError("empty text")
+                examples.append((n, int(change['unit']), change['text'], change.get('parameter'), change.get('value')))
+            elif op == 'retarget':
+                links.append((n, int(change['unit']), int(change['target']), int(change['new_target']),
+                              change.get('type', 'hyperlink')))
+            elif op == 'add_form':
+                forms.append((n, int(change['unit']), change['formtype'], change['text']))
+                for parameter, vals in change.get('values', {}).items():
+                    values.extend((n, 'forms', None, n, parameter, value, False) for value in vals)
+            else:
+                errors.append((n, "unknown operation %s" % op))
+        except KeyError as e:
+            errors.append((n, "%s needs %s" % (op, e.args[0])))
+        except (TypeError, ValueError, AttributeError) as e:
+            errors.append((n, "malformed %s: %s" % (op, e)))
+    conn.executescript(STAGING)
+    for table in ('edit_values', 'edit_examples', 'edit_links', 'edit_forms', 'edit_errors', 'edit_removed'):
+        conn.execute('DELETE FROM temp.%s' % table)
+    conn.executemany('INSERT INTO temp.edit_values (n, owner, owner_id, form_n, parameter, value, remove) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)', values)
+    conn.executemany('INSERT INTO temp.edit_examples (n, unit_id, text, parameter, value) VALUES (?, ?, ?, ?, ?)', examples)
+    conn.executemany('INSERT INTO temp.edit_links (n, source_id, target_id, new_target_id, type) VALUES (?, ?, ?, ?, ?)', links)
+    conn.executemany('INSERT INTO temp.edit_forms (n, unit_id, formtype, text) VALUES (?, ?, ?, ?)', forms)
+    return errors
+
+def _new_ids(conn: sqlite3.Connection, table: str, rows):
+    """[(change, id)] for new rows of table given as (change, {column: value}) in batch order"""
+    stable = (conn.execute('SELECT MIN(id) FROM %s' % table).fetchone()[0] or ID_BASE) >= ID_BASE
+    next_id = (conn.execute('SELECT MAX(id) FROM %s' % table).fetchone()[0] or 0) + 1
+    keycols = KEYS[table]
+    seen, used, ids = {}, set(), []
+    for n, row in rows:
+        if not stable:
+            ids.append((n, next_id))
+            next_id += 1
+            continue
+        # As in stable_ids.assign_ids: the key, and the occurrence among rows with the same key
+        key = tuple(row[c] for c in keycols)
+        if key not in seen:
+            seen[key] = conn.execute('SELECT COUNT(*) FROM %s WHERE %s' % (
+                table, ' AND '.join('%s = ?' % c for c in keycols)), key).fetchone()[0]
+        seen[key] += 1
+        new = _hash_id(table, key + (seen[key],))
+        while new in used or conn.execute('SELECT 1 FROM %s WHERE id = ?' % table, (new,)).fetchone():
+            new = new + 1 if new + 1 < ID_LIMIT else ID_BASE
+        used.add(new)
+        ids.append((n, new))
+    return ids
+
+def _apply(conn: sqlite3.Connection):
+    for owner, (mapping, column, _, attached) in OWNERS.items():
+        removed = 'SELECT owner_id, parametervalue_id FROM temp.edit_removed WHERE owner = \'%s\'' % owner
+        for table in (mapping,) + attached:
+            conn.execute('DELETE FROM %s WHERE (%s, parametervalue_id) IN (%s)' % (table, column, removed))
+    conn.execute('''INSERT INTO forms (id, unit_id, formtype_id, text, parametermap)
+                    SELECT form_id, unit_id, formtype_id, text, '{}' FROM temp.edit_forms WHERE %s ORDER BY n''' % OK)
+    for owner, (mapping, column, _, _) in OWNERS.items():
+        conn.execute('''INSERT OR IGNORE INTO %s (%s, parametervalue_id)
+                        SELECT owner_id, parametervalue_id FROM temp.edit_values
+                        WHERE owner = '%s' AND NOT remove AND %s ORDER BY n''' % (mapping, column, owner, OK))
+    conn.execute('INSERT INTO examples (id, text) SELECT example_id, text FROM temp.edit_examples WHERE %s ORDER BY n' % OK)
+    conn.execute('INSERT INTO examples_to_units (example_id, unit_id) SELECT example_id, unit_id FROM temp.edit_examples WHERE %s' % OK)
+    conn.execute('''INSERT INTO examples_to_unit_parametervalues (example_id, unit_id, parametervalue_id)
+                    SELECT example_id, unit_id, parametervalue_id FROM temp.edit_examples
+                    WHERE parametervalue_id IS NOT NULL AND %s''' % OK)
+    conn.execute('''UPDATE units_to_units SET target_id = (
+                        SELECT l.new_target_id FROM temp.edit_links AS l WHERE l.source_id = units_to_units.source_id
+                        AND l.target_id = units_to_units.target_id AND l.unitlinktype_id = units_to_units.unitlinktype_id)
+                    WHERE (source_id, target_id, unitlinktype_id) IN (
+                        SELECT source_id, target_id, unitlinktype_id FROM temp.edit_links WHERE %s)''' % OK)
+    for owner, (mapping, column, _, _) in OWNERS.items():
+        conn.execute('UPDATE %s SET parametermap = %s WHERE id IN (SELECT owner_id FROM temp.edit_values WHERE owner = \'%s\' AND %s)' % (
+            owner, parametermap_select(mapping, column, '%s.id' % owner), owner, OK))
+
+def apply(conn: sqlite3.Connection, changes, partial: bool = False):
+    """(number of changes applied, [(change index, error), ...]); nothing is applied if there are errors, unless partial"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'zstd_dictionaries'").fetchone():
+        raise ValueError("compressed databases cannot be edited; edit the database they were made from")
+    changes = list(changes)
+    try:
+        errors = _stage(conn, changes)
+        conn.executemany('INSERT INTO temp.edit_errors VALUES (?, ?)', errors)
+        for sql in RESOLVE:
+            conn.execute(sql)
+        for sql in CHECKS:
+            conn.execute('INSERT INTO temp.edit_errors ' + sql)
+        for owner, (mapping, column, _, _) in OWNERS.items():
+            conn.execute(REMOVED % (owner, column, mapping, owner, column))
+        conn.execute('INSERT INTO temp.edit_errors ' + EXAMPLE_VALUES)
+        errors = conn.execute('SELECT n, message FROM temp.edit_errors ORDER BY n, rowid').fetchall()
+        rejected = {n for n, _ in errors}
+        if rejected and not partial or len(rejected) == len(changes):
+            conn.rollback()
+            return 0, errors
+
+        forms = conn.execute('SELECT n, unit_id, formtype_id, text FROM temp.edit_forms WHERE %s ORDER BY n' % OK).fetchall()
+        conn.executemany('UPDATE temp.edit_forms SET form_id = ? WHERE n = ?', [(i, n) for n, i in _new_ids(
+            conn, 'forms', [(n, {'unit_id': u, 'formtype_id': f, 'text': t}) for n, u, f, t in forms])])
+        conn.execute('UPDATE temp.edit_values SET owner_id = (SELECT form_id FROM temp.edit_forms WHERE n = form_n) '
+                     'WHERE form_n IS NOT NULL')
+        examples = conn.execute('SELECT n, text FROM temp.edit_examples WHERE %s ORDER BY n' % OK).fetchall()
+        conn.executemany('UPDATE temp.edit_examples SET example_id = ? WHERE n = ?', [(i, n) for n, i in _new_ids(
+            conn, 'examples', [(n, {'text': t}) for n, t in examples])])
+
+        with without_triggers(conn):
+            _apply(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(changes) - len(rejected), errors
+
+def _per_row(conn: sqlite3.Connection, changes):
+    """The batch applied one change and one commit at a time with the triggers, as the ORM does (set only)"""
+    for change in changes:
+        pv_id, parameter_id, singleval = conn.execute('''
+            SELECT pv.id, p.id, p.singleval FROM parametervalues AS pv JOIN parameters AS p ON p.id = pv.parameter_id
+            WHERE p.keyword = ? AND pv.keyword = ?''', (change['parameter'], change['value'])).fetchone()
+        if singleval:
+            conn.execute('''DELETE FROM units_to_parametervalues WHERE unit_id = ? AND parametervalue_id IN (
+                            SELECT id FROM parametervalues WHERE parameter_id = ? AND id != ?)''',
+                         (change['unit'], parameter_id, pv_id))
+        conn.execute('INSERT OR IGNORE INTO units_to_parametervalues (unit_id, parametervalue_id) VALUES (?, ?)',
+                     (change['unit'], pv_id))
+        conn.commit()
+
+def bench(path: str, parameter: str):
+    """Time a re-annotation of one parameter on every unit, one change at a time and as one batch"""
+    conn = sqlite3.connect(path)
+    values = [v for v, in conn.execute('''SELECT pv.keyword FROM parametervalues AS pv JOIN parameters AS p
+                                          ON p.id = pv.parameter_id WHERE p.keyword = ? ORDER BY pv.id''', (parameter,))]
+    if not values:
+        raise KeyError(parameter)
+    # Every unit gets the value after the first one it has now, or the first value
+    current = dict(conn.execute('''SELECT m.unit_id, MIN(pv.keyword) FROM units_to_parametervalues AS m
+                                   JOIN parametervalues AS pv ON pv.id = m.parametervalue_id
+                                   JOIN parameters AS p ON p.id = pv.parameter_id WHERE p.keyword = ?
+                                   GROUP BY m.unit_id''', (parameter,)))
+    units = [u for u, in conn.execute('SELECT id FROM units ORDER BY id')]
+    conn.close()
+    changes = [{'op': 'set', 'unit': u, 'parameter': parameter,
+                'value': values[(values.index(current[u]) + 1) % len(values)] if u in current else values[0]}
+               for u in units]
+    workdir = tempfile.mkdtemp(prefix='ruslinkers-edits-')
+    try:
+        results = {}
+        for name in ('per change', 'batch'):
+            copy = os.path.join(workdir, name.replace(' ', '_') + '.db')
+            shutil.copyfile(path, copy)
+            conn = sqlite3.connect(copy)
+            start = time.perf_counter()
+            if name == 'batch':
+                applied, errors = apply(conn, changes)
+                if errors:
+                    print("WARNING: %d changes rejected, e.g. %s" % (len(errors), errors[0]))
+            else:
+                _per_row(conn, changes)
+            elapsed = time.perf_counter() - start
+            results[name] = conn.execute('''SELECT u.id, u.parametermap, group_concat(m.parametervalue_id) FROM units AS u
+                                            LEFT JOIN units_to_parametervalues AS m ON m.unit_id = u.id
+                                            GROUP BY u.id ORDER BY u.id''').fetchall()
+            conn.close()
+            print("%-10s %5d changes in %8.3f s" % (name, len(changes), elapsed))
+        if results['per change'] != results['batch']:
+            print("WARNING: the batch gives other parameter values than the changes one at a time")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Apply a batch of edits to a built database")
+    argparser.add_argument("command", choices=["apply", "bench"])
+    argparser.add_argument("database")
+    argparser.add_argument("changes", nargs='?', help="apply: JSON lines with one change each (default: stdin)")
+    argparser.add_argument("--partial", action="store_true", help="apply: apply the valid changes if some are rejected")
+    argparser.add_argument("--parameter", default="parts.order",
+                           help="bench: parameter to re-annotate on every unit (default: %(default)s)")
+    args = argparser.parse_args()
+
+    if args.command == "bench":
+        bench(args.database, args.parameter)
+        sys.exit()
+    file = open(args.changes) if args.changes else sys.stdin
+    changes = [json.loads(line) for line in file if line.strip()]
+    conn = sqlite3.connect(args.database)
+    applied, errors = apply(conn, changes, args.partial)
+    conn.close()
+    for n, message in errors:
+        print("change %d: %s" % (n + 1, message))
+    print("%d of %d changes applied" % (applied, len(changes)))
+    sys.exit(1 if errors else 0)
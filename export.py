@@ -0,0 +1,402 @@
+# Export of a built database back to the layouts of the source tables.
+#
+# The syntactic table gets one row per unit and the dictionary table one row
+# per meaning, with multi-valued cells joined by "; " as make-sqlite.py
+# splits them. Every column is one SQL expression over the unit (see
+# SYNTAX_COLUMNS and DATA_COLUMNS), aggregated with group_concat in ordered
+# subqueries, so the rows are streamed straight from SQLite to the CSV files.
+# The columns are SQL text rather than SQLAlchemy Core selects: they rely on
+# ordered group_concat/json_group_array subqueries and on the plain() function
+# that db.py registers on the sqlite3 connection, which Core would only wrap in text().
+#
+# Some information is only kept per unit although it came from dictionary
+# rows (phonvars, examples, hyperlinks, extra semantic fields, comments).
+# It is spread over the unit's dictionary rows again, one value per row,
+# which make-sqlite.py reads back into the same unit.
+#
+# Ids are hashes of the content (stable_ids.py), so nothing is ordered by
+# id. Units follow their linkers in dictionary order (collation.py), then
+# their semantic fields; a unit naming subfields of other semantic fields
+# waits until a unit of each of those fields has named them, as
+# make-sqlite.py files a subfield under the first row naming it. Meanings
+# follow their source and text, and the values of a cell their keywords or
+# texts.
+#
+#     python export.py export ruslinkers-new4.db --syntax syntax.csv --data data.csv
+#     python export.py check ruslinkers-new4.db
+#
+# check exports the database, builds a new one from the export and compares
+# the two with dbdiff.py. It also exports the new database, which has to give
+# the same files, rows in the same order. tests/test_export.py does the same for a plain and a
+# compressed build of a slice of the source tables:
+#
+#     python -m pytest tests
+
+import os
+import sys
+import csv
+import json
+import shutil
+import sqlite3
+import tempfile
+import argparse
+import subprocess
+
+from itertools import groupby
+from collections import defaultdict
+
+import db
+import dbdiff
+import collation
+
+MAKE_SQLITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'make-sqlite.py')
+
+# Column layouts of syntax_aug2024.csv and data_aug2024.csv
+SYNTAX_FIELDS = [
+    'linker', 'semfield1_ed', 'id', 'source', 'parts.num', 'parts.order', 'parts.order.example', 'linker_position',
+    'linker_position_exclusivity', 'position.example', 'mainpart', 'correl', 'correl.oblig', 'correl.oblig.example',
+    'comp.oblig', 'comment', 'public_comments', 'correl.position', 'correl.position.example', 'clause.order',
+    'clause.order.example', 'clause order comments', 'dep.clause.type', 'expansion', 'indep.sentence',
+    'indep.sentence.example', 'inferential.example', 'illoc example', 'metatext example', 'phonvar', 'pos', 'pos.type',
+    'meaning', 'style', 'example', 'other_senses', 'other_pos', 'subfield1_ed', 'semfield2_ed', 'subfield2_ed',
+    'sem_comment', 'inside_info', 'developer',
+]
+DATA_FIELDS = [
+    'id', 'form', 'edit form', 'hyperlink', 'dict', 'количество компонентов в смысловой части',
+    'позиция компонентов смысловой части', 'позиция коннектора в составе клаузы', 'phonvar', 'pos', 'type of pos',
+    'meaning', 'Non-connector', 'Стилистич. ограничения', 'Example', 'other_senses', 'other_pos', 'semfield1', 'subfield1',
+    'semfield2', 'subfield2', 'semfield1_ed', 'subfield1_ed', 'semfield2_ed', 'subfield2_ed', 'sem_comment',
+    'inside_info', 'Основная часть', 'Коррелят', 'Обязательность коррелята', 'Обязательность компонентов',
+    'Комментарий', 'Разработчик', '', '',
+]
+
+# Rows and multi-valued cells are ordered by content: ids are hashes of it (see stable_ids.py).
+# Units by linker in dictionary order, then by semantic field (s); equal keys keep their ids' order
+UNIT_ORDER = 'sort_key(u.linker), s.keyword, u.id'
+# Meanings of a unit by source (src) and text
+MEANING_ORDER = 'src.keyword, plain(m.meaning), m.id'
+
+def _concat(sql: str) -> str:
+    return "(SELECT group_concat(v, '; ') FROM (%s))" % sql
+
+def _parameter(keyword: str) -> str:
+    return _concat('''
+        SELECT pv.keyword AS v FROM units_to_parametervalues AS up
+        JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id
+        WHERE up.unit_id = u.id AND p.keyword = '%s' ORDER BY pv.keyword''' % keyword)
+
+def _parameter_example(keyword: str) -> str:
+    # make-sqlite.py gives the example to every value of the parameter
+    return '''(SELECT plain(e.text) FROM examples_to_unit_parametervalues AS ep
+        JOIN examples AS e ON e.id = ep.example_id
+        JOIN parametervalues AS pv ON pv.id = ep.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id
+        WHERE ep.unit_id = u.id AND p.keyword = '%s' ORDER BY plain(e.text) LIMIT 1)''' % keyword
+
+def _parameter_comment(keyword: str) -> str:
+    return '''(SELECT plain(c.text) FROM comments_to_unit_parametervalues AS cp
+        JOIN comments AS c ON c.id = cp.comment_id
+        JOIN parametervalues AS pv ON pv.id = cp.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id
+        WHERE cp.unit_id = u.id AND p.keyword = '%s' ORDER BY plain(c.text) LIMIT 1)''' % keyword
+
+def _text_parameter(keyword: str) -> str:
+    return '''(SELECT ut.value FROM units_to_textparametervalues AS ut
+        JOIN textparameters AS t ON t.id = ut.parameter_id
+        WHERE ut.unit_id = u.id AND t.keyword = '%s')''' % keyword
+
+def _form(formtype: str) -> str:
+    return '''(SELECT f.text FROM forms AS f JOIN formtypes AS ft ON ft.id = f.formtype_id
+        WHERE f.unit_id = u.id AND ft.keyword = '%s' ORDER BY f.text LIMIT 1)''' % formtype
+
+def _correl(column: str, joins: str) -> str:
+    # A unit has at most one correlative
+    return '''(SELECT %s FROM forms AS f JOIN formtypes AS ft ON ft.id = f.formtype_id
+        %s WHERE f.unit_id = u.id AND ft.keyword = 'correl' LIMIT 1)''' % (column, joins)
+
+# Columns of the syntactic table that make-sqlite.py reads; u is the unit
+SYNTAX_COLUMNS = {
+    'linker': 'u.linker',
+    'semfield1_ed': 's.keyword',
+    'id': _concat('''
+        SELECT m.id AS v FROM meanings AS m LEFT JOIN sources AS src ON src.id = m.source_id
+        WHERE m.unit_id = u.id ORDER BY %s''' % MEANING_ORDER),
+    'source': _concat('''
+        SELECT s.keyword AS v FROM sources_to_units AS su JOIN sources AS s ON s.id = su.source_id
+        WHERE su.unit_id = u.id ORDER BY s.keyword'''),
+    'subfield1_ed': _concat('''
+        SELECT sf.keyword AS v FROM meanings_to_subfields AS ms JOIN subfields AS sf ON sf.id = ms.subfield_id
+        WHERE ms.meaning_id = u.id AND (sf.semfield_id IS u.semfield_id OR sf.semfield_id NOT IN (
+            SELECT semfield_id FROM units_to_semfields WHERE unit_id = u.id)) ORDER BY sf.keyword'''),
+    'parts.num': _parameter('parts.num'),
+    'parts.order': _parameter('parts.order'),
+    'linker_position': _parameter('linker_position'),
+    'clause.order': _parameter('clause.order'),
+    # The whole cell is also kept as a text parameter
+    'dep.clause.type': 'COALESCE(%s, %s)' % (_text_parameter('dep.clause.type'), _parameter('dep.clause.type')),
+    'indep.sentence': _parameter('indep.sentence'),
+    'linker_position_exclusivity': _parameter('linker_position_exclusivity'),
+    'parts.order.example': _parameter_example('parts.order'),
+    'position.example': _parameter_example('linker_position'),
+    'clause.order.example': _parameter_example('clause.order'),
+    'clause order comments': _parameter_comment('clause.order'),
+    'indep.sentence.example': _parameter_example('indep.sentence'),
+    'inferential.example': _parameter_example('inferential'),
+    'illoc example': _parameter_example('illocutionary'),
+    'metatext example': _parameter_example('metatextual'),
+    'mainpart': _form('mainpart'),
+    'expansion': _text_parameter('expansion'),
+    'comp.oblig': _text_parameter('comp.oblig'),
+    'correl': _form('correl'),
+    'correl.oblig': _correl('ftp.value', '''JOIN forms_to_textparametervalues AS ftp ON ftp.form_id = f.id
+        JOIN textparameters AS t ON t.id = ftp.parameter_id AND t.keyword = 'correl.oblig' '''),
+    'correl.oblig.example': _correl('plain(e.text)', '''JOIN examples_to_forms AS ef ON ef.form_id = f.id
+        JOIN examples AS e ON e.id = ef.example_id'''),
+    'correl.position': _correl('pv.keyword', '''JOIN forms_to_parametervalues AS fp ON fp.form_id = f.id
+        JOIN parametervalues AS pv ON pv.id = fp.parametervalue_id'''),
+    'correl.position.example': _correl('plain(e.text)', '''JOIN examples_to_form_parametervalues AS ep ON ep.form_id = f.id
+        JOIN examples AS e ON e.id = ep.example_id'''),
+    # Comments of the syntactic table are split on "; " and hidden by default
+    'comment': _concat('''
+        SELECT plain(c.text) AS v FROM comments_to_units AS cu JOIN comments AS c ON c.id = cu.comment_id
+        WHERE cu.unit_id = u.id AND c.hidden AND instr(plain(c.text), '; ') = 0 ORDER BY v'''),
+}
+
+# Per unit lists of values that are written one per dictionary row
+DATA_COLUMNS = {
+    'phonvar': '''
+        SELECT json_group_array(text) FROM (SELECT f.text FROM forms AS f JOIN formtypes AS ft ON ft.id = f.formtype_id
+        WHERE f.unit_id = u.id AND ft.keyword = 'phonvar' ORDER BY f.text)''',
+    'Example': '''
+        SELECT json_group_array(text) FROM (SELECT plain(e.text) AS text FROM examples_to_units AS eu
+        JOIN examples AS e ON e.id = eu.example_id WHERE eu.unit_id = u.id ORDER BY text)''',
+    'hyperlink': '''
+        SELECT json_group_array(linker) FROM (SELECT t.linker FROM units_to_units AS l JOIN units AS t ON t.id = l.target_id
+        JOIN unitlinktypes AS lt ON lt.id = l.unitlinktype_id
+        WHERE l.source_id = u.id AND lt.keyword = 'hyperlink' ORDER BY sort_key(t.linker), t.id)''',
+    'semfield2_ed': '''
+        SELECT json_group_array(keyword) FROM (SELECT s.keyword, s.id FROM units_to_semfields AS us
+        JOIN semfields AS s ON s.id = us.semfield_id WHERE us.unit_id = u.id ORDER BY s.keyword)''',
+    'subfield2_ed': '''
+        SELECT json_group_array(json_array(keyword, semfield_id)) FROM (
+        SELECT sf.keyword, sf.semfield_id FROM meanings_to_subfields AS ms JOIN subfields AS sf ON sf.id = ms.subfield_id
+        WHERE ms.meaning_id = u.id AND sf.semfield_id IS NOT u.semfield_id AND sf.semfield_id IN (
+            SELECT semfield_id FROM units_to_semfields WHERE unit_id = u.id) ORDER BY sf.keyword)''',
+    # Comments of the dictionary table are visible unless they are inside_info
+    'sem_comment': '''
+        SELECT json_group_array(text) FROM (SELECT plain(c.text) AS text FROM comments_to_units AS cu
+        JOIN comments AS c ON c.id = cu.comment_id WHERE cu.unit_id = u.id AND NOT c.hidden ORDER BY text)''',
+    'inside_info': '''
+        SELECT json_group_array(text) FROM (SELECT plain(c.text) AS text FROM comments_to_units AS cu
+        JOIN comments AS c ON c.id = cu.comment_id WHERE cu.unit_id = u.id AND c.hidden
+        AND instr(plain(c.text), '; ') > 0 ORDER BY text)''',
+}
+
+# make-sqlite.py skips dictionary rows whose Non-connector is not NA, empty or объед
+SKIPPED = 'да'
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = db.connect(path)
+    conn.create_function('sort_key', 1, collation.sort_key, deterministic=True)
+    return conn
+
+def _subfields(conn: sqlite3.Connection):
+    """{unit id: ids of its subfields of its own semantic field}, {unit id: ids of its other subfields}"""
+    own, other = defaultdict(set), defaultdict(set)
+    for uid, sfid, same in conn.execute('''
+            SELECT u.id, sf.id, sf.semfield_id IS u.semfield_id FROM meanings_to_subfields AS ms
+            JOIN subfields AS sf ON sf.id = ms.subfield_id JOIN units AS u ON u.id = ms.meaning_id'''):
+        (own if same else other)[uid].add(sfid)
+    return own, other
+
+def syntax_rows(conn: sqlite3.Connection):
+    """Rows of the syntactic table as dictionaries, one per unit"""
+    names = list(SYNTAX_COLUMNS)
+    own, other = _subfields(conn)
+    cur = conn.execute('''
+        SELECT u.id, %s FROM units AS u LEFT JOIN semfields AS s ON s.id = u.semfield_id ORDER BY %s''' % (
+        ', '.join(SYNTAX_COLUMNS.values()), UNIT_ORDER))
+    # A subfield belongs to the semantic field of the first row naming it, so a row
+    # naming subfields of other fields waits until a row of each of those fields has
+    named, waiting = set(), []
+    for values in cur:
+        waiting.append(values)
+        while waiting:
+            ready = [values for values in waiting if other[values[0]] <= named]
+            if not ready:
+                break
+            for values in ready:
+                waiting.remove(values)
+                named.update(own[values[0]])
+                yield _syntax_row(names, values[1:])
+    for values in waiting:
+        yield _syntax_row(names, values[1:])
+
+def _syntax_row(names, values):
+    row = dict.fromkeys(SYNTAX_FIELDS, '')
+    row.update((name, '' if value is None else str(value)) for name, value in zip(names, values))
+    return row
+
+def _phonvar_cells(linker: str, phonvars, n: int):
+    """(form, edit form, phonvar) cells of n dictionary rows that give back the phonvars
+
+    make-sqlite.py adds the form of a row whose edit form is set unless the
+    edit form is already a phonvar, and the phonvar of a row unless it is
+    already there, so repeated phonvars can only be given as forms.
+    """
+    remaining = list(phonvars)
+    added = []
+    cells = []
+    for _ in range(n):
+        form = edit = phonvar = ''
+        if linker not in added:
+            choice = [p for p in remaining if p != linker] or remaining
+            if choice:
+                form, edit = choice[0], linker
+                remaining.remove(form)
+                added.append(form)
+        choice = [p for p in remaining if p not in added and p != linker]
+        if not choice and linker in remaining and linker not in added and len(set(remaining)) == 1:
+            choice = [linker]
+        if choice:
+            phonvar = choice[0]
+            remaining.remove(phonvar)
+            added.append(phonvar)
+        cells.append((form, edit, phonvar))
+    return cells, remaining
+
+def data_rows(conn: sqlite3.Connection, warnings=None):
+    """Rows of the dictionary table as dictionaries, one per meaning"""
+    units = conn.execute('''
+        SELECT u.id, u.linker, s.keyword, u.style, plain(u.sem_comment), %s FROM units AS u
+        LEFT JOIN semfields AS s ON s.id = u.semfield_id ORDER BY %s''' % (
+        ', '.join('(%s)' % sql for sql in DATA_COLUMNS.values()), UNIT_ORDER))
+    # In the order of the units
+    meanings = groupby(conn.execute('''
+        SELECT m.unit_id, m.id, src.keyword, plain(m.meaning), m.pos, m.pos_type, m.other_senses, m.other_pos
+        FROM meanings AS m JOIN units AS u ON u.id = m.unit_id LEFT JOIN semfields AS s ON s.id = u.semfield_id
+        LEFT JOIN sources AS src ON src.id = m.source_id ORDER BY %s, %s''' % (UNIT_ORDER, MEANING_ORDER)), key=lambda r: r[0])
+    semfields = dict(conn.execute('SELECT id, keyword FROM semfields'))
+    subfields = dict(conn.execute('''
+        SELECT meaning_id, group_concat(keyword, '; ') FROM (SELECT ms.meaning_id, sf.keyword FROM meanings_to_subfields AS ms
+        JOIN subfields AS sf ON sf.id = ms.subfield_id ORDER BY ms.meaning_id, sf.keyword) GROUP BY meaning_id'''))
+    uid, rows = next(meanings, (None, None))
+    for unit in units:
+        if unit[0] != uid:
+            continue
+        rows = list(rows)
+        uid, linker, semfield, style, sem_comment = unit[:5]
+        lists = {name: json.loads(value) for name, value in zip(DATA_COLUMNS, unit[5:])}
+        # Subfields of an extra semantic field go with that field
+        extra = lists['semfield2_ed']
+        by_field = {}
+        for keyword, semfield_id in lists.pop('subfield2_ed'):
+            by_field.setdefault(semfields[semfield_id], []).append(keyword)
+        lists['subfield2_ed'] = [';'.join(by_field.get(kw, [])) for kw in extra]
+        # The last comment becomes the unit's sem_comment
+        comments = [text for text in lists['sem_comment'] if text != sem_comment]
+        if sem_comment:
+            comments.append(sem_comment)
+        if len(comments) > len(rows):
+            comments[len(rows) - 1:] = comments[-1:]
+        lists['sem_comment'] = [''] * (len(rows) - len(comments)) + comments
+        cells, left = _phonvar_cells(linker, lists.pop('phonvar'), len(rows))
+        lists['phonvar'] = [phonvar for _, _, phonvar in cells] + left
+        lists['edit form'] = [edit for _, edit, _ in cells]
+        lists['form'] = [form or linker for form, _, _ in cells]
+        for name, values in lists.items():
+            if len(values) > len(rows) and warnings is not None:
+                warnings.append("%d %s value(s) of unit %d (%s) do not fit in its %d dictionary row(s)" % (
+                    len(values) - len(rows), name, uid, linker, len(rows)))
+        for i, (_, mid, source, meaning, pos, pos_type, other_senses, other_pos) in enumerate(rows):
+            row = dict.fromkeys(DATA_FIELDS, '')
+            row.update({
+                'id': str(mid), 'form': linker, 'dict': source or '', 'meaning': meaning or '', 'pos': pos or '',
+                'type of pos': pos_type or '', 'other_senses': other_senses or '', 'other_pos': other_pos or '',
+                'Non-connector': 'NA', 'Стилистич. ограничения': style or '',
+                'semfield1_ed': semfield or '', 'subfield1_ed': subfields.get(uid) or '',
+            })
+            for name, values in lists.items():
+                if i < len(values):
+                    row[name] = values[i]
+            yield row
+        uid, rows = next(meanings, (None, None))
+    # Sources without meanings exist only as values of the dict column
+    for source, in conn.execute('''
+            SELECT keyword FROM sources WHERE id NOT IN (SELECT source_id FROM meanings WHERE source_id IS NOT NULL)
+            AND keyword != 'ИМК' ORDER BY keyword'''):
+        row = dict.fromkeys(DATA_FIELDS, '')
+        row.update({'dict': source, 'Non-connector': SKIPPED})
+        yield row
+
+def _write(path: str, fieldnames, rows):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(fieldnames)
+        for row in rows:
+            writer.writerow([row[name] for name in fieldnames])
+
+def export(path: str, syntax_file: str, data_file: str):
+    """Write both tables of a database; returns the warnings about lost values"""
+    conn = _connect(path)
+    warnings = []
+    _write(syntax_file, SYNTAX_FIELDS, syntax_rows(conn))
+    _write(data_file, DATA_FIELDS, data_rows(conn, warnings))
+    conn.close()
+    return warnings
+
+def check(path: str):
+    """Export a database, build it again and return the dbdiff report
+
+    report['reordered'] lists the tables whose export from the new database differs from the first one."""
+    workdir = tempfile.mkdtemp(prefix='ruslinkers-export-')
+    try:
+        syntax_file = os.path.join(workdir, 'syntax.csv')
+        data_file = os.path.join(workdir, 'data.csv')
+        for warning in export(path, syntax_file, data_file):
+            print("WARNING: %s" % warning)
+        output = os.path.join(workdir, 'rebuilt')
+        subprocess.run([sys.executable, MAKE_SQLITE, '--syntax', syntax_file, '--data', data_file, '--output', output],
+                       check=True, stdout=subprocess.DEVNULL)
+        old = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+        new = sqlite3.connect('file:%s.db?mode=ro' % output, uri=True)
+        report = dbdiff.diff(old, new)
+        old.close()
+        new.close()
+        export(output + '.db', syntax_file + '.again', data_file + '.again')
+        report['reordered'] = []
+        for name, file in (('syntax', syntax_file), ('data', data_file)):
+            with open(file, 'rb') as first, open(file + '.again', 'rb') as again:
+                if first.read() != again.read():
+                    report['reordered'].append(name)
+        return report
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Export a database to the layouts of the source tables")
+    argparser.add_argument("command", choices=["export", "check"])
+    argparser.add_argument("database")
+    argparser.add_argument("--syntax", default="syntax_export.csv", help="syntactic table to write (default: %(default)s)")
+    argparser.add_argument("--data", default="data_export.csv", help="dictionary table to write (default: %(default)s)")
+    args = argparser.parse_args()
+
+    if args.command == "export":
+        for warning in export(args.database, args.syntax, args.data):
+            print("WARNING: %s" % warning)
+    else:
+        report = check(args.database)
+        s = report['summary']
+        if s['added'] or s['removed'] or s['changed'] or report['vocabularies']:
+            json.dump({'summary': s, 'vocabularies': report['vocabularies'],
+                       'units': [u for u in report['units'] if u['status'] != 'unchanged'][:20]},
+                      sys.stdout, ensure_ascii=False, indent=1)
+            print()
+            print("Round trip changed the database: %d units added, %d removed, %d changed" % (
+                s['added'], s['removed'], s['changed']))
+            sys.exit(1)
+        if report['reordered']:
+            print("Exporting the rebuilt database changed the %s table(s)" % ' and '.join(report['reordered']))
+            sys.exit(1)
+        print("Round trip gives an equivalent database (%d units)" % s['units_old'])
@@ -0,0 +1,143 @@
+# Spans of the linkers inside their example sentences.
+#
+# An example belongs to a unit through examples_to_units,
+# examples_to_unit_parametervalues, or one of the unit's forms
+# (examples_to_forms, examples_to_form_parametervalues). For every such pair
+# the unit is looked for in the example text with the matchers of the
+# annotation pipeline: the best discontinuous analyses of the unit
+# (discontinuous.py) and the longest contiguous occurrences of its linker
+# and phonvar, mainpart and correl forms that do not overlap them
+# (spotter.py). Units found by neither, because of words inserted into them
+# (если даже погода и испортится), are matched as their words in order within
+# a sentence. The spans are stored in example_highlights as
+# (example_id, unit_id, start, length), with offsets in characters of
+# Example.text, so a page can highlight an example by slicing.
+#
+# make-sqlite.py fills the table at the end of a build; this script does the
+# same for an existing database.
+#
+#     python highlights.py ruslinkers-new4.db
+
+import sqlite3
+import argparse
+
+from collections import defaultdict
+
+import spotter
+import discontinuous
+
+# (example, unit) pairs through every table that links examples
+EXAMPLE_UNITS = '''
+    SELECT example_id, unit_id FROM examples_to_units
+    UNION SELECT example_id, unit_id FROM examples_to_unit_parametervalues
+    UNION SELECT ef.example_id, f.unit_id FROM examples_to_forms AS ef JOIN forms AS f ON f.id = ef.form_id
+    UNION SELECT ef.example_id, f.unit_id FROM examples_to_form_parametervalues AS ef JOIN forms AS f ON f.id = ef.form_id
+'''
+
+def _subsequence(sentence: str, base: int, sequence):
+    """Spans of the shortest in-order occurrence of the words of sequence in a sentence, or None"""
+    tokens = [(m.start(), m.end(), m.group()) for m in spotter.WORD.finditer(spotter.normalize(sentence))]
+    best = None
+    for first in range(len(tokens)):
+        if tokens[first][2] != sequence[0]:
+            continue
+        matched, i = [first], 1
+        for j in range(first + 1, len(tokens)):
+            if i == len(sequence):
+                break
+            if tokens[j][2] == sequence[i]:
+                matched.append(j)
+                i += 1
+        if i == len(sequence) and (best is None or matched[-1] - matched[0] < best[-1] - best[0]):
+            best = matched
+    if best is None:
+        return None
+    # Adjacent words make one span
+    spans = []
+    for k, j in enumerate(best):
+        if k and j == best[k - 1] + 1:
+            spans[-1][1] = tokens[j][1]
+        else:
+            spans.append([tokens[j][0], tokens[j][1]])
+    return [(base + s, e - s) for s, e in spans]
+
+def _overlaps(start: int, length: int, taken) -> bool:
+    return any(start < e and s < start + length for s, e in taken)
+
+def spans(text: str, unit_ids, spot: spotter.Spotter, matcher: discontinuous.Matcher, names=None):
+    """{unit id: [(start, length), ...]} for the given units in one text
+
+    Units that neither matcher finds are looked for as their words in order
+    within a sentence (до тех пор, пока я не), if names gives their word
+    sequences."""
+    found = defaultdict(list)
+    taken = defaultdict(list)
+    for _, analyses in matcher.match(text):
+        for a in discontinuous.best([a for a in analyses if a.unit_id in unit_ids]):
+            if any(_overlaps(o, n, taken[a.unit_id]) for o, n in a.spans):
+                continue
+            found[a.unit_id].extend(a.spans)
+            taken[a.unit_id].extend((o, o + n) for o, n in a.spans)
+    matches = list(spot.scan(text))
+    for uid in unit_ids:
+        own = [(offset, length, (uid,)) for offset, length, uids in matches if uid in uids]
+        for offset, length, _ in spotter.longest(own):
+            if not _overlaps(offset, length, taken[uid]):
+                found[uid].append((offset, length))
+    for uid in unit_ids:
+        if found[uid] or not names:
+            continue
+        for m in discontinuous.SENTENCE.finditer(text):
+            occurrences = [_subsequence(m.group(), m.start(), sequence) for sequence in names.get(uid, ())]
+            occurrences = [o for o in occurrences if o]
+            if occurrences:
+                # The most specific name, then the tightest
+                found[uid].extend(min(occurrences, key=lambda o: (-len(o), o[-1][0] - o[0][0])))
+    return {uid: sorted(s) for uid, s in found.items()}
+
+def compute(conn: sqlite3.Connection):
+    """(example id, unit id, start, length) rows for every example of every unit"""
+    units = defaultdict(set)
+    for example_id, unit_id in conn.execute(EXAMPLE_UNITS):
+        units[example_id].add(unit_id)
+    names = defaultdict(set)
+    for uid, _, text in spotter.patterns(conn):
+        for variant in spotter.expand(text):
+            names[uid].add(tuple(word for component in variant for word in component))
+    names = {uid: sorted(sequences, key=lambda s: -len(s)) for uid, sequences in names.items()}
+    spot = spotter.Spotter.compile(conn)
+    matcher = discontinuous.Matcher.compile(conn)
+    for example_id, text in conn.execute('SELECT id, text FROM examples ORDER BY id'):
+        if example_id not in units or not text:
+            continue
+        if isinstance(text, bytes):
+            import compression
+            text = compression.decompress(text)
+        for uid, found in sorted(spans(text, units[example_id], spot, matcher, names).items()):
+            for start, length in found:
+                yield example_id, uid, start, length
+
+def store(conn: sqlite3.Connection) -> int:
+    """Replace the contents of example_highlights; returns the number of spans"""
+    rows = list(compute(conn))
+    conn.execute('DELETE FROM example_highlights')
+    conn.executemany('INSERT INTO example_highlights (example_id, unit_id, start, length) VALUES (?, ?, ?, ?)', rows)
+    conn.commit()
+    return len(rows)
+
+def store_database(path: str) -> int:
+    conn = sqlite3.connect(path)
+    count = store(conn)
+    conn.close()
+    return count
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Compute where the linkers occur in their examples")
+    argparser.add_argument("database")
+    args = argparser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    count = store(conn)
+    pairs = conn.execute('SELECT COUNT(*) FROM (%s)' % EXAMPLE_UNITS).fetchone()[0]
+    found = conn.execute('SELECT COUNT(*) FROM (SELECT DISTINCT example_id, unit_id FROM example_highlights)').fetchone()[0]
+    print("%d spans for %d of %d example/unit pairs" % (count, found, pairs))
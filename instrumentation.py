@@ -0,0 +1,269 @@
+# Opt-in query instrumentation for engines over a built database.
+#
+#     stats = instrumentation.attach(engine, slow=0.05)
+#     ...
+#     stats.snapshot()      # {fingerprint: {count, sum, max, rows, buckets}}
+#     stats.prometheus()    # the same in the Prometheus text format
+#     stats.detach()
+#
+# Statements are grouped by fingerprint: the SQL text with literals replaced
+# by ? and IN lists collapsed, so the same query with other values counts
+# once. For every fingerprint there is a latency histogram, the number of
+# rows (affected, or fetched for SELECTs) and the slowest run. Fetched rows
+# are counted on one SELECT in row_sample (the first, then every
+# row_sample-th) and scaled to all of them: wrapping every cursor in Python
+# cost as much as the rest of the instrumentation. Statements slower than the
+# threshold are logged to the 'ruslinkers.queries' logger with their EXPLAIN
+# QUERY PLAN and kept in stats.slow.
+#
+# Nothing is attached to an engine until attach() is called, so an engine
+# that is not instrumented pays nothing.
+#
+#     python instrumentation.py ruslinkers-new4.db
+
+import re
+import time
+import hashlib
+import logging
+import argparse
+import threading
+
+from bisect import bisect_left
+from collections import deque
+from functools import lru_cache
+
+from sqlalchemy import event
+
+logger = logging.getLogger('ruslinkers.queries')
+
+# Upper bounds of the latency buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\bx'[0-9a-fA-F]*'")
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """Statement text with literals, IN lists and whitespace normalized"""
+    text = _LITERALS.sub('?', statement)
+    text = _IN_LIST.sub('IN (?)', text)
+    # Numbered bind parameters of the SQLite dialect (?1, ?2) are literals too
+    text = re.sub(r'\?\d+', '?', text)
+    return _SPACE.sub(' ', text).strip()
+
+def _label(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# SELECTs whose fetched rows are counted: one in ROW_SAMPLE
+ROW_SAMPLE = 16
+
+class _Stats:
+    __slots__ = ('count', 'sum', 'max', 'rows', 'buckets', 'selects', 'sampled', 'fetched')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.rows = 0 # affected by other statements
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.selects = 0
+        self.sampled = 0
+        self.fetched = 0 # by the sampled SELECTs
+
+    def total_rows(self) -> int:
+        if not self.sampled:
+            return self.rows
+        return self.rows + round(self.fetched * self.selects / self.sampled)
+
+class _CountingCursor:
+    """DB-API cursor that adds the rows fetched from it to a fingerprint"""
+
+    def __init__(self, cursor, stats: _Stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.fetched += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.fetched += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._stats.fetched += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class Instrumentation:
+    def __init__(self, engine, slow: float = 0.1, explain: bool = True, count_rows: bool = True, keep: int = 100,
+                 row_sample: int = ROW_SAMPLE):
+        self.engine = engine
+        self.threshold = slow
+        self.explain = explain
+        self.count_rows = count_rows
+        self.row_sample = max(1, row_sample)
+        self.stats = {}
+        self.slow = deque(maxlen=keep)
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def attach(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+        return self
+
+    def detach(self):
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+            self.slow.clear()
+            self._plans.clear()
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        # A connection runs one statement at a time (plans are explained on the DB-API connection)
+        conn.info['query_start'] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start']
+        key = fingerprint(statement)
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = _Stats()
+            stats.count += 1
+            stats.sum += elapsed
+            if elapsed > stats.max:
+                stats.max = elapsed
+            stats.buckets[bisect_left(BUCKETS, elapsed)] += 1
+            if cursor.description is None:
+                if cursor.rowcount > 0:
+                    stats.rows += cursor.rowcount
+            elif self.count_rows and context is not None:
+                stats.selects += 1
+                if stats.selects % self.row_sample == 1 or self.row_sample == 1:
+                    stats.sampled += 1
+                    # Rows are fetched after this event, through the context's cursor
+                    context.cursor = _CountingCursor(cursor, stats)
+        if elapsed >= self.threshold:
+            self._log_slow(cursor, statement, parameters, elapsed, executemany)
+
+    def _log_slow(self, cursor, statement, parameters, elapsed, executemany):
+        key = fingerprint(statement)
+        plan = self._plans.get(key)
+        # Queries with the same fingerprint share a plan, so it is explained once
+        if plan is None and self.explain and not executemany:
+            try:
+                explain = cursor.connection.cursor()
+                plan = ['%s%s' % ('  ' * depth, detail) for depth, detail in
+                        _plan_depths(explain.execute('EXPLAIN QUERY PLAN ' + statement, parameters or ()).fetchall())]
+                explain.close()
+            except Exception as e: # e.g. statements that cannot be explained
+                plan = ['(no plan: %s)' % e]
+            self._plans[key] = plan
+        entry = {'time': time.time(), 'elapsed': elapsed, 'statement': statement, 'fingerprint': key, 'plan': plan}
+        self.slow.append(entry)
+        logger.warning("Slow query (%.1f ms): %s%s", elapsed * 1000, _SPACE.sub(' ', statement).strip(),
+                       ''.join('\n    ' + line for line in plan or ()))
+
+    def snapshot(self):
+        """{fingerprint: {count, sum, max, rows, buckets: {upper bound: cumulative count}}}
+
+        Fetched rows are an estimate unless row_sample is 1."""
+        with self._lock:
+            result = {}
+            for key, s in self.stats.items():
+                cumulative, buckets = 0, {}
+                for bound, n in zip(BUCKETS + (float('inf'),), s.buckets):
+                    cumulative += n
+                    buckets[bound] = cumulative
+                result[key] = {'count': s.count, 'sum': s.sum, 'max': s.max, 'rows': s.total_rows(), 'buckets': buckets}
+            return result
+
+    def prometheus(self, prefix: str = 'ruslinkers_query') -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        lines = [
+            '# HELP %s_duration_seconds Statement execution time by fingerprint' % prefix,
+            '# TYPE %s_duration_seconds histogram' % prefix,
+        ]
+        info, rows = [], []
+        for key, s in sorted(self.snapshot().items()):
+            qid = hashlib.sha1(key.encode()).hexdigest()[:12]
+            for bound, n in s['buckets'].items():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_duration_seconds_bucket{query="%s",le="%s"} %d' % (prefix, qid, le, n))
+            lines.append('%s_duration_seconds_sum{query="%s"} %r' % (prefix, qid, s['sum']))
+            lines.append('%s_duration_seconds_count{query="%s"} %d' % (prefix, qid, s['count']))
+            rows.append('%s_rows_total{query="%s"} %d' % (prefix, qid, s['rows']))
+            info.append('%s_info{query="%s",statement="%s"} 1' % (prefix, qid, _label(key)))
+        lines += ['# HELP %s_rows_total Rows fetched (estimated from a sample) or affected by fingerprint' % prefix,
+                  '# TYPE %s_rows_total counter' % prefix] + rows
+        lines += ['# HELP %s_info Statement text of each query label' % prefix,
+                  '# TYPE %s_info gauge' % prefix] + info
+        return '\n'.join(lines) + '\n'
+
+def _plan_depths(rows):
+    """(depth, detail) of EXPLAIN QUERY PLAN rows (id, parent, notused, detail)"""
+    depth = {0: -1}
+    for id_, parent, _, detail in rows:
+        depth[id_] = depth.get(parent, -1) + 1
+        yield depth[id_], detail
+
+def attach(engine, slow: float = 0.1, explain: bool = True, count_rows: bool = True,
+           row_sample: int = ROW_SAMPLE) -> Instrumentation:
+    """Start collecting query statistics on an engine"""
+    return Instrumentation(engine, slow, explain, count_rows, row_sample=row_sample).attach()
+
+def _workload(engine):
+    """Load every unit with its relationships, as the entry pages do"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import Session
+    from models import Unit
+
+    with Session(engine) as session:
+        for unit in session.scalars(select(Unit)):
+            unit.forms, unit.examples, unit.comments, unit.meanings
+
+if __name__ == '__main__':
+    from sqlalchemy import create_engine
+
+    argparser = argparse.ArgumentParser(description="Run the entry page queries with instrumentation and print the statistics")
+    argparser.add_argument("database")
+    argparser.add_argument("--slow", type=float, default=0.005, help="slow query threshold in seconds (default: %(default)s)")
+    argparser.add_argument("--repeat", type=int, default=5, help="runs of the workload, the best is kept (default: %(default)s)")
+    args = argparser.parse_args()
+    logging.basicConfig(format='%(message)s')
+
+    engine = create_engine('sqlite:///%s' % args.database)
+    _workload(engine) # warm up the statement caches
+    stats = Instrumentation(engine, args.slow)
+    plain = instrumented = float('inf')
+    # Alternate the runs so that both see the same machine load
+    for _ in range(args.repeat):
+        stats.reset()
+        start = time.perf_counter()
+        _workload(engine)
+        plain = min(plain, time.perf_counter() - start)
+        stats.attach()
+        start = time.perf_counter()
+        _workload(engine)
+        instrumented = min(instrumented, time.perf_counter() - start)
+        stats.detach()
+    print(stats.prometheus(), end='')
+    print("# workload: %.1f ms plain, %.1f ms instrumented (%+.0f%%, best of %d)"
+          % (plain * 1000, instrumented * 1000, (instrumented / plain - 1) * 100, args.repeat))
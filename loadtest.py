@@ -0,0 +1,321 @@
+# Load test of the read queries behind the dictionary pages.
+#
+# A query log is a JSON line per request, [operation, arguments...], drawn
+# from the contents of a database with a fixed seed:
+#
+#   lookup      the entry of a linker: its units with their whole subtree, as dump.py reads it
+#   facet       units with one or two given parameter values (sorted by linker, first page)
+#   search      examples containing a word, with the linkers they illustrate
+#   neighbours  units linked from or to the units of a linker (units_to_units)
+#   browse      the first pages of a semantic field or subfield (closure.py)
+#
+# Arguments are linkers and keywords, never ids, so the same log can be
+# replayed against any build. The log is split over N threads or processes,
+# each with its own connection, and every request is timed; the report gives
+# p50/p95/p99 latency and throughput per operation. With several databases,
+# or --variant statements applied to a copy of the first one (e.g. an extra
+# index), the same log is replayed against each and reported side by side.
+#
+# search scans the example texts by default. Only compressed builds have the
+# FTS5 index of compression.py, and it matches whole tokens where the scan
+# matches substrings, so the two variants are neither equally fast nor give
+# the same rows: --fts uses the index, and every database must have it.
+#
+#     python loadtest.py log ruslinkers-new4.db -n 5000 -o queries.jsonl
+#     python loadtest.py run ruslinkers-new4.db --log queries.jsonl --workers 4
+#     python loadtest.py run ruslinkers-old.db ruslinkers-new4.db -n 2000 --processes
+#     python loadtest.py run ruslinkers-new4.db --variant "CREATE INDEX ix_units_linker ON units (linker)"
+#     python loadtest.py run ruslinkers-compressed.db -n 2000 --fts
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import dump
+import closure
+import spotter
+import memimage
+
+OPERATIONS = ('lookup', 'facet', 'search', 'neighbours', 'browse')
+
+# Share of each operation in a generated log
+MIX = {'lookup': 40, 'facet': 20, 'search': 20, 'neighbours': 10, 'browse': 10}
+
+PAGE = 50
+
+FACET = '''
+    SELECT u.id, u.linker FROM units AS u WHERE %s ORDER BY u.linker, u.id LIMIT ?'''
+
+FACET_VALUE = '''u.id IN (
+    SELECT up.unit_id FROM units_to_parametervalues AS up
+    JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+    JOIN parameters AS p ON p.id = pv.parameter_id WHERE p.keyword = ? AND pv.keyword = ?)'''
+
+# One row per example, with the linkers it illustrates
+SEARCH = '''
+    SELECT e.id, plain(e.text), (SELECT group_concat(u.linker, '; ') FROM examples_to_units AS eu
+                                 JOIN units AS u ON u.id = eu.unit_id WHERE eu.example_id = e.id)
+    FROM examples AS e WHERE e.id IN (%s)'''
+
+SEARCH_FTS = SEARCH % 'SELECT rowid FROM fts_examples_text WHERE fts_examples_text MATCH ? LIMIT ?'
+
+# Words are matched as substrings of the normalized text
+SEARCH_SCAN = SEARCH % 'SELECT id FROM examples WHERE instr(normalize(plain(text)), ?) LIMIT ?'
+
+NEIGHBOURS = '''
+    SELECT lt.keyword, t.linker FROM units AS s
+    JOIN units_to_units AS l ON l.source_id = s.id
+    JOIN unitlinktypes AS lt ON lt.id = l.unitlinktype_id JOIN units AS t ON t.id = l.target_id
+    WHERE s.linker = ?
+    UNION
+    SELECT lt.keyword, t.linker FROM units AS s
+    JOIN units_to_units AS l ON l.target_id = s.id
+    JOIN unitlinktypes AS lt ON lt.id = l.unitlinktype_id JOIN units AS t ON t.id = l.source_id
+    WHERE s.linker = ?'''
+
+BROWSE = '''
+    WITH uf (semfield_id, subfield_id, unit_id, role) AS (%s)
+    SELECT uf.unit_id, u.linker, uf.role FROM uf JOIN units AS u ON u.id = uf.unit_id
+    WHERE uf.semfield_id = ? AND uf.subfield_id IS ? AND uf.unit_id > ? ORDER BY uf.unit_id LIMIT ?''' % closure.CLOSURE
+
+class Client:
+    """One connection and the requests of the log; the query for an operation depends on what the database has"""
+
+    def __init__(self, path: str, fts: bool = False):
+        self.conn = memimage.connect(path)
+        tables = {name for name, in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if fts and 'fts_examples_text' not in tables:
+            self.conn.close()
+            raise ValueError("%s has no full-text index; it is built by compression.py" % path)
+        self.fts = fts
+        self.closure = 'unit_fields' in tables
+        self.sections = dump._sections()
+
+    def lookup(self, linker: str) -> int:
+        ids = [i for i, in self.conn.execute('SELECT id FROM units WHERE linker = ?', (linker,))]
+        return sum(len(dump.documents(self.conn, self.sections)) for _ in dump.batches(self.conn, only=ids))
+
+    def facet(self, *values) -> int:
+        """values are [parameter, value] pairs"""
+        where = ' AND '.join([FACET_VALUE] * len(values))
+        return len(self.conn.execute(FACET % where, [x for pair in values for x in pair] + [PAGE]).fetchall())
+
+    def search(self, word: str) -> int:
+        if self.fts:
+            return len(self.conn.execute(SEARCH_FTS, ('"%s"' % word.replace('"', ''), PAGE)).fetchall())
+        return len(self.conn.execute(SEARCH_SCAN, (word, PAGE)).fetchall())
+
+    def neighbours(self, linker: str) -> int:
+        return len(self.conn.execute(NEIGHBOURS, (linker, linker)).fetchall())
+
+    def browse(self, keyword: str, pages: int) -> int:
+        try:
+            field = closure.resolve(self.conn, keyword)
+        except KeyError:
+            return 0
+        count, cursor = 0, 0
+        for _ in range(pages):
+            if self.closure:
+                rows, cursor = closure.page(self.conn, *field, after=cursor, limit=PAGE)
+            else:
+                # Databases built before unit_fields existed
+                rows = self.conn.execute(BROWSE, field + (cursor, PAGE)).fetchall()
+                cursor = rows[-1][0] if len(rows) == PAGE else None
+            count += len(rows)
+            if cursor is None:
+                break
+        return count
+
+    def close(self):
+        self.conn.close()
+
+def generate(conn: sqlite3.Connection, n: int, seed: int = 0, mix=MIX):
+    """A query log of n requests drawn from the contents of a database"""
+    rng = random.Random(seed)
+    # Everything is read in content order, so builds with other ids give the same log
+    linkers = [l for l, in conn.execute('SELECT DISTINCT linker FROM units ORDER BY linker')]
+    values = defaultdict(list)
+    for linker, parameter, value in conn.execute('''
+            SELECT u.linker, p.keyword, pv.keyword FROM units_to_parametervalues AS up
+            JOIN units AS u ON u.id = up.unit_id
+            JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+            JOIN parameters AS p ON p.id = pv.parameter_id ORDER BY u.linker, p.keyword, pv.keyword'''):
+        if [parameter, value] not in values[linker]:
+            values[linker].append([parameter, value])
+    texts = [t for t, in conn.execute('SELECT plain(text) FROM examples ORDER BY plain(text)') if t]
+    linked = [l for l, in conn.execute('''
+        SELECT DISTINCT u.linker FROM units AS u JOIN units_to_units AS l ON l.source_id = u.id ORDER BY u.linker''')]
+    fields = [k for k, in conn.execute('SELECT keyword FROM semfields UNION SELECT keyword FROM subfields ORDER BY 1')]
+
+    operations = [op for op in OPERATIONS if mix.get(op)]
+    weights = [mix[op] for op in operations]
+    log = []
+    while len(log) < n:
+        op = rng.choices(operations, weights)[0]
+        if op == 'lookup':
+            log.append([op, rng.choice(linkers)])
+        elif op == 'facet':
+            # Values that one unit has together, so the filter is not empty
+            own = values[rng.choice([l for l in linkers if values[l]])]
+            log.append([op] + rng.sample(own, min(len(own), rng.choice((1, 2)))))
+        elif op == 'search':
+            words = [w for w in spotter.WORD.findall(spotter.normalize(rng.choice(texts))) if len(w) > 3]
+            if words:
+                log.append([op, rng.choice(words)])
+        elif op == 'neighbours':
+            # Mostly linkers that have links
+            log.append([op, rng.choice(linked if linked and rng.random() < 0.8 else linkers)])
+        else:
+            log.append([op, rng.choice(fields), rng.choice((1, 1, 2, 3))])
+    return log
+
+def _replay(path: str, entries, fts: bool = False):
+    """(start, end, [(operation, seconds, rows), ...]) of one worker"""
+    client = Client(path, fts)
+    timings = []
+    start = time.perf_counter()
+    for op, *params in entries:
+        t = time.perf_counter()
+        rows = getattr(client, op)(*params)
+        timings.append((op, time.perf_counter() - t, rows))
+    end = time.perf_counter()
+    client.close()
+    return start, end, timings
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))]
+
+def run(path: str, log, workers: int = 1, processes: bool = False, fts: bool = False):
+    """{operation: {count, rows, p50, p95, p99, throughput}} with '*' for all requests"""
+    slices = [log[i::workers] for i in range(workers)]
+    if processes:
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        with context.Pool(workers) as pool:
+            results = pool.starmap(_replay, [(path, s, fts) for s in slices])
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(_replay, [path] * workers, slices, [fts] * workers))
+    elapsed = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+    timings = defaultdict(list)
+    rows = defaultdict(int)
+    for _, _, worker in results:
+        for op, seconds, n in worker:
+            for key in (op, '*'):
+                timings[key].append(seconds)
+                rows[key] += n
+    report = {}
+    for op in list(OPERATIONS) + ['*']:
+        if not timings[op]:
+            continue
+        values = sorted(timings[op])
+        report[op] = {'count': len(values), 'rows': rows[op], 'p50': percentile(values, 50),
+                      'p95': percentile(values, 95), 'p99': percentile(values, 99),
+                      'throughput': len(values) / elapsed}
+    return report
+
+def variant(path: str, statements, workdir: str) -> str:
+    """Copy of a database with the given statements applied"""
+    copy = os.path.join(workdir, 'variant.db')
+    shutil.copyfile(path, copy)
+    conn = sqlite3.connect(copy)
+    for sql in statements:
+        conn.executescript(sql)
+    conn.commit()
+    conn.close()
+    return copy
+
+def print_reports(names, reports):
+    columns = ''.join('  %-39s' % name[-39:] for name in names)
+    print("%-10s %6s%s" % ('', '', columns))
+    print("%-10s %6s%s" % ('operation', 'count', '  %8s %8s %8s %10s  ' % ('p50 ms', 'p95 ms', 'p99 ms', 'req/s') * len(names)))
+    for op in list(OPERATIONS) + ['*']:
+        if op not in reports[0]:
+            continue
+        cells = ''.join('  %8.2f %8.2f %8.2f %10.0f  ' % (r[op]['p50'] * 1000, r[op]['p95'] * 1000, r[op]['p99'] * 1000,
+                                                        r[op]['throughput']) for r in reports)
+        print("%-10s %6d%s" % ('all' if op == '*' else op, reports[0][op]['count'], cells))
+    # Requests that give other results on another database are worth a look
+    for name, r in zip(names[1:], reports[1:]):
+        differ = [op for op in OPERATIONS if op in r and r[op]['rows'] != reports[0][op]['rows']]
+        if differ:
+            print("WARNING: %s returns other numbers of rows for %s" % (name, ', '.join(differ)))
+
+def _mix(text: str):
+    mix = dict.fromkeys(OPERATIONS, 0)
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        if op not in mix:
+            raise argparse.ArgumentTypeError("unknown operation %s" % op)
+        mix[op] = float(weight)
+    return mix
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Replay a mix of read queries against built databases")
+    argparser.add_argument("command", choices=["log", "run"])
+    argparser.add_argument("databases", nargs='+', help="the log is drawn from the first one")
+    argparser.add_argument("-n", type=int, default=2000, help="requests to generate (default: %(default)s)")
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--mix", type=_mix, default=MIX,
+                           help="operation weights, e.g. lookup=50,search=50 (default: %s)" % \
+                                ','.join('%s=%d' % kv for kv in MIX.items()))
+    argparser.add_argument("-o", "--output", help="log: file to write the query log to (default: stdout)")
+    argparser.add_argument("--log", help="run: replay this query log instead of generating one")
+    argparser.add_argument("--workers", type=int, default=1, help="run: concurrent workers (default: %(default)s)")
+    argparser.add_argument("--processes", action="store_true", help="run: workers are processes instead of threads")
+    argparser.add_argument("--variant", action="append", default=[],
+                           help="run: also replay against a copy of the first database with this SQL applied")
+    argparser.add_argument("--fts", action="store_true",
+                           help="run: search through the FTS5 index of compressed databases instead of scanning the texts")
+    argparser.add_argument("--warmup", type=int, default=200, help="run: requests replayed once before timing (default: %(default)s)")
+    args = argparser.parse_args()
+
+    if args.log:
+        with open(args.log) as file:
+            log = [json.loads(line) for line in file if line.strip()]
+    else:
+        client = Client(args.databases[0])
+        log = generate(client.conn, args.n, args.seed, args.mix)
+        client.close()
+    if args.command == "log":
+        out = open(args.output, 'w') if args.output else sys.stdout
+        for entry in log:
+            out.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        if args.output:
+            out.close()
+        sys.exit()
+
+    workdir = tempfile.mkdtemp(prefix='ruslinkers-loadtest-')
+    try:
+        names = list(args.databases)
+        if args.variant:
+            names.append(variant(args.databases[0], args.variant, workdir))
+        if args.fts:
+            for path in names:
+                try:
+                    Client(path, fts=True).close()
+                except ValueError as e:
+                    argparser.error(str(e))
+        reports = []
+        for path in names:
+            # Warm the page cache and the statement caches of the first requests
+            _replay(path, log[:args.warmup], args.fts)
+            reports.append(run(path, log, args.workers, args.processes, args.fts))
+        if args.variant:
+            names[-1] = 'variant of %s' % os.path.basename(args.databases[0])
+        print("%d requests, %d %s, search by %s" % (len(log), args.workers, 'processes' if args.processes else 'threads',
+                                                   'full-text index' if args.fts else 'scan'))
+        print_reports(names, reports)
+    finally:
+        shutil.rmtree(workdir)
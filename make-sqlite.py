@@ -1,616 +1,96 @@
-from typing import List, Dict, Set
-
 from sqlalchemy import create_engine
 
 from sqlalchemy import select
 
-from sqlalchemy import ForeignKey,ForeignKeyConstraint
-from sqlalchemy import UniqueConstraint, CheckConstraint
-from sqlalchemy import Table
-from sqlalchemy import Column
-from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy.orm import Mapped
-from sqlalchemy.orm import mapped_column
-from sqlalchemy.orm import relationship
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm import attribute_keyed_dict
-
-from sqlalchemy import event, DDL
 
 # import sqlalchemy as db
 import sqlalchemy_utils as db_utils
 # from sqlalchemy.orm import declarative_base, sessionmaker, relationship, backref
 
-from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.ext.associationproxy import AssociationProxy
+from models import *
 
 DATA = "data_aug2024.csv"
 SYNTAX = "syntax_aug2024.csv"
 FILENAME = "ruslinkers-new4"
 
-# Database model
-class Base(DeclarativeBase):
-    pass
-
-# EXAMPLES
-
-# Examples can illustrate units, parameter values of units, and parameter values of forms
-
-examples_to_unit_parametervalues = Table(
-    "examples_to_unit_parametervalues",
-    Base.metadata,
-    Column("example_id", ForeignKey("examples.id"), primary_key=True),
-    Column("unit_id", primary_key=True),
-    Column("parametervalue_id", primary_key=True),
-    ForeignKeyConstraint(
-        ["unit_id","parametervalue_id"],
-        ["units_to_parametervalues.unit_id", "units_to_parametervalues.parametervalue_id"]
-    )
-)
-
-examples_to_form_parametervalues = Table(
-    "examples_to_form_parametervalues",
-    Base.metadata,
-    Column("example_id", ForeignKey("examples.id"), primary_key=True),
-    Column("form_id", primary_key=True),
-    Column("parametervalue_id", primary_key=True),
-    ForeignKeyConstraint(
-        ["form_id","parametervalue_id"],
-        ["forms_to_parametervalues.form_id", "forms_to_parametervalues.parametervalue_id"]
-    )
-)
-
-examples_to_units = Table(
-    "examples_to_units",
-    Base.metadata,
-    Column("example_id", ForeignKey("examples.id"), primary_key=True),
-    Column("unit_id", ForeignKey("units.id"), primary_key=True)
-)
-
-examples_to_forms = Table(
-    "examples_to_forms",
-    Base.metadata,
-    Column("example_id", ForeignKey("examples.id"), primary_key=True),
-    Column("form_id", ForeignKey("forms.id"), primary_key=True)
-)
-
-class Example(Base):
-    __tablename__ = 'examples'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    text: Mapped[str]
-
-# SOURCES
-
-# Sources can be related to units and meanings (possibly also examples)
-
-sources_to_units = Table(
-    "sources_to_units",
-    Base.metadata,
-    Column("source_id", ForeignKey("sources.id"), primary_key=True),
-    Column("unit_id", ForeignKey("units.id"), primary_key=True)
-)
-
-class Source(Base):
-    __tablename__ = 'sources'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    biblio: Mapped[str]
-    keyword: Mapped[str] = mapped_column(unique=True)
-
-# SEMANTIC FIELDS
-
-class Semfield(Base):
-    __tablename__ = 'semfields'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    name: Mapped[str]
-    keyword: Mapped[str] = mapped_column(unique=True)
-
-    subfields: Mapped[Set["Subfield"]] = relationship(back_populates="semfield")
-
-class Subfield(Base):
-    __tablename__ = 'subfields'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    name: Mapped[str]
-    keyword: Mapped[str] = mapped_column(unique=True)
-
-    semfield_id: Mapped[int]  = mapped_column(ForeignKey('semfields.id'))
-    semfield: Mapped["Semfield"] = relationship(back_populates="subfields")
-
-
-units_to_semfields = Table(
-    "units_to_semfields",
-    Base.metadata,
-    Column("unit_id", ForeignKey("units.id"), primary_key=True),
-    Column("semfield_id", ForeignKey("semfields.id"), primary_key=True)
-)
-
-units_to_subfields = Table(
-    "units_to_subfields",
-    Base.metadata,
-    Column("unit_id", ForeignKey("units.id"), primary_key=True),
-    Column("subfield_id", ForeignKey("subfields.id"), primary_key=True)
-)
-
-# For additional fields associated with specific dictionaries
-meanings_to_semfields = Table(
-    "meanings_to_semfields",
-    Base.metadata,
-    Column("meaning_id", ForeignKey("meanings.id"), primary_key=True),
-    Column("semfield_id", ForeignKey("semfields.id"), primary_key=True)
-)
-
-units_to_subfields = Table(
-    "meanings_to_subfields",
-    Base.metadata,
-    Column("meaning_id", ForeignKey("units.id"), primary_key=True),
-    Column("subfield_id", ForeignKey("subfields.id"), primary_key=True)
-)
-
-# class UnitToSemfield(Base):
-#     __tablename__ = 'units_to_semfields'
-
-#     unit_to_semfield_id: Mapped[int] = mapped_column(primary_key=True)
-    
-#     semfield_id = db.Column(db.Integer, db.ForeignKey('semfields.semfield_id'), nullable=False)
-#     subfield_id = db.Column(db.Integer, db.ForeignKey('subfields.subfield_id')) # Only if there's a subfield
-
-# COMMENTS
-
-class Comment(Base):
-    __tablename__ = 'comments'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    text: Mapped[str]
-    hidden: Mapped[bool] = mapped_column(default=True)
-
-    # unit_id: Mapped[int] = mapped_column(ForeignKey("units.id"))
-    # unit: Mapped["Unit"] = relationship(back_populates='comments')
-
-comments_to_units = Table(
-    "comments_to_units",
-    Base.metadata,
-    Column("comment_id", ForeignKey("comments.id"), primary_key=True),
-    Column("unit_id", ForeignKey("units.id"), primary_key=True)
-)
-
-comments_to_unit_parametervalues = Table(
-    "comments_to_unit_parametervalues",
-    Base.metadata,
-    Column("comment_id", ForeignKey("comments.id"), primary_key=True),
-    Column("unit_id", primary_key=True),
-    Column("parametervalue_id", primary_key=True),
-    ForeignKeyConstraint(
-        ["unit_id","parametervalue_id"],
-        ["units_to_parametervalues.unit_id", "units_to_parametervalues.parametervalue_id"]
-    )
-)
-
-comments_to_form_parametervalues = Table(
-    "comments_to_form_parametervalues",
-    Base.metadata,
-    Column("comment_id", ForeignKey("comments.id"), primary_key=True),
-    Column("form_id", primary_key=True),
-    Column("parametervalue_id", primary_key=True),
-    ForeignKeyConstraint(
-        ["form_id","parametervalue_id"],
-        ["forms_to_parametervalues.form_id", "forms_to_parametervalues.parametervalue_id"]
-    )
-)
-
-# PARAMETERS
-
-class Parameter(Base):
-    __tablename__ = "parameters"
-
-    Unit = 1
-    Form = 2
-    
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    name: Mapped[str]
-    keyword: Mapped[str] = mapped_column(unique=True)
-    description: Mapped[str] = mapped_column(default = "INSERT TEXT HERE")
-
-    hidden: Mapped[bool] = mapped_column(default=False)
-    singleval: Mapped[bool] = mapped_column(default=True) # If parameter can have only one value
-    semantic: Mapped[bool] = mapped_column(default=False) # If semantic, otherwise syntactic
-    target: Mapped[str] = mapped_column(CheckConstraint("target = 1 OR target = 2"), default=1) # 1 = Unit, 2 = Form
-
-    values: Mapped[Set["ParameterValue"]] = relationship(back_populates='parameter',
-                                                         cascade='all,delete-orphan')
-
-class ParameterValue(Base): # Individual values a parameter can take
-    __tablename__ = "parametervalues"
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    name: Mapped[str]
-    keyword: Mapped[str]
-    description: Mapped[str] = mapped_column(default = "INSERT TEXT HERE")    
-
-    parameter_id: Mapped[int] = mapped_column(ForeignKey("parameters.id"))
-    parameter: Mapped["Parameter"] = relationship(back_populates='values')
-
-    __table_args__ = (UniqueConstraint('keyword', 'parameter_id'),
-                     ) # Ensure that each parameter value is unique within the scope of one parameter
-
-class TextParameter(Base): # Parameters whose values are free-form text
-    __tablename__ = 'textparameters'
-
-    Unit = 1
-    Form = 2
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    name: Mapped[str]
-    keyword: Mapped[str] = mapped_column(unique=True)
-    description: Mapped[str] = mapped_column(default = "INSERT TEXT HERE")
-
-    hidden: Mapped[bool] = mapped_column(default=False)
-    target: Mapped[str] = mapped_column(CheckConstraint("target = 1 OR target = 2"), default=1)
-
-# Parameter mappings
-
-class UnitToParameterValue(Base):
-    __tablename__ = 'units_to_parametervalues' # Units are mapped to parameter values
-
-    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
-    unit: Mapped["Unit"] = relationship(back_populates="parametervalue_mappings")
-
-    parametervalue_id: Mapped[int] = mapped_column(ForeignKey('parametervalues.id'), primary_key=True)
-    parametervalue: Mapped["ParameterValue"] = relationship()
-    
-    parameter: AssociationProxy["Parameter"] = association_proxy("parametervalue", "parameter")
-    # parameter_kw: AssociationProxy["ParameterValue"] = association_proxy("parametervalue", "parameter_kw")
-
-    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_unit_parametervalues)
-    comments: Mapped[Set["Comment"]] = relationship(secondary=comments_to_unit_parametervalues,
-                                                    cascade='all,delete-orphan')
-    # examples = relationship('Example', backref='param') Make a separate linking table
-
-class FormToParameterValue(Base):
-    __tablename__ = 'forms_to_parametervalues' # mainly for correlatives, but perhaps also for others
-
-    form_id: Mapped[int] = mapped_column(ForeignKey('forms.id'), primary_key=True)
-    form: Mapped["Form"] = relationship(back_populates='parametervalue_mappings')
-
-    parametervalue_id: Mapped[int] = mapped_column(ForeignKey('parametervalues.id'), primary_key=True) # Maybe add constraints that ensure that correct parameters are chosen
-    parametervalue: Mapped["ParameterValue"] = relationship()
-
-    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_form_parametervalues)
-    comments: Mapped[Set["Comment"]] = relationship(secondary=comments_to_form_parametervalues,
-                                                    cascade='all,delete-orphan')
-
-class UnitToTextParameter(Base):
-    __tablename__ = 'units_to_textparametervalues' # For text parameters, you just map parameters to text values
-
-    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
-    unit: Mapped["Unit"] = relationship(back_populates="textparametervalues")
-
-    parameter_id: Mapped[int] = mapped_column(ForeignKey('textparameters.id'), primary_key=True)
-    parameter: Mapped["TextParameter"] = relationship()
-
-    value: Mapped[str]
-
-class FormToTextParameter(Base):
-    __tablename__ = 'forms_to_textparametervalues' # For text parameters, you just map parameters to text values
-
-    form_id: Mapped[int] = mapped_column(ForeignKey('forms.id'), primary_key=True)
-    form: Mapped["Form"] = relationship(back_populates="textparametervalues")
-
-    parameter_id: Mapped[int] = mapped_column(ForeignKey('textparameters.id'), primary_key=True)
-    parameter: Mapped["TextParameter"] = relationship()
-
-    value: Mapped[str]    
-
-# UNITS
-
-class Unit(Base):
-    __tablename__ = 'units'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    linker: Mapped[str] # Head word (not treated as Form)
-
-    #internal_id = db.Column(db.Integer)
-    status: Mapped[bool] = mapped_column(default=True)  # will be found in dictionary search (1) or not (?)
-
-    # Hardcoded parameters
-    style: Mapped[str] = mapped_column(nullable=True)
-    sem_comment: Mapped[str] = mapped_column(nullable=True)
-
-    # Connections between units
-    links: Mapped[Set["UnitToUnit"]] = relationship(back_populates="source", foreign_keys='UnitToUnit.source_id')
-
-    # Semantic fields
-    semfield_id: Mapped[int] = mapped_column(ForeignKey("semfields.id"))
-    semfield: Mapped['Semfield'] = relationship()
-    extra_semfields: Mapped[Set["Semfield"]] = relationship(secondary=units_to_semfields)
-    subfields: Mapped[Set["Subfield"]] = relationship(secondary=units_to_subfields) # Maybe somehow check that subfields belong to the semfields (main and extra)?
-
-    forms: Mapped[Set["Form"]] = relationship(back_populates='unit',cascade='all,delete-orphan')
-    meanings: Mapped[Set["Meaning"]] = relationship(back_populates='unit',cascade='all,delete-orphan')
-    # log = relationship('Entry_logs', backref='unit', lazy=True)
-    # comments = db.relationship('Unit_comments', backref='unit', lazy=True)
-    # pictures = db.relationship('Unit_pictures', backref='unit', lazy=True)
-    parametervalue_mappings: Mapped[Set["UnitToParameterValue"]] = relationship(back_populates='unit',
-                                                                                cascade='all,delete-orphan')
-    parametervalues: AssociationProxy[Set["ParameterValue"]] = association_proxy(
-        "parametervalue_mappings",
-        "parametervalue",
-        creator=lambda param: UnitToParameterValue(parametervalue = param)
-        )
-    parameters: AssociationProxy[Set["Parameter"]] = association_proxy("parametervalue_mappings", "parameter")
-
-    textparametervalues: Mapped[Set["UnitToTextParameter"]] = relationship(back_populates='unit',
-                                                                           cascade='all,delete-orphan')
-    textparameters: AssociationProxy[Set["TextParameter"]] = association_proxy("textparametervalues", "parameter")
-
-    def get_values_for_parameter(self, param: Parameter) -> List[ParameterValue]:
-        if param.target is not Parameter.Unit:
-            raise ValueError("Parameter %s does not classify units" % param.keyword)
-        return [x for x in param.values if x in self.parametervalues]    
-
-    comments: Mapped[Set["Comment"]] = relationship(secondary=comments_to_units,
-                                                    cascade='all,delete-orphan')
-    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_units)
-    sources: Mapped[Set["Source"]] = relationship(secondary=sources_to_units)
-
-    # __table_args__ = (UniqueConstraint('linker', 'semfield_id'),
-    #                  ) # Ensures that the combination of linker and semantic field is unique
-
-class UnitLinkType(Base):
-    __tablename__ = 'unitlinktypes'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    
-    name: Mapped[str]
-    keyword: Mapped[str] = mapped_column(unique=True)
-
-class UnitToUnit(Base): #connections between units
-    __tablename__ = 'units_to_units'
-
-    # id: Mapped[int] = mapped_column(primary_key=True)
-
-    # rank = db.Column(db.Integer, nullable=True)
-
-    source_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
-    target_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
-    unitlinktype_id: Mapped[int] = mapped_column(ForeignKey('unitlinktypes.id'), primary_key=True)
-
-    source: Mapped["Unit"] = relationship(foreign_keys=[source_id], back_populates="links")
-    target: Mapped["Unit"] = relationship(foreign_keys=[target_id])
-    unitlinktype: Mapped["UnitLinkType"] = relationship()
-
-# class Label(Base):
-#     __tablename__ = 'labels' # Assign a parameter value to a Unit
-
-#     label_id = db.Column(db.Integer, primary_key=True)
-#     label = db.Column(db.Text, unique=True)
-    # decode = db.Column(db.Text)
-    # rank = db.Column(db.Integer, unique=True)
-    # label_type = db.Column(db.Integer, unique=False) # what column is this label from? 1 -- number of components, 2 -- position, 3 -- ...        
-
-# FORMS
-
-class Form(Base):
-    __tablename__ = 'forms'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'))
-    unit: Mapped["Unit"] = relationship(back_populates="forms")
-
-    formtype_id: Mapped[int] = mapped_column(ForeignKey('formtypes.id'))
-    formtype: Mapped["FormType"] = relationship(back_populates="forms")
-
-    # gloss_id = db.Column(db.Integer, db.ForeignKey('glosses.gloss_id'), nullable=False)
-    text: Mapped[str]
-
-    parametervalue_mappings: Mapped[Set["FormToParameterValue"]] = relationship(back_populates='form',
-                                                                                cascade='all,delete-orphan')
-    parametervalues: AssociationProxy[Set["ParameterValue"]] = association_proxy(
-        "parametervalue_mappings", 
-        "parametervalue", 
-        creator = lambda param: FormToParameterValue(parametervalue = param)
-        )
-    parameters: AssociationProxy[Set["Parameter"]] = association_proxy("parametervalue_mappings", "parameter")
-
-    textparametervalues: Mapped[Set["FormToTextParameter"]] = relationship(back_populates='form',
-                                                                           cascade='all,delete-orphan')
-    textparameters: AssociationProxy[Set["TextParameter"]] = association_proxy("textparametervalues", "parameter")
-
-    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_forms)
-
-    # __table_args__ = (UniqueConstraint('unit_id', 'formtype_id', "text"),
-    #                  ) # Only one unit-type mapping for a given text value
-
-    def get_values_for_parameter(self, param: Parameter) -> List[ParameterValue]:
-        if param.target is not Parameter.Form:
-            raise ValueError("Parameter %s does not classify forms" % param.keyword)
-        return [x for x in param.values if x in self.parametervalues]
-
-parameters_to_formtypes = Table(
-    "parameters_to_formtypes",
-    Base.metadata,
-    Column("parameter_id", ForeignKey("parameters.id")),
-    Column("formtype_id", ForeignKey("formtypes.id"))
-)
-
-textparameters_to_formtypes = Table(
-    "textparameters_to_formtypes",
-    Base.metadata,
-    Column("textparameter_id", ForeignKey("parameters.id")),
-    Column("formtype_id", ForeignKey("formtypes.id"))
-)
-
-class FormType(Base):
-    __tablename__ = 'formtypes' # linker, correl, phonvar, mainpart
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    
-    name: Mapped[str]
-    keyword: Mapped[str] = mapped_column(unique=True)
-
-    forms: Mapped[Set["Form"]] = relationship(back_populates="formtype")
-    parameters: Mapped[Set["Parameter"]] = relationship(secondary=parameters_to_formtypes)
-
-# MEANINGS
-
-class Meaning(Base):
-    __tablename__ = 'meanings'
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-
-    meaning: Mapped[str]
-    pos: Mapped[str]
-    pos_type: Mapped[str]
-    other_senses: Mapped[str]
-    other_pos: Mapped[str]
-
-    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'))
-    unit: Mapped["Unit"] = relationship()
-
-    source_id: Mapped[int] = mapped_column(ForeignKey('sources.id'))
-    source: Mapped["Source"] = relationship()
-
-# Various additional triggers for constraints that cannot be handled via UNIQUE, CHECK etc.
-
-# Ensures that single-valued parameters cannot be assigned more than one value for a unit
-event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_units_to_parametervalues_INSERT_singleval
-	AFTER INSERT
-	ON units_to_parametervalues
-	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
-		 (SELECT COUNT(*) from units_to_parametervalues
-			WHERE 	unit_id = NEW.unit_id AND
-					parametervalue_id IN (SELECT id FROM parametervalues 
-											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued unit parameter.');
-END;'''))
-event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_units_to_parametervalues_UPDATE_singleval
-	AFTER INSERT
-	ON units_to_parametervalues
-	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
-		 (SELECT COUNT(*) from units_to_parametervalues
-			WHERE 	unit_id = NEW.unit_id AND
-					parametervalue_id IN (SELECT id FROM parametervalues 
-											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued unit parameter.');
-END;'''))
-
-# Ensures that form parameters cannot be assigned to units
-event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_units_to_parametervalues_INSERT_unitval
-	AFTER INSERT
-	ON units_to_parametervalues
-	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
-					INNER JOIN parameters AS p
-					ON pv.parameter_id = p.id
-					WHERE pv.id = NEW.parametervalue_id AND p.target = 2)
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Form parameter to Unit.');
-END;'''))
-event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_units_to_parametervalues_UPDATE_unitval
-	AFTER UPDATE
-	ON units_to_parametervalues
-	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
-					INNER JOIN parameters AS p
-					ON pv.parameter_id = p.id
-					WHERE pv.id = NEW.parametervalue_id AND p.target = 2)
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Form parameter to Unit.');
-END;'''))
-
-# Same stuff for form parameters
-event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_forms_to_parametervalues_INSERT_singleval
-	AFTER INSERT
-	ON forms_to_parametervalues
-	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
-		 (SELECT COUNT(*) from forms_to_parametervalues
-			WHERE 	form_id = NEW.form_id AND
-					parametervalue_id IN (SELECT id FROM parametervalues 
-											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued form parameter.');
-END;'''))
-event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_forms_to_parametervalues_UPDATE_singleval
-	AFTER INSERT
-	ON forms_to_parametervalues
-	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
-		 (SELECT COUNT(*) from forms_to_parametervalues
-			WHERE 	form_id = NEW.form_id AND
-					parametervalue_id IN (SELECT id FROM parametervalues 
-											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued form parameter.');
-END;'''))
-event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_forms_to_parametervalues_INSERT_formval
-	AFTER INSERT
-	ON forms_to_parametervalues
-	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
-					INNER JOIN parameters AS p
-					ON pv.parameter_id = p.id
-					WHERE pv.id = NEW.parametervalue_id AND p.target = 1)
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Unit parameter to Form.');
-END;'''))
-event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_forms_to_parametervalues_UPDATE_formval
-	AFTER UPDATE
-	ON forms_to_parametervalues
-	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
-					INNER JOIN parameters AS p
-					ON pv.parameter_id = p.id
-					WHERE pv.id = NEW.parametervalue_id AND p.target = 1)
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Unit parameter to Form.');
-END;'''))
-
-# Ensure that form parameters are assigned to correct form types
-event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_forms_to_parametervalues_INSERT_formtype
-	AFTER INSERT
-	ON forms_to_parametervalues
-	WHEN NOT EXISTS (SELECT 1 FROM parametervalues AS pv
-				INNER JOIN parameters_to_formtypes AS pft
-					ON pft.parameter_id = pv.parameter_id
-				INNER JOIN forms AS f
-					ON f.formtype_id = pft.formtype_id
-				WHERE f.id = NEW.form_id AND pv.id = NEW.parametervalue_id)
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: Incorrect parameter value for form type.');
-END;'''))
-event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
-CREATE TRIGGER TR_forms_to_parametervalues_UPDATE_formtype
-	AFTER UPDATE
-	ON forms_to_parametervalues
-	WHEN NOT EXISTS (SELECT 1 FROM parametervalues AS pv
-				INNER JOIN parameters_to_formtypes AS pft
-					ON pft.parameter_id = pv.parameter_id
-				INNER JOIN forms AS f
-					ON f.formtype_id = pft.formtype_id
-				WHERE f.id = NEW.form_id AND pv.id = NEW.parametervalue_id)
-BEGIN
-	SELECT RAISE(ABORT, 'ERROR: Incorrect parameter value for form type.');
-END;'''))
-
 # Begin script
 
-import csv
+import argparse
+
+argparser = argparse.ArgumentParser(description="Build the RusLinkers SQLite database from the CSV tables")
+argparser.add_argument("--syntax", default=SYNTAX, help="syntactic table (default: %(default)s)")
+argparser.add_argument("--data", default=DATA, help="dictionary table (default: %(default)s)")
+argparser.add_argument("--output", default=FILENAME, help="database file name without .db (default: %(default)s)")
+argparser.add_argument("--release", help="also add the build to a release store under this name")
+argparser.add_argument("--store", default="ruslinkers-releases.db",
+                       help="release store used with --release (default: %(default)s)")
+argparser.add_argument("--jobs", type=int, default=1,
+                       help="build shards partitioned by semantic field in this many processes and merge them")
+argparser.add_argument("--defer-links", action="store_true",
+                       help="store hyperlinks in pending_links instead of resolving them (used for shards)")
+argparser.add_argument("--sources", help="read the list of sources from this dictionary table instead of --data")
+argparser.add_argument("--sequential-ids", action="store_true",
+                       help="keep the ids in build order instead of deriving them from content")
+argparser.add_argument("--watch", action="store_true",
+                       help="keep running and apply changes of the tables to the database as they are saved")
+argparser.add_argument("--merge-duplicates", action="store_true",
+                       help="merge examples and comments that are identical up to source tags, punctuation and ё")
+argparser.add_argument("--no-parse-cache", action="store_true",
+                       help="parse the CSV tables without reading or writing the parse cache")
+argparser.add_argument("--compress", action="store_true",
+                       help="store long texts compressed with trained zstd dictionaries (requires zstandard)")
+args = argparser.parse_args()
+
+SYNTAX = args.syntax
+DATA = args.data
+FILENAME = args.output
+
+def finish_build():
+    if not args.defer_links: # shards are merged first
+        if not args.sequential_ids:
+            import stable_ids
+            print("Stable ids assigned to %d entities" % stable_ids.stabilize('%s.db' % FILENAME))
+        import neardup
+        stats, merged = neardup.store_database('%s.db' % FILENAME, args.merge_duplicates)
+        for table, (clusters, rows) in stats.items():
+            print("Near duplicates in %s: %d clusters of %d rows%s" % (table, clusters, rows,
+                  ", %d rows merged" % merged[table] if merged else ""))
+        import highlights
+        print("Linker highlights: %d spans in examples" % highlights.store_database('%s.db' % FILENAME))
+        import closure
+        print("Field closure: %d unit_fields rows" % closure.build_database('%s.db' % FILENAME))
+        import collation
+        print("Browse index: %d linkers and forms" % collation.build_database('%s.db' % FILENAME))
+        import spotter
+        print("Linker spotter written to %s" % spotter.compile_database('%s.db' % FILENAME))
+    # The store keeps plain text: compressed values depend on the dictionaries of the build
+    if args.release:
+        import releases
+        store = releases.connect(args.store)
+        stats = releases.add_release(store, '%s.db' % FILENAME, args.release)
+        store.close()
+        print("Release %s added to %s: %d rows added, %d rows closed, %d rows shared, %d changes logged" % \
+            (args.release, args.store, stats["added"], stats["closed"], stats["kept"], stats["changes"]))
+    if args.compress:
+        import compression
+        for column, (before, after) in compression.compress_database('%s.db' % FILENAME).items():
+            print("Compressed %s: %d -> %d bytes" % (column, before, after))
+
+if args.watch:
+    if args.compress or args.release or args.sequential_ids or args.defer_links or args.merge_duplicates:
+        argparser.error("--watch keeps a plain preview database and cannot be combined with other build modes")
+    import sys
+    import watch
+    watch.watch(SYNTAX, DATA, FILENAME, args.jobs)
+    sys.exit()
+
+if args.jobs > 1:
+    import sys
+    import shards
+    shards.build(SYNTAX, DATA, FILENAME, args.jobs)
+    finish_build()
+    sys.exit()
 
 # Create SQLite database engine
 engine = create_engine('sqlite:///%s.db' % FILENAME)
@@ -627,13 +107,10 @@ Base.metadata.create_all(engine)
 Session = sessionmaker(bind=engine)
 session = Session()
 
-with open(SYNTAX) as file:
-    reader = csv.DictReader(file, delimiter=',')
-    syntax = list(reader)
+import parse_cache
 
-with open(DATA) as file:
-    reader = csv.DictReader(file, delimiter=',')
-    data = list(reader)
+syntax = parse_cache.read_table(SYNTAX, not args.no_parse_cache)
+data = parse_cache.read_table(DATA, not args.no_parse_cache)
 
 # Create the parameters
 
@@ -667,8 +144,13 @@ dummy_field = Semfield(
     keyword = "dummy"
 ) 
 
-sources = set([x["dict"] for x in data])
-sources.add("ИМК")
+if args.sources:
+    sources_table = parse_cache.read_table(args.sources, not args.no_parse_cache)
+    parse_cache.save(sources_table)
+    sources = dict.fromkeys([x["dict"] for x in sources_table])
+else:
+    sources = dict.fromkeys([x["dict"] for x in data])
+sources["ИМК"] = None
 sources_dict = { }
 
 for sourcename in sources:
@@ -752,24 +234,16 @@ def process_parameter(full_name, column_name, table, hidden = False, singleval =
     )
     session.add(param)
 
-    vals = set([x[column_name] for x in table])
-
-    uniquevals = set()
-
     valdict = { }
 
-    for val in vals:
-        if val != '' and val != 'NA':
-            for subval in val.split("; "):
-                if subval not in uniquevals:
-                    parval = ParameterValue(
-                        name = subval,
-                        keyword = subval,
-                        parameter = param
-                    )
-                    param.values.add(parval)
-                    uniquevals.add(subval)
-                    valdict[subval] = parval
+    for subval in table.vocabulary(column_name): # in order of appearance
+        parval = ParameterValue(
+            name = subval,
+            keyword = subval,
+            parameter = param
+        )
+        param.values.add(parval)
+        valdict[subval] = parval
     return param, valdict # return a tuple of parameter and dictionary of its values
 
 synt_params = {}
@@ -914,6 +388,10 @@ metatext_param_no = ParameterValue(
 correl_params["correl.position"] = process_parameter("позиция коррелята", "correl.position", syntax, singleval=False, target=Parameter.Form)
 type_correl.parameters.add(correl_params["correl.position"][0])
 
+# All parameter vocabularies are known now
+parse_cache.save(syntax)
+parse_cache.save(data)
+
 # TEXT PARAMETERS FOR CORRELATIVES
 correl_text_params = {}
 correl_text_params["correl.oblig"] = TextParameter(
@@ -1124,14 +602,16 @@ hyperlink_type = UnitLinkType(
 )
 session.add(hyperlink_type)
 
+pending_links = []
+
 for row in data:
     if row["Non-connector"] != "NA" and row["Non-connector"] != '' and row["Non-connector"] != 'объед':
         continue
     field = session.scalars(select(Semfield).where(Semfield.keyword == row['semfield1_ed'])).first()
     
-    subfields = set()
-    for sf in row["subfield1_ed"].split("; "):
-        subfields.add(session.scalars(select(Subfield).where(Subfield.keyword == sf)).first())
+    subfields = []
+    for sf in dict.fromkeys(row["subfield1_ed"].split("; ")):
+        subfields.append(session.scalars(select(Subfield).where(Subfield.keyword == sf)).first())
     if field is None:
         print('WARNING: No such semantic field %s (unit %s)' % (row["semfield1_ed"], row["form"]))
         continue
@@ -1178,7 +658,9 @@ for row in data:
             )
         )
 
-    if row["hyperlink"] != '' and row["hyperlink"] != 'NA':
+    if row["hyperlink"] != '' and row["hyperlink"] != 'NA' and args.defer_links:
+        pending_links.append((unit, row["hyperlink"], row["semfield1_ed"]))
+    elif row["hyperlink"] != '' and row["hyperlink"] != 'NA':
         refunits = session.scalars(select(Unit).where(Unit.linker == row['hyperlink'])).all()
         if len(refunits) == 0:
             print("WARNING! Referenced unit %s not found" % row["hyperlink"])
@@ -1302,4 +784,17 @@ for row in data:
     # к словарям:
     # pos, type of pos, meaning, other_senses, other_pos
 
-session.commit()
\ No newline at end of file
+session.commit()
+
+# Links whose targets may live in another shard are resolved after merging
+if args.defer_links:
+    with engine.begin() as connection:
+        connection.exec_driver_sql('CREATE TABLE pending_links (source_id INTEGER REFERENCES units(id), hyperlink TEXT, semfield TEXT)')
+        if pending_links:
+            connection.exec_driver_sql('INSERT INTO pending_links VALUES (?, ?, ?)',
+                                       [(unit.id, hyperlink, semfield) for unit, hyperlink, semfield in pending_links])
+
+session.close()
+engine.dispose()
+
+finish_build()
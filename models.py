@@ -0,0 +1,746 @@
+# Database model shared by make-sqlite.py and the tools that read built databases
+
+import sqlite3
+
+from typing import List, Dict, Set
+
+from sqlalchemy import ForeignKey,ForeignKeyConstraint
+from sqlalchemy import UniqueConstraint, CheckConstraint
+from sqlalchemy import Table
+from sqlalchemy import Column
+from sqlalchemy import Index
+from sqlalchemy import JSON
+from sqlalchemy import String, TypeDecorator
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.orm import relationship
+from sqlalchemy.orm import attribute_keyed_dict
+
+from sqlalchemy import event, DDL
+from sqlalchemy.engine import Engine
+
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.ext.associationproxy import AssociationProxy
+
+class Base(DeclarativeBase):
+    pass
+
+class CompressedText(TypeDecorator):
+    """Text column that may hold zstd-compressed values (see compression.py)"""
+    impl = String
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, bytes):
+            import compression
+            return compression.decompress(value)
+        return value
+
+@event.listens_for(Engine, 'connect')
+def _load_dictionaries(dbapi_connection, connection_record):
+    """Load the zstd dictionaries of a compressed database for CompressedText, on every engine"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    if dbapi_connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'zstd_dictionaries'").fetchone():
+        import compression
+        compression.load_dictionaries(dbapi_connection)
+
+# EXAMPLES
+
+# Examples can illustrate units, parameter values of units, and parameter values of forms
+
+examples_to_unit_parametervalues = Table(
+    "examples_to_unit_parametervalues",
+    Base.metadata,
+    Column("example_id", ForeignKey("examples.id"), primary_key=True),
+    Column("unit_id", primary_key=True),
+    Column("parametervalue_id", primary_key=True),
+    ForeignKeyConstraint(
+        ["unit_id","parametervalue_id"],
+        ["units_to_parametervalues.unit_id", "units_to_parametervalues.parametervalue_id"]
+    ),
+    Index("ix_examples_to_unit_parametervalues_unit", "unit_id", "parametervalue_id")
+)
+
+examples_to_form_parametervalues = Table(
+    "examples_to_form_parametervalues",
+    Base.metadata,
+    Column("example_id", ForeignKey("examples.id"), primary_key=True),
+    Column("form_id", primary_key=True),
+    Column("parametervalue_id", primary_key=True),
+    ForeignKeyConstraint(
+        ["form_id","parametervalue_id"],
+        ["forms_to_parametervalues.form_id", "forms_to_parametervalues.parametervalue_id"]
+    ),
+    Index("ix_examples_to_form_parametervalues_form", "form_id", "parametervalue_id")
+)
+
+examples_to_units = Table(
+    "examples_to_units",
+    Base.metadata,
+    Column("example_id", ForeignKey("examples.id"), primary_key=True),
+    Column("unit_id", ForeignKey("units.id"), primary_key=True),
+    Index("ix_examples_to_units_unit", "unit_id")
+)
+
+examples_to_forms = Table(
+    "examples_to_forms",
+    Base.metadata,
+    Column("example_id", ForeignKey("examples.id"), primary_key=True),
+    Column("form_id", ForeignKey("forms.id"), primary_key=True),
+    Index("ix_examples_to_forms_form", "form_id")
+)
+
+class Example(Base):
+    __tablename__ = 'examples'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    text: Mapped[str] = mapped_column(CompressedText)
+
+    highlights: Mapped[List["ExampleHighlight"]] = relationship(order_by="ExampleHighlight.start", viewonly=True)
+
+class ExampleHighlight(Base):
+    __tablename__ = 'example_highlights' # Where a unit linked to the example occurs in its text (see highlights.py)
+
+    example_id: Mapped[int] = mapped_column(ForeignKey('examples.id'), primary_key=True)
+    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
+    start: Mapped[int] = mapped_column(primary_key=True) # character offset
+    length: Mapped[int]
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class ExampleDuplicate(Base):
+    __tablename__ = 'example_duplicates' # Clusters of near-identical examples for review (see neardup.py)
+
+    row_id: Mapped[int] = mapped_column(ForeignKey('examples.id'), primary_key=True)
+    cluster_id: Mapped[int] = mapped_column(ForeignKey('examples.id'), index=True) # row the cluster would be merged into
+    similarity: Mapped[float] # Jaccard similarity of the shingles with that row
+
+# SOURCES
+
+# Sources can be related to units and meanings (possibly also examples)
+
+sources_to_units = Table(
+    "sources_to_units",
+    Base.metadata,
+    Column("source_id", ForeignKey("sources.id"), primary_key=True),
+    Column("unit_id", ForeignKey("units.id"), primary_key=True),
+    Index("ix_sources_to_units_unit", "unit_id")
+)
+
+class Source(Base):
+    __tablename__ = 'sources'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    biblio: Mapped[str]
+    keyword: Mapped[str] = mapped_column(unique=True)
+
+# SEMANTIC FIELDS
+
+class Semfield(Base):
+    __tablename__ = 'semfields'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    name: Mapped[str]
+    keyword: Mapped[str] = mapped_column(unique=True)
+
+    subfields: Mapped[Set["Subfield"]] = relationship(back_populates="semfield")
+
+class Subfield(Base):
+    __tablename__ = 'subfields'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    name: Mapped[str]
+    keyword: Mapped[str] = mapped_column(unique=True)
+
+    semfield_id: Mapped[int]  = mapped_column(ForeignKey('semfields.id'))
+    semfield: Mapped["Semfield"] = relationship(back_populates="subfields")
+
+
+units_to_semfields = Table(
+    "units_to_semfields",
+    Base.metadata,
+    Column("unit_id", ForeignKey("units.id"), primary_key=True),
+    Column("semfield_id", ForeignKey("semfields.id"), primary_key=True)
+)
+
+units_to_subfields = Table(
+    "units_to_subfields",
+    Base.metadata,
+    Column("unit_id", ForeignKey("units.id"), primary_key=True),
+    Column("subfield_id", ForeignKey("subfields.id"), primary_key=True)
+)
+
+# For additional fields associated with specific dictionaries
+meanings_to_semfields = Table(
+    "meanings_to_semfields",
+    Base.metadata,
+    Column("meaning_id", ForeignKey("meanings.id"), primary_key=True),
+    Column("semfield_id", ForeignKey("semfields.id"), primary_key=True)
+)
+
+units_to_subfields = Table(
+    "meanings_to_subfields",
+    Base.metadata,
+    Column("meaning_id", ForeignKey("units.id"), primary_key=True),
+    Column("subfield_id", ForeignKey("subfields.id"), primary_key=True)
+)
+
+# Every unit under every field it belongs to, filled by closure.py after the build.
+# Rows with a NULL subfield_id list the units of a whole field, with their
+# strongest role in it: main (units.semfield_id), extra (units_to_semfields)
+# or sub (one of its subfields); the other rows list the units of a subfield.
+unit_fields = Table(
+    "unit_fields",
+    Base.metadata,
+    Column("semfield_id", ForeignKey("semfields.id"), nullable=False),
+    Column("subfield_id", ForeignKey("subfields.id"), nullable=True),
+    Column("unit_id", ForeignKey("units.id"), nullable=False),
+    Column("role", String, nullable=False),
+    Index("ix_unit_fields_field", "semfield_id", "subfield_id", "unit_id", "role"),
+    Index("ix_unit_fields_unit", "unit_id", "semfield_id", "subfield_id", "role")
+)
+
+# class UnitToSemfield(Base):
+#     __tablename__ = 'units_to_semfields'
+
+#     unit_to_semfield_id: Mapped[int] = mapped_column(primary_key=True)
+    
+#     semfield_id = db.Column(db.Integer, db.ForeignKey('semfields.semfield_id'), nullable=False)
+#     subfield_id = db.Column(db.Integer, db.ForeignKey('subfields.subfield_id')) # Only if there's a subfield
+
+# COMMENTS
+
+class Comment(Base):
+    __tablename__ = 'comments'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    text: Mapped[str] = mapped_column(CompressedText)
+    hidden: Mapped[bool] = mapped_column(default=True)
+
+    # unit_id: Mapped[int] = mapped_column(ForeignKey("units.id"))
+    # unit: Mapped["Unit"] = relationship(back_populates='comments')
+
+class CommentDuplicate(Base):
+    __tablename__ = 'comment_duplicates' # Clusters of near-identical comments for review (see neardup.py)
+
+    row_id: Mapped[int] = mapped_column(ForeignKey('comments.id'), primary_key=True)
+    cluster_id: Mapped[int] = mapped_column(ForeignKey('comments.id'), index=True) # row the cluster would be merged into
+    similarity: Mapped[float] # Jaccard similarity of the shingles with that row
+
+comments_to_units = Table(
+    "comments_to_units",
+    Base.metadata,
+    Column("comment_id", ForeignKey("comments.id"), primary_key=True),
+    Column("unit_id", ForeignKey("units.id"), primary_key=True),
+    Index("ix_comments_to_units_unit", "unit_id")
+)
+
+comments_to_unit_parametervalues = Table(
+    "comments_to_unit_parametervalues",
+    Base.metadata,
+    Column("comment_id", ForeignKey("comments.id"), primary_key=True),
+    Column("unit_id", primary_key=True),
+    Column("parametervalue_id", primary_key=True),
+    ForeignKeyConstraint(
+        ["unit_id","parametervalue_id"],
+        ["units_to_parametervalues.unit_id", "units_to_parametervalues.parametervalue_id"]
+    ),
+    Index("ix_comments_to_unit_parametervalues_unit", "unit_id", "parametervalue_id")
+)
+
+comments_to_form_parametervalues = Table(
+    "comments_to_form_parametervalues",
+    Base.metadata,
+    Column("comment_id", ForeignKey("comments.id"), primary_key=True),
+    Column("form_id", primary_key=True),
+    Column("parametervalue_id", primary_key=True),
+    ForeignKeyConstraint(
+        ["form_id","parametervalue_id"],
+        ["forms_to_parametervalues.form_id", "forms_to_parametervalues.parametervalue_id"]
+    ),
+    Index("ix_comments_to_form_parametervalues_form", "form_id", "parametervalue_id")
+)
+
+# PARAMETERS
+
+class Parameter(Base):
+    __tablename__ = "parameters"
+
+    Unit = 1
+    Form = 2
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    name: Mapped[str]
+    keyword: Mapped[str] = mapped_column(unique=True)
+    description: Mapped[str] = mapped_column(default = "INSERT TEXT HERE")
+
+    hidden: Mapped[bool] = mapped_column(default=False)
+    singleval: Mapped[bool] = mapped_column(default=True) # If parameter can have only one value
+    semantic: Mapped[bool] = mapped_column(default=False) # If semantic, otherwise syntactic
+    target: Mapped[str] = mapped_column(CheckConstraint("target = 1 OR target = 2"), default=1) # 1 = Unit, 2 = Form
+
+    values: Mapped[Set["ParameterValue"]] = relationship(back_populates='parameter',
+                                                         cascade='all,delete-orphan')
+
+class ParameterValue(Base): # Individual values a parameter can take
+    __tablename__ = "parametervalues"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    name: Mapped[str]
+    keyword: Mapped[str]
+    description: Mapped[str] = mapped_column(default = "INSERT TEXT HERE")    
+
+    parameter_id: Mapped[int] = mapped_column(ForeignKey("parameters.id"))
+    parameter: Mapped["Parameter"] = relationship(back_populates='values')
+
+    __table_args__ = (UniqueConstraint('keyword', 'parameter_id'),
+                     ) # Ensure that each parameter value is unique within the scope of one parameter
+
+class TextParameter(Base): # Parameters whose values are free-form text
+    __tablename__ = 'textparameters'
+
+    Unit = 1
+    Form = 2
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    name: Mapped[str]
+    keyword: Mapped[str] = mapped_column(unique=True)
+    description: Mapped[str] = mapped_column(default = "INSERT TEXT HERE")
+
+    hidden: Mapped[bool] = mapped_column(default=False)
+    target: Mapped[str] = mapped_column(CheckConstraint("target = 1 OR target = 2"), default=1)
+
+# Parameter mappings
+
+class UnitToParameterValue(Base):
+    __tablename__ = 'units_to_parametervalues' # Units are mapped to parameter values
+
+    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
+    unit: Mapped["Unit"] = relationship(back_populates="parametervalue_mappings")
+
+    parametervalue_id: Mapped[int] = mapped_column(ForeignKey('parametervalues.id'), primary_key=True)
+    parametervalue: Mapped["ParameterValue"] = relationship()
+    
+    parameter: AssociationProxy["Parameter"] = association_proxy("parametervalue", "parameter")
+    # parameter_kw: AssociationProxy["ParameterValue"] = association_proxy("parametervalue", "parameter_kw")
+
+    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_unit_parametervalues)
+    comments: Mapped[Set["Comment"]] = relationship(secondary=comments_to_unit_parametervalues,
+                                                    cascade='all')
+    # examples = relationship('Example', backref='param') Make a separate linking table
+
+class FormToParameterValue(Base):
+    __tablename__ = 'forms_to_parametervalues' # mainly for correlatives, but perhaps also for others
+
+    form_id: Mapped[int] = mapped_column(ForeignKey('forms.id'), primary_key=True)
+    form: Mapped["Form"] = relationship(back_populates='parametervalue_mappings')
+
+    parametervalue_id: Mapped[int] = mapped_column(ForeignKey('parametervalues.id'), primary_key=True) # Maybe add constraints that ensure that correct parameters are chosen
+    parametervalue: Mapped["ParameterValue"] = relationship()
+
+    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_form_parametervalues)
+    comments: Mapped[Set["Comment"]] = relationship(secondary=comments_to_form_parametervalues,
+                                                    cascade='all')
+
+class UnitToTextParameter(Base):
+    __tablename__ = 'units_to_textparametervalues' # For text parameters, you just map parameters to text values
+
+    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
+    unit: Mapped["Unit"] = relationship(back_populates="textparametervalues")
+
+    parameter_id: Mapped[int] = mapped_column(ForeignKey('textparameters.id'), primary_key=True)
+    parameter: Mapped["TextParameter"] = relationship()
+
+    value: Mapped[str]
+
+class FormToTextParameter(Base):
+    __tablename__ = 'forms_to_textparametervalues' # For text parameters, you just map parameters to text values
+
+    form_id: Mapped[int] = mapped_column(ForeignKey('forms.id'), primary_key=True)
+    form: Mapped["Form"] = relationship(back_populates="textparametervalues")
+
+    parameter_id: Mapped[int] = mapped_column(ForeignKey('textparameters.id'), primary_key=True)
+    parameter: Mapped["TextParameter"] = relationship()
+
+    value: Mapped[str]    
+
+# UNITS
+
+class Unit(Base):
+    __tablename__ = 'units'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    linker: Mapped[str] # Head word (not treated as Form)
+
+    #internal_id = db.Column(db.Integer)
+    status: Mapped[bool] = mapped_column(default=True)  # will be found in dictionary search (1) or not (?)
+
+    # Hardcoded parameters
+    style: Mapped[str] = mapped_column(nullable=True)
+    sem_comment: Mapped[str] = mapped_column(CompressedText, nullable=True)
+
+    # Connections between units
+    links: Mapped[Set["UnitToUnit"]] = relationship(back_populates="source", foreign_keys='UnitToUnit.source_id')
+
+    # Semantic fields
+    semfield_id: Mapped[int] = mapped_column(ForeignKey("semfields.id"))
+    semfield: Mapped['Semfield'] = relationship()
+    extra_semfields: Mapped[Set["Semfield"]] = relationship(secondary=units_to_semfields)
+    subfields: Mapped[Set["Subfield"]] = relationship(secondary=units_to_subfields) # Maybe somehow check that subfields belong to the semfields (main and extra)?
+
+    forms: Mapped[Set["Form"]] = relationship(back_populates='unit',cascade='all,delete-orphan')
+    meanings: Mapped[Set["Meaning"]] = relationship(back_populates='unit',cascade='all,delete-orphan')
+    # log = relationship('Entry_logs', backref='unit', lazy=True)
+    # comments = db.relationship('Unit_comments', backref='unit', lazy=True)
+    # pictures = db.relationship('Unit_pictures', backref='unit', lazy=True)
+    parametervalue_mappings: Mapped[Set["UnitToParameterValue"]] = relationship(back_populates='unit',
+                                                                                cascade='all,delete-orphan')
+    parametervalues: AssociationProxy[Set["ParameterValue"]] = association_proxy(
+        "parametervalue_mappings",
+        "parametervalue",
+        creator=lambda param: UnitToParameterValue(parametervalue = param)
+        )
+    parameters: AssociationProxy[Set["Parameter"]] = association_proxy("parametervalue_mappings", "parameter")
+
+    textparametervalues: Mapped[Set["UnitToTextParameter"]] = relationship(back_populates='unit',
+                                                                           cascade='all,delete-orphan')
+    textparameters: AssociationProxy[Set["TextParameter"]] = association_proxy("textparametervalues", "parameter")
+
+    # Parameter keyword -> value keywords, kept in sync with units_to_parametervalues by triggers
+    parametermap: Mapped[Dict[str, List[str]]] = mapped_column(JSON, default=dict)
+
+    def get_value_keywords(self, keyword: str) -> List[str]:
+        return self.parametermap.get(keyword, []) if self.parametermap else []
+
+    def get_values_for_parameter(self, param: Parameter) -> List[ParameterValue]:
+        if int(param.target) != Parameter.Unit:
+            raise ValueError("Parameter %s does not classify units" % param.keyword)
+        values = {x.keyword: x for x in param.values}
+        return [values[kw] for kw in self.get_value_keywords(param.keyword)]
+
+    comments: Mapped[Set["Comment"]] = relationship(secondary=comments_to_units,
+                                                    cascade='all')
+    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_units)
+    sources: Mapped[Set["Source"]] = relationship(secondary=sources_to_units)
+
+    # __table_args__ = (UniqueConstraint('linker', 'semfield_id'),
+    #                  ) # Ensures that the combination of linker and semantic field is unique
+
+class UnitLinkType(Base):
+    __tablename__ = 'unitlinktypes'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    
+    name: Mapped[str]
+    keyword: Mapped[str] = mapped_column(unique=True)
+
+class UnitToUnit(Base): #connections between units
+    __tablename__ = 'units_to_units'
+
+    # id: Mapped[int] = mapped_column(primary_key=True)
+
+    # rank = db.Column(db.Integer, nullable=True)
+
+    source_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
+    target_id: Mapped[int] = mapped_column(ForeignKey('units.id'), primary_key=True)
+    unitlinktype_id: Mapped[int] = mapped_column(ForeignKey('unitlinktypes.id'), primary_key=True)
+
+    source: Mapped["Unit"] = relationship(foreign_keys=[source_id], back_populates="links")
+    target: Mapped["Unit"] = relationship(foreign_keys=[target_id])
+    unitlinktype: Mapped["UnitLinkType"] = relationship()
+
+# class Label(Base):
+#     __tablename__ = 'labels' # Assign a parameter value to a Unit
+
+#     label_id = db.Column(db.Integer, primary_key=True)
+#     label = db.Column(db.Text, unique=True)
+    # decode = db.Column(db.Text)
+    # rank = db.Column(db.Integer, unique=True)
+    # label_type = db.Column(db.Integer, unique=False) # what column is this label from? 1 -- number of components, 2 -- position, 3 -- ...        
+
+# FORMS
+
+class Form(Base):
+    __tablename__ = 'forms'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'), index=True)
+    unit: Mapped["Unit"] = relationship(back_populates="forms")
+
+    formtype_id: Mapped[int] = mapped_column(ForeignKey('formtypes.id'))
+    formtype: Mapped["FormType"] = relationship(back_populates="forms")
+
+    # gloss_id = db.Column(db.Integer, db.ForeignKey('glosses.gloss_id'), nullable=False)
+    text: Mapped[str]
+
+    parametervalue_mappings: Mapped[Set["FormToParameterValue"]] = relationship(back_populates='form',
+                                                                                cascade='all,delete-orphan')
+    parametervalues: AssociationProxy[Set["ParameterValue"]] = association_proxy(
+        "parametervalue_mappings", 
+        "parametervalue", 
+        creator = lambda param: FormToParameterValue(parametervalue = param)
+        )
+    parameters: AssociationProxy[Set["Parameter"]] = association_proxy("parametervalue_mappings", "parameter")
+
+    textparametervalues: Mapped[Set["FormToTextParameter"]] = relationship(back_populates='form',
+                                                                           cascade='all,delete-orphan')
+    textparameters: AssociationProxy[Set["TextParameter"]] = association_proxy("textparametervalues", "parameter")
+
+    examples: Mapped[Set["Example"]] = relationship(secondary=examples_to_forms)
+
+    # Parameter keyword -> value keywords, kept in sync with forms_to_parametervalues by triggers
+    parametermap: Mapped[Dict[str, List[str]]] = mapped_column(JSON, default=dict)
+
+    # __table_args__ = (UniqueConstraint('unit_id', 'formtype_id', "text"),
+    #                  ) # Only one unit-type mapping for a given text value
+
+    def get_value_keywords(self, keyword: str) -> List[str]:
+        return self.parametermap.get(keyword, []) if self.parametermap else []
+
+    def get_values_for_parameter(self, param: Parameter) -> List[ParameterValue]:
+        if int(param.target) != Parameter.Form:
+            raise ValueError("Parameter %s does not classify forms" % param.keyword)
+        values = {x.keyword: x for x in param.values}
+        return [values[kw] for kw in self.get_value_keywords(param.keyword)]
+
+parameters_to_formtypes = Table(
+    "parameters_to_formtypes",
+    Base.metadata,
+    Column("parameter_id", ForeignKey("parameters.id")),
+    Column("formtype_id", ForeignKey("formtypes.id"))
+)
+
+textparameters_to_formtypes = Table(
+    "textparameters_to_formtypes",
+    Base.metadata,
+    Column("textparameter_id", ForeignKey("parameters.id")),
+    Column("formtype_id", ForeignKey("formtypes.id"))
+)
+
+# Alphabetical index of the linkers and their forms, filled by collation.py after the build.
+# sort_key compares in Russian order with the default BINARY collation, so browsing
+# is a range scan of the primary key; form_id is NULL for the linker itself.
+browse_keys = Table(
+    "browse_keys",
+    Base.metadata,
+    Column("sort_key", String, primary_key=True),
+    Column("unit_id", ForeignKey("units.id"), primary_key=True),
+    Column("form_id", ForeignKey("forms.id"), nullable=True),
+    Column("letter", String, nullable=False),
+    Column("text", String, nullable=False),
+    sqlite_with_rowid=False
+)
+
+class FormType(Base):
+    __tablename__ = 'formtypes' # linker, correl, phonvar, mainpart
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    
+    name: Mapped[str]
+    keyword: Mapped[str] = mapped_column(unique=True)
+
+    forms: Mapped[Set["Form"]] = relationship(back_populates="formtype")
+    parameters: Mapped[Set["Parameter"]] = relationship(secondary=parameters_to_formtypes)
+
+# MEANINGS
+
+class Meaning(Base):
+    __tablename__ = 'meanings'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    meaning: Mapped[str] = mapped_column(CompressedText)
+    pos: Mapped[str]
+    pos_type: Mapped[str]
+    other_senses: Mapped[str]
+    other_pos: Mapped[str]
+
+    unit_id: Mapped[int] = mapped_column(ForeignKey('units.id'), index=True)
+    unit: Mapped["Unit"] = relationship()
+
+    source_id: Mapped[int] = mapped_column(ForeignKey('sources.id'))
+    source: Mapped["Source"] = relationship()
+
+# Various additional triggers for constraints that cannot be handled via UNIQUE, CHECK etc.
+
+# Ensures that single-valued parameters cannot be assigned more than one value for a unit
+event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_units_to_parametervalues_INSERT_singleval
+	AFTER INSERT
+	ON units_to_parametervalues
+	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
+		 (SELECT COUNT(*) from units_to_parametervalues
+			WHERE 	unit_id = NEW.unit_id AND
+					parametervalue_id IN (SELECT id FROM parametervalues 
+											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued unit parameter.');
+END;'''))
+event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_units_to_parametervalues_UPDATE_singleval
+	AFTER INSERT
+	ON units_to_parametervalues
+	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
+		 (SELECT COUNT(*) from units_to_parametervalues
+			WHERE 	unit_id = NEW.unit_id AND
+					parametervalue_id IN (SELECT id FROM parametervalues 
+											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued unit parameter.');
+END;'''))
+
+# Ensures that form parameters cannot be assigned to units
+event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_units_to_parametervalues_INSERT_unitval
+	AFTER INSERT
+	ON units_to_parametervalues
+	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
+					INNER JOIN parameters AS p
+					ON pv.parameter_id = p.id
+					WHERE pv.id = NEW.parametervalue_id AND p.target = 2)
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Form parameter to Unit.');
+END;'''))
+event.listen(UnitToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_units_to_parametervalues_UPDATE_unitval
+	AFTER UPDATE
+	ON units_to_parametervalues
+	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
+					INNER JOIN parameters AS p
+					ON pv.parameter_id = p.id
+					WHERE pv.id = NEW.parametervalue_id AND p.target = 2)
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Form parameter to Unit.');
+END;'''))
+
+# Same stuff for form parameters
+event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_forms_to_parametervalues_INSERT_singleval
+	AFTER INSERT
+	ON forms_to_parametervalues
+	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
+		 (SELECT COUNT(*) from forms_to_parametervalues
+			WHERE 	form_id = NEW.form_id AND
+					parametervalue_id IN (SELECT id FROM parametervalues 
+											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued form parameter.');
+END;'''))
+event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_forms_to_parametervalues_UPDATE_singleval
+	AFTER INSERT
+	ON forms_to_parametervalues
+	WHEN (SELECT p.singleval FROM parameters AS p WHERE p.id = (SELECT pv.parameter_id FROM parametervalues AS pv WHERE pv.id = NEW.parametervalue_id)) = 1 AND
+		 (SELECT COUNT(*) from forms_to_parametervalues
+			WHERE 	form_id = NEW.form_id AND
+					parametervalue_id IN (SELECT id FROM parametervalues 
+											WHERE parameter_id = (SELECT parameter_id FROM parametervalues WHERE id = NEW.parametervalue_id))) > 1
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: More than one value assigned to a single-valued form parameter.');
+END;'''))
+event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_forms_to_parametervalues_INSERT_formval
+	AFTER INSERT
+	ON forms_to_parametervalues
+	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
+					INNER JOIN parameters AS p
+					ON pv.parameter_id = p.id
+					WHERE pv.id = NEW.parametervalue_id AND p.target = 1)
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Unit parameter to Form.');
+END;'''))
+event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_forms_to_parametervalues_UPDATE_formval
+	AFTER UPDATE
+	ON forms_to_parametervalues
+	WHEN EXISTS (SELECT 1 FROM parametervalues AS pv
+					INNER JOIN parameters AS p
+					ON pv.parameter_id = p.id
+					WHERE pv.id = NEW.parametervalue_id AND p.target = 1)
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: Attempt to assign Unit parameter to Form.');
+END;'''))
+
+# Ensure that form parameters are assigned to correct form types
+event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_forms_to_parametervalues_INSERT_formtype
+	AFTER INSERT
+	ON forms_to_parametervalues
+	WHEN NOT EXISTS (SELECT 1 FROM parametervalues AS pv
+				INNER JOIN parameters_to_formtypes AS pft
+					ON pft.parameter_id = pv.parameter_id
+				INNER JOIN forms AS f
+					ON f.formtype_id = pft.formtype_id
+				WHERE f.id = NEW.form_id AND pv.id = NEW.parametervalue_id)
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: Incorrect parameter value for form type.');
+END;'''))
+event.listen(FormToParameterValue.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_forms_to_parametervalues_UPDATE_formtype
+	AFTER UPDATE
+	ON forms_to_parametervalues
+	WHEN NOT EXISTS (SELECT 1 FROM parametervalues AS pv
+				INNER JOIN parameters_to_formtypes AS pft
+					ON pft.parameter_id = pv.parameter_id
+				INNER JOIN forms AS f
+					ON f.formtype_id = pft.formtype_id
+				WHERE f.id = NEW.form_id AND pv.id = NEW.parametervalue_id)
+BEGIN
+	SELECT RAISE(ABORT, 'ERROR: Incorrect parameter value for form type.');
+END;'''))
+
+# Precomputed parameter maps: {parameter keyword: [value keywords]}, both in keyword order, which
+# unlike the ids (see stable_ids.py) does not change when another value is added or renamed.
+# Recomputed for the affected unit or form whenever its mappings change.
+def parametermap_select(mapping_table, owner_col, owner_id):
+    return '''(
+		SELECT json_group_object(keyword, json(vals)) FROM (
+			SELECT keyword, json_group_array(value) AS vals FROM (
+				SELECT p.keyword AS keyword, pv.keyword AS value FROM %s AS m
+					INNER JOIN parametervalues AS pv
+						ON pv.id = m.parametervalue_id
+					INNER JOIN parameters AS p
+						ON p.id = pv.parameter_id
+					WHERE m.%s = %s
+					ORDER BY p.keyword, pv.keyword)
+			GROUP BY keyword))''' % (mapping_table, owner_col, owner_id)
+
+def parametermap_sql(owner_table, mapping_table, owner_col, owner_id):
+    return '''UPDATE %s SET parametermap = %s
+	WHERE id = %s;''' % (owner_table, parametermap_select(mapping_table, owner_col, owner_id), owner_id)
+
+for owner_table, mapping_table, owner_col, mapped in (('units', 'units_to_parametervalues', 'unit_id', UnitToParameterValue),
+                                                       ('forms', 'forms_to_parametervalues', 'form_id', FormToParameterValue)):
+    event.listen(mapped.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_%s_INSERT_parametermap
+	AFTER INSERT
+	ON %s
+BEGIN
+	%s
+END;''' % (mapping_table, mapping_table, parametermap_sql(owner_table, mapping_table, owner_col, 'NEW.' + owner_col))))
+    event.listen(mapped.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_%s_DELETE_parametermap
+	AFTER DELETE
+	ON %s
+BEGIN
+	%s
+END;''' % (mapping_table, mapping_table, parametermap_sql(owner_table, mapping_table, owner_col, 'OLD.' + owner_col))))
+    event.listen(mapped.__table__, 'after_create', DDL('''\
+CREATE TRIGGER TR_%s_UPDATE_parametermap
+	AFTER UPDATE
+	ON %s
+BEGIN
+	%s
+	%s
+END;''' % (mapping_table, mapping_table, parametermap_sql(owner_table, mapping_table, owner_col, 'OLD.' + owner_col),
+           parametermap_sql(owner_table, mapping_table, owner_col, 'NEW.' + owner_col))))
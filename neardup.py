@@ -0,0 +1,224 @@
+# Near-duplicate examples and comments.
+#
+# The tables repeat many examples with small differences: a source tag
+# ("(НКРЯ)", "[Сконструированный пример]", "[НКРЯ: author. title (year)]"),
+# punctuation, ё for е, a trailing review mark (GOOD, NOTFOUND). Texts are
+# normalized (bracketed tags anywhere and parenthesized tags and marks at the
+# end dropped, lowercased, ё read as е, punctuation dropped) and cut into
+# character shingles, and every text gets a MinHash signature.
+# LSH banding puts texts that agree on all rows of a band into one bucket,
+# so candidates are found without comparing all pairs; candidates are kept
+# if the Jaccard similarity of their shingles reaches the threshold.
+# Comments are only compared with comments of the same visibility.
+#
+# The clusters go to the review tables example_duplicates and
+# comment_duplicates (see models.py), one row per member, with the id of the
+# member the cluster would be merged into (the longest text, which keeps the
+# most source information) and the similarity to it. Both ids are foreign
+# keys, so releases.py and stable_ids.py renumber them with the rows. merge() makes every owner of a member link the merged
+# row instead and deletes the other members.
+#
+# Only members identical to the merged row after normalization are merged by
+# default: many examples are minimal pairs that differ in the linker alone
+# (то/так, но/однако), which are near-duplicates as text but illustrate
+# different units. They stay in the review table.
+#
+# make-sqlite.py fills the review table after the ids are assigned, and
+# merges the clusters with --merge-duplicates.
+#
+#     python neardup.py ruslinkers-new4.db --show 10
+#     python neardup.py ruslinkers-new4.db --merge
+#
+# Requires numpy.
+
+import re
+import zlib
+import sqlite3
+import argparse
+
+from collections import defaultdict
+
+import numpy as np
+
+import spotter
+from releases import Schema, quote
+from stable_ids import without_triggers
+
+TABLES = {
+    # table: (text column, column that separates rows that must not be merged, review table)
+    'examples': ('text', None, 'example_duplicates'),
+    'comments': ('text', 'hidden', 'comment_duplicates'),
+}
+
+SHINGLE = 5
+BANDS = 16
+ROWS = 8 # BANDS * ROWS permutations; texts become likely candidates from about 0.8 similarity
+THRESHOLD = 0.9
+
+PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240801)
+_A = _rng.randint(1, PRIME, BANDS * ROWS).astype(np.uint64)
+_B = _rng.randint(0, PRIME, BANDS * ROWS).astype(np.uint64)
+
+BRACKETS = re.compile(r'\[[^\[\]]*\]')
+TRAILING_TAG = re.compile(r'\s*(?:\([^()]*\)|\b[A-Z]{2,}\b)[\s.!?…;]*$')
+
+def normalize(text: str) -> str:
+    """Words of a text without source tags, lowercased, ё as е"""
+    text = BRACKETS.sub(' ', text)
+    while True:
+        stripped = TRAILING_TAG.sub('', text)
+        if stripped == text:
+            break
+        text = stripped
+    return ' '.join(spotter.WORD.findall(spotter.normalize(text)))
+
+def shingles(text: str) -> set:
+    """Hashes of the character shingles of a normalized text"""
+    if len(text) <= SHINGLE:
+        return {zlib.crc32(text.encode())} if text else set()
+    return {zlib.crc32(text[i:i + SHINGLE].encode()) for i in range(len(text) - SHINGLE + 1)}
+
+def signature(hashes) -> np.ndarray:
+    x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    return ((np.outer(_A, x) + _B[:, None]) % PRIME).min(axis=1)
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b)
+
+def clusters(items, threshold: float = THRESHOLD):
+    """[(canonical id, [(id, similarity to canonical), ...]), ...] for (id, text, group) items"""
+    sets, texts = {}, {}
+    buckets = defaultdict(list)
+    for rid, text, group in items:
+        s = shingles(normalize(text or ''))
+        if not s:
+            continue
+        sets[rid], texts[rid] = s, text
+        sig = signature(s)
+        for band in range(BANDS):
+            buckets[band, group, sig[band * ROWS:(band + 1) * ROWS].tobytes()].append(rid)
+
+    parent = {}
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        # Every member is compared with the first member of each group found so far in the
+        # bucket, not with every other member, so a bucket of identical texts stays linear
+        leaders = []
+        for rid in members:
+            for leader in leaders:
+                if find(rid) == find(leader) or jaccard(sets[rid], sets[leader]) >= threshold:
+                    parent[find(rid)] = find(leader)
+                    break
+            else:
+                leaders.append(rid)
+
+    groups = defaultdict(list)
+    for rid in sets:
+        groups[find(rid)].append(rid)
+    result = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        canonical = max(members, key=lambda r: (len(texts[r]), -r))
+        result.append((canonical, sorted((r, jaccard(sets[r], sets[canonical])) for r in members)))
+    return sorted(result)
+
+def find_duplicates(conn: sqlite3.Connection, threshold: float = THRESHOLD):
+    """{table: clusters()} for the tables in TABLES"""
+    plain = lambda text: text
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'zstd_dictionaries'").fetchone():
+        import compression
+        compression.load_dictionaries(conn)
+        plain = compression.decompress
+    found = {}
+    for table, (column, group, _) in TABLES.items():
+        rows = conn.execute('SELECT id, %s, %s FROM %s ORDER BY id' % (column, group or 'NULL', table))
+        found[table] = clusters(((rid, plain(text), g) for rid, text, g in rows), threshold)
+    return found
+
+def store(conn: sqlite3.Connection, threshold: float = THRESHOLD):
+    """Replace the contents of the review tables; returns {table: (clusters, rows in them)}"""
+    stats = {}
+    for table, found in find_duplicates(conn, threshold).items():
+        review = quote(TABLES[table][2])
+        conn.execute('DELETE FROM %s' % review)
+        conn.executemany('INSERT INTO %s (row_id, cluster_id, similarity) VALUES (?, ?, ?)' % review,
+                         [(rid, canonical, round(similarity, 4)) for canonical, members in found
+                          for rid, similarity in members])
+        stats[table] = (len(found), sum(len(members) for _, members in found))
+    conn.commit()
+    return stats
+
+def merge(conn: sqlite3.Connection, similarity: float = 1.0):
+    """Merge the reviewed members at least this similar into their canonical rows; returns {table: rows deleted}"""
+    schema = Schema(conn)
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS merged_rows (old INTEGER PRIMARY KEY, new INTEGER NOT NULL)')
+    merged = {}
+    with without_triggers(conn):
+        for table, (_, _, review) in TABLES.items():
+            conn.execute('DELETE FROM temp.merged_rows')
+            conn.execute('''INSERT INTO temp.merged_rows SELECT row_id, cluster_id FROM %s
+                            WHERE row_id != cluster_id AND similarity >= ?''' % quote(review), (similarity,))
+            for t in schema.tables:
+                for c in schema.columns[t]:
+                    if t in (table, review) or schema.target(t, c) != table:
+                        continue
+                    # Owners that already link the canonical row keep one link
+                    conn.execute('UPDATE OR IGNORE %s SET %s = (SELECT new FROM temp.merged_rows WHERE old = %s) '
+                                 'WHERE %s IN (SELECT old FROM temp.merged_rows)' % (quote(t), quote(c), quote(c), quote(c)))
+                    conn.execute('DELETE FROM %s WHERE %s IN (SELECT old FROM temp.merged_rows)' % (quote(t), quote(c)))
+            merged[table] = conn.execute('DELETE FROM %s WHERE id IN (SELECT old FROM temp.merged_rows)' % quote(table)).rowcount
+            conn.execute('DELETE FROM %s WHERE row_id IN (SELECT old FROM temp.merged_rows)' % quote(review))
+            # Clusters left with their canonical row alone are resolved
+            conn.execute('''DELETE FROM %s WHERE cluster_id IN (
+                SELECT cluster_id FROM %s GROUP BY cluster_id HAVING COUNT(*) = 1)''' % (quote(review), quote(review)))
+    conn.commit()
+    return merged
+
+def store_database(path: str, merge_clusters: bool = False):
+    """store(), then merge() if asked; returns their results"""
+    conn = sqlite3.connect(path)
+    stats = store(conn)
+    merged = merge(conn) if merge_clusters else {}
+    conn.close()
+    return stats, merged
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Find near-duplicate examples and comments")
+    argparser.add_argument("database")
+    argparser.add_argument("--threshold", type=float, default=THRESHOLD,
+                           help="minimum Jaccard similarity of the shingles (default: %(default)s)")
+    argparser.add_argument("--show", type=int, default=0, metavar="N", help="print the N largest clusters of each table")
+    argparser.add_argument("--merge", type=float, nargs='?', const=1.0, metavar="SIMILARITY",
+                           help="merge the rows at least this similar to their cluster's row (default: %(const)s)")
+    args = argparser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    for table, (n, rows) in store(conn, args.threshold).items():
+        print("%s: %d clusters of %d rows" % (table, n, rows))
+    if args.show:
+        for table, (column, _, review) in TABLES.items():
+            sizes = conn.execute('''SELECT cluster_id, COUNT(*) FROM %s
+                                    GROUP BY cluster_id ORDER BY COUNT(*) DESC, cluster_id LIMIT ?''' % review, (args.show,))
+            for cluster_id, size in sizes.fetchall():
+                print("\n%s cluster %d (%d rows)" % (table, cluster_id, size))
+                for rid, similarity, text in conn.execute('''
+                        SELECT d.row_id, d.similarity, t.%s FROM %s AS d JOIN %s AS t ON t.id = d.row_id
+                        WHERE d.cluster_id = ? ORDER BY d.similarity DESC, d.row_id LIMIT 10''' % (column, review, table),
+                        (cluster_id,)):
+                    if isinstance(text, bytes):
+                        import compression
+                        text = compression.decompress(text)
+                    print("  %.2f %s" % (similarity, text))
+    if args.merge is not None:
+        for table, n in merge(conn, args.merge).items():
+            print("%s: %d rows merged into others" % (table, n))
+    conn.close()
@@ -0,0 +1,143 @@
+# Cache of the parsed CSV tables.
+#
+# make-sqlite.py reads the syntax, data and --sources tables as lists of row
+# dicts and collects the vocabulary of every parameter column (the distinct
+# values, split on "; ", in order of appearance). read_table() keeps the
+# result in .parse-cache/ next to the CSV file, in marshal format: the field
+# names, the row dicts and the vocabularies found so far. Equal cells are
+# stored once (marshal writes a reference for an object it has already
+# written), and most cells repeat a few values (NA, parameter values), so
+# the file stays small and loads about twice as fast as the CSV parses.
+#
+# The cache file name holds the SHA-256 of the CSV and PARSER_VERSION, so a
+# changed input or parser gets a new file, and stale ones are removed when it
+# is written. Bump PARSER_VERSION whenever read_table(), save() or
+# Table.vocabulary() change what they return or write.
+#
+# Parsing is a small part of a build (tens of milliseconds against seconds
+# spent in the ORM); the bench command measures both paths.
+#
+#     python parse_cache.py bench syntax_aug2024.csv data_aug2024.csv
+#     python parse_cache.py clear syntax_aug2024.csv
+
+import os
+import csv
+import glob
+import time
+import marshal
+import hashlib
+import argparse
+
+from typing import Dict, List
+
+PARSER_VERSION = 1
+CACHE_DIR = '.parse-cache'
+
+class Table(list):
+    """Rows of a CSV table as dicts, with the field names and cached vocabularies"""
+
+    def __init__(self, fieldnames, rows, vocabularies=None):
+        super().__init__(rows)
+        self.fieldnames = fieldnames
+        self.vocabularies = vocabularies if vocabularies is not None else {}
+        self.changed = False
+
+    def vocabulary(self, column: str) -> List[str]:
+        """Distinct values of a column split on "; " in order of appearance, without empty and NA cells"""
+        if column not in self.vocabularies:
+            values = dict.fromkeys(x[column] for x in self)
+            self.vocabularies[column] = list(dict.fromkeys(
+                sub for val in values if val != '' and val != 'NA' for sub in val.split("; ")))
+            self.changed = True
+        return self.vocabularies[column]
+
+def _parse(path: str) -> Table:
+    with open(path) as file:
+        reader = csv.DictReader(file, delimiter=',')
+        rows = list(reader)
+    return Table(reader.fieldnames, rows)
+
+def cache_path(path: str, digest: str) -> str:
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    return os.path.join(directory, '%s.%s.v%d.marshal' % (os.path.basename(path), digest[:16], PARSER_VERSION))
+
+def _cache_files(path: str) -> List[str]:
+    """All cache files of a CSV file, whatever their contents and version"""
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    prefix = os.path.basename(path) + '.'
+    return [f for f in glob.glob(os.path.join(directory, glob.escape(prefix) + '*.marshal'))
+            if os.path.basename(f)[len(prefix):].count('.') == 2]
+
+def _digest(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def read_table(path: str, cache: bool = True) -> Table:
+    """Table of a CSV file, from the parse cache if it has one for these contents"""
+    if not cache:
+        return _parse(path)
+    target = cache_path(path, _digest(path))
+    try:
+        with open(target, 'rb') as file:
+            fieldnames, rows, vocabularies = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        table = _parse(path)
+        table.changed = True
+    else:
+        table = Table(fieldnames, rows, vocabularies)
+    table.path, table.target = path, target
+    return table
+
+def save(table: Table):
+    """Write a table read by read_table() to the cache if anything new was parsed, replacing older versions"""
+    target = getattr(table, 'target', None)
+    if target is None or not table.changed:
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    for old in _cache_files(table.path):
+        if old != target:
+            os.remove(old)
+    shared = {}
+    rows = [{shared.setdefault(k, k): shared.setdefault(v, v) for k, v in row.items()} for row in table]
+    tmp = target + '.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(marshal.dumps((table.fieldnames, rows, table.vocabularies)))
+    os.replace(tmp, target)
+    table.changed = False
+
+def clear(path: str) -> int:
+    """Remove all cache files of a CSV file; returns their number"""
+    files = _cache_files(path)
+    for f in files:
+        os.remove(f)
+    return len(files)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Inspect the parse cache of the CSV tables")
+    argparser.add_argument("command", choices=["bench", "clear"])
+    argparser.add_argument("tables", nargs='+', help="CSV files")
+    argparser.add_argument("--repeat", type=int, default=10)
+    args = argparser.parse_args()
+
+    for path in args.tables:
+        if args.command == "clear":
+            print("%s: %d cache files removed" % (path, clear(path)))
+            continue
+        table = read_table(path)
+        save(table)
+        # The vocabularies a build asked for are loaded with the cache and collected again without it
+        columns = list(table.vocabularies)
+        timings: Dict[str, float] = {}
+        for name, cached in (("parse", False), ("cache", True)):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                table = read_table(path, cached)
+                for column in columns:
+                    table.vocabulary(column)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        print("%s: %d rows, %d vocabularies, parse %.1f ms, cache %.1f ms (best of %d; %s, %d bytes)"
+              % (path, len(table), len(columns), timings["parse"] * 1000, timings["cache"] * 1000, args.repeat,
+                 os.path.relpath(table.target), os.path.getsize(table.target)))
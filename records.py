@@ -0,0 +1,148 @@
+# Lightweight read path for list pages and exports.
+#
+# Instead of declarative instances (identity map entries, relationship
+# collections, association proxies) the functions here run Core select()
+# statements over an explicit column projection and return immutable named
+# tuples. Results are streamed with yield_per, so scanning the whole table
+# keeps only one batch of rows in memory.
+#
+#     with engine.connect() as conn:
+#         for unit, forms in records.units_with_forms(conn, ('id', 'linker'), ('text',)):
+#             ...
+#
+#     python records.py bench ruslinkers-new4.db
+
+import time
+import argparse
+import tracemalloc
+
+from collections import namedtuple
+from functools import lru_cache
+from typing import Iterator, Sequence, Tuple
+
+from sqlalchemy import select
+
+from models import Unit, Form, FormType, ParameterValue, Parameter
+
+units_table = Unit.__table__
+forms_table = Form.__table__
+parametervalues_table = ParameterValue.__table__
+
+@lru_cache(maxsize=None)
+def record_type(name: str, columns: Tuple[str, ...]):
+    """Named tuple class for one projection, created once per column set"""
+    return namedtuple(name, columns)
+
+def _stream(conn, stmt, record, yield_per: int):
+    result = conn.execution_options(yield_per=yield_per).execute(stmt)
+    make = record._make
+    for partition in result.partitions():
+        for row in partition:
+            yield make(row)
+
+def scan(conn, table, columns: Sequence[str], *where, order_by: str = 'id', name: str = None,
+         yield_per: int = 1000) -> Iterator[tuple]:
+    """Stream the given columns of a table as named tuples"""
+    columns = tuple(columns)
+    stmt = select(*[table.c[c] for c in columns]).where(*where).order_by(table.c[order_by])
+    record = record_type(name or table.name.capitalize().rstrip('s') + 'Record', columns)
+    return _stream(conn, stmt, record, yield_per)
+
+def units(conn, columns: Sequence[str] = ('id', 'linker', 'semfield_id'), *where, yield_per: int = 1000):
+    return scan(conn, units_table, columns, *where, name='UnitRecord', yield_per=yield_per)
+
+def forms(conn, columns: Sequence[str] = ('id', 'unit_id', 'formtype_id', 'text'), *where, yield_per: int = 1000):
+    return scan(conn, forms_table, columns, *where, name='FormRecord', yield_per=yield_per)
+
+def parametervalues(conn, columns: Sequence[str] = ('id', 'parameter_id', 'keyword', 'name'), *where,
+                    yield_per: int = 1000):
+    return scan(conn, parametervalues_table, columns, *where, name='ParameterValueRecord', yield_per=yield_per)
+
+def parametervalues_of(conn, parameter_keyword: str, columns: Sequence[str] = ('id', 'keyword', 'name')):
+    """Values of one parameter, selected by the parameter's keyword"""
+    parameter_id = select(Parameter.__table__.c.id).where(Parameter.__table__.c.keyword == parameter_keyword)
+    return parametervalues(conn, columns, parametervalues_table.c.parameter_id == parameter_id.scalar_subquery())
+
+def units_with_forms(conn, unit_columns: Sequence[str] = ('id', 'linker'),
+                     form_columns: Sequence[str] = ('formtype', 'text'), *where,
+                     yield_per: int = 1000) -> Iterator[Tuple[tuple, Tuple[tuple, ...]]]:
+    """Stream (unit, forms) pairs from one ordered outer join
+
+    'formtype' among the form columns is the keyword of the form type.
+    """
+    unit_columns = tuple(unit_columns)
+    form_columns = tuple(form_columns)
+    formtypes = FormType.__table__
+    projection = [units_table.c[c] for c in unit_columns]
+    projection += [formtypes.c.keyword if c == 'formtype' else forms_table.c[c] for c in form_columns]
+    projection.append(forms_table.c.id.label('_form_id'))
+    stmt = (select(*projection)
+            .select_from(units_table
+                         .outerjoin(forms_table, forms_table.c.unit_id == units_table.c.id)
+                         .outerjoin(formtypes, formtypes.c.id == forms_table.c.formtype_id))
+            .where(*where)
+            .order_by(units_table.c.id, forms_table.c.id))
+    unit_record = record_type('UnitRecord', unit_columns)
+    form_record = record_type('FormRecord', form_columns)
+    n = len(unit_columns)
+    # Rows of one unit are adjacent; the unit id is needed to tell units apart
+    id_index = unit_columns.index('id') if 'id' in unit_columns else None
+    if id_index is None:
+        stmt = stmt.add_columns(units_table.c.id.label('_unit_id'))
+    result = conn.execution_options(yield_per=yield_per).execute(stmt)
+    current_id = unit = None
+    unit_forms = []
+    for partition in result.partitions():
+        for row in partition:
+            uid = row[id_index] if id_index is not None else row[-1]
+            if uid != current_id:
+                if unit is not None:
+                    yield unit, tuple(unit_forms)
+                current_id = uid
+                unit = unit_record._make(row[:n])
+                unit_forms = []
+            if row[n + len(form_columns)] is not None: # units without forms give one NULL row
+                unit_forms.append(form_record._make(row[n:n + len(form_columns)]))
+    if unit is not None:
+        yield unit, tuple(unit_forms)
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+def bench(path: str):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session, selectinload
+
+    engine = create_engine('sqlite:///%s' % path)
+
+    def orm():
+        with Session(engine) as session:
+            count = 0
+            for unit in session.scalars(select(Unit).options(selectinload(Unit.forms).joinedload(Form.formtype))):
+                count += len([(f.formtype.keyword, f.text) for f in unit.forms])
+            return count
+
+    def core():
+        with engine.connect() as conn:
+            count = 0
+            for unit, unit_forms in units_with_forms(conn, ('id', 'linker'), ('formtype', 'text')):
+                count += len(unit_forms)
+            return count
+
+    for name, func in (('ORM', orm), ('records', core)):
+        func() # warm up the statement caches
+        count, elapsed, peak = _measure(func)
+        print("%-8s %6d forms  %8.1f ms  peak %8.1f KiB" % (name, count, elapsed * 1000, peak / 1024))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Compare scanning units with their forms through the ORM and through records")
+    argparser.add_argument("command", choices=["bench"])
+    argparser.add_argument("database")
+    args = argparser.parse_args()
+    bench(args.database)
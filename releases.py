@@ -0,0 +1,443 @@
+# Release store: several builds of the database kept in one file.
+#
+# Every row of every table of a build is stored once in rel_<table> together
+# with the interval of releases it is valid in (valid_from <= release < valid_to,
+# valid_to NULL for rows still valid in the latest release). Rows that do not
+# change between releases are shared, so the store grows with the amount of
+# change rather than with the number of releases.
+#
+# Ids assigned by make-sqlite.py depend on the order of the CSV rows, so the
+# store keeps its own ids: every entity gets a content key (see KEYS) whose
+# hash is mapped to a stable store id in rel_keys. All foreign keys are rewritten
+# accordingly.
+#
+# A single release is read through temporary views that have the names and
+# columns of the original tables, so queries written for a single-release
+# database work unchanged:
+#
+#     conn = releases.open_release("ruslinkers-releases.db", "aug2024")
+#     conn.execute("SELECT linker FROM units WHERE id = ?", (1,))
+#
+# With SQLAlchemy: create_engine("sqlite://", creator=lambda: releases.open_release(store, name))
+#
+# rel_<table> gets the indexes of the build table (with valid_to appended),
+# so lookups through the views use an index as they do in a build, and
+# extract_release() recreates the indexes and triggers of the latest release.
+# A release whose table definitions differ from those in the store is
+# rejected: migrate the store, or start a new one.
+#
+# Builds are added before they are compressed (make-sqlite.py --compress
+# --release does so); compressed builds are rejected.
+#
+# Every release also logs its changes in rel_changes, so consumers (search
+# indexes, caches, mirrors) can refresh what changed instead of everything:
+# one row per inserted, updated or deleted unit, form, example, meaning and
+# link (CHANGE_ENTITIES), keyed by store id. An entity is updated if one of its
+# rows changed, or a row referring to it (a parameter value, an example
+# link), or an entity it refers to (a renamed value, an edited comment).
+# changes_since() pages through the changes after the release a consumer has:
+#
+#     python releases.py ruslinkers-releases.db changes --since aug2024 --entity unit
+
+import sqlite3
+import json
+import hashlib
+import argparse
+
+from collections import defaultdict
+
+# Natural keys of entity tables; other columns may change between releases
+# without changing the store id of the entity. Foreign key columns are
+# compared by the store id they point to. Tables not listed use all columns.
+KEYS = {
+    'semfields': ('keyword',),
+    'subfields': ('keyword',),
+    'sources': ('keyword',),
+    'parameters': ('keyword',),
+    'parametervalues': ('parameter_id', 'keyword'),
+    'textparameters': ('keyword',),
+    'formtypes': ('keyword',),
+    'unitlinktypes': ('keyword',),
+    'units': ('linker', 'semfield_id'),
+    'forms': ('unit_id', 'formtype_id', 'text'),
+    'meanings': ('unit_id', 'source_id', 'meaning'),
+    'examples': ('text',),
+    'comments': ('text', 'hidden'),
+}
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS releases (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        source TEXT,
+        created TEXT DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS rel_tables (
+        name TEXT PRIMARY KEY,
+        sql TEXT NOT NULL)''')
+    # Tables of every release (stores from before it have none listed: all tables are shown)
+    conn.execute('''CREATE TABLE IF NOT EXISTS rel_release_tables (
+        release INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        PRIMARY KEY (release, name)) WITHOUT ROWID''')
+    # Indexes and triggers of the tables, as in the latest release
+    conn.execute('''CREATE TABLE IF NOT EXISTS rel_objects (
+        name TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        tbl TEXT NOT NULL,
+        sql TEXT NOT NULL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS rel_keys (
+        tbl TEXT NOT NULL,
+        key BLOB NOT NULL,
+        id INTEGER NOT NULL,
+        PRIMARY KEY (tbl, key)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS rel_changes (
+        id INTEGER PRIMARY KEY,
+        release INTEGER NOT NULL,
+        entity TEXT NOT NULL,
+        key TEXT NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete')))''')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_rel_changes_release ON rel_changes (release, id)')
+    return conn
+
+def quote(name: str) -> str:
+    return '"%s"' % name.replace('"', '""')
+
+# Tables whose changes are logged in rel_changes, by entity name. Keys are
+# store ids, and for links source_id:target_id:unitlinktype_id.
+CHANGE_ENTITIES = {
+    'units': 'unit',
+    'forms': 'form',
+    'examples': 'example',
+    'meanings': 'meaning',
+    'units_to_units': 'link',
+}
+
+# Tables of a compressed build (compression.py) that are not versioned:
+# the dictionaries, and the FTS5 tables with their shadow tables
+DICTIONARIES = 'zstd_dictionaries'
+FTS5_SHADOWS = ('data', 'idx', 'content', 'docsize', 'config')
+
+def is_compressed(conn: sqlite3.Connection, schema: str = 'main') -> bool:
+    return conn.execute("SELECT 1 FROM %s.sqlite_master WHERE name = ?" % schema, (DICTIONARIES,)).fetchone() is not None
+
+class Schema:
+    """Tables, columns and foreign keys of a built database
+
+    With storable=True, only the tables a release store can version are listed."""
+
+    def __init__(self, conn: sqlite3.Connection, schema: str = 'main', storable: bool = False):
+        self.sql = dict(conn.execute(
+            "SELECT name, sql FROM %s.sqlite_master WHERE type = 'table'" % schema))
+        self.tables = sorted(t for t in self.sql if not t.startswith('sqlite_'))
+        if storable:
+            virtual = [t for t in self.tables if self.sql[t].upper().startswith('CREATE VIRTUAL TABLE')]
+            skipped = set(virtual) | {'%s_%s' % (t, s) for t in virtual for s in FTS5_SHADOWS} | {DICTIONARIES}
+            self.tables = [t for t in self.tables if t not in skipped]
+        self.columns = {}
+        self.pk = {}
+        self.fks = {}
+        self.unique = {}
+        for t in self.tables:
+            info = conn.execute('PRAGMA %s.table_info(%s)' % (schema, quote(t))).fetchall()
+            self.columns[t] = [r[1] for r in info]
+            self.pk[t] = [r[1] for r in sorted(info, key=lambda r: r[5]) if r[5] > 0]
+            self.fks[t] = {r[3]: (r[2], r[4]) for r in
+                           conn.execute('PRAGMA %s.foreign_key_list(%s)' % (schema, quote(t)))}
+            # Columns of the first UNIQUE constraint, if any
+            for index in conn.execute('PRAGMA %s.index_list(%s)' % (schema, quote(t))).fetchall():
+                if index[2] and index[3] == 'u':
+                    self.unique[t] = [r[2] for r in conn.execute('PRAGMA %s.index_info(%s)' % (schema, quote(index[1])))]
+                    break
+
+    def is_entity(self, table: str) -> bool:
+        return self.pk[table] == ['id']
+
+    def target(self, table: str, column: str):
+        """Entity table a column ultimately refers to (following composite keys), or None"""
+        seen = set()
+        while (table, column) not in seen:
+            seen.add((table, column))
+            if column == 'id' and self.is_entity(table):
+                return table
+            if column not in self.fks.get(table, {}):
+                return None
+            table, column = self.fks[table][column]
+        return None
+
+    def entity_order(self):
+        """Entity tables sorted so that referenced tables come first"""
+        deps = {t: {self.target(t, c) for c in self.columns[t] if c != 'id'} - {None, t}
+                for t in self.tables if self.is_entity(t)}
+        order = []
+        while deps:
+            ready = sorted(t for t, d in deps.items() if not d - set(order))
+            if not ready: # cycle: fall back to name order
+                ready = sorted(deps)
+            for t in ready:
+                order.append(t)
+                del deps[t]
+        return order
+
+def _remap(schema: Schema, table: str, rows, idmaps):
+    """Rewrite all id and foreign key columns of rows to store ids"""
+    targets = [schema.target(table, c) for c in schema.columns[table]]
+    out = []
+    for row in rows:
+        out.append(tuple(idmaps[t].get(v, v) if t is not None and v is not None else v
+                         for t, v in zip(targets, row)))
+    return out
+
+def _assign_ids(store: sqlite3.Connection, schema: Schema, table: str, rows, idmaps):
+    """Map build ids of an entity table to stable store ids via content keys"""
+    cols = schema.columns[table]
+    keycols = KEYS.get(table, [c for c in cols if c != 'id'])
+    keyidx = [cols.index(c) for c in keycols if c in cols]
+    known = dict(store.execute('SELECT key, id FROM rel_keys WHERE tbl = ?', (table,)))
+    nextid = max(known.values(), default=0) + 1
+    seen = defaultdict(int)
+    idmap = {}
+    new = []
+    remapped = _remap(schema, table, rows, idmaps)
+    for row, orig in zip(remapped, rows):
+        key = tuple(row[i] for i in keyidx)
+        seen[key] += 1 # entities with identical keys are told apart by occurrence
+        keyhash = hashlib.sha1(json.dumps(list(key) + [seen[key]], ensure_ascii=False).encode()).digest()
+        if keyhash not in known:
+            known[keyhash] = nextid
+            new.append((table, keyhash, nextid))
+            nextid += 1
+        idmap[orig[cols.index('id')]] = known[keyhash]
+    store.executemany('INSERT INTO rel_keys (tbl, key, id) VALUES (?, ?, ?)', new)
+    return idmap
+
+def _create_table(store: sqlite3.Connection, schema: Schema, table: str):
+    """Create rel_<table> with the indexes of the build, or check that the table has not changed"""
+    cols = schema.columns[table]
+    row = store.execute('SELECT sql FROM rel_tables WHERE name = ?', (table,)).fetchone()
+    if row is None:
+        store.execute('INSERT INTO rel_tables (name, sql) VALUES (?, ?)', (table, schema.sql[table]))
+    elif row[0] != schema.sql[table]:
+        raise ValueError("Table %s of the build differs from the one in the store:\n%s\nStore:\n%s" % (
+            table, schema.sql[table], row[0]))
+    pk = schema.pk[table] or cols
+    store.execute('CREATE TABLE IF NOT EXISTS %s (%s, valid_from INTEGER NOT NULL, valid_to INTEGER, PRIMARY KEY (%s, valid_from))' % (
+        quote('rel_' + table), ', '.join(quote(c) for c in cols), ', '.join(quote(c) for c in pk)))
+    store.execute('DELETE FROM rel_objects WHERE tbl = ?', (table,))
+    store.executemany('INSERT INTO rel_objects (name, type, tbl, sql) VALUES (?, ?, ?, ?)', store.execute(
+        "SELECT name, type, tbl_name, sql FROM build.sqlite_master WHERE type IN ('index', 'trigger') "
+        "AND tbl_name = ? AND sql IS NOT NULL", (table,)).fetchall())
+    # The indexes of the build, UNIQUE constraints included, serve the same lookups in the release
+    # views; valid_to picks the current rows. The primary key is already that of rel_<table>.
+    for _, name, _, origin, _ in store.execute('PRAGMA build.index_list(%s)' % quote(table)).fetchall():
+        columns = [r[2] for r in store.execute('PRAGMA build.index_info(%s)' % quote(name))]
+        if origin == 'pk' or None in columns: # expression indexes are left out
+            continue
+        store.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s, valid_to)' % (
+            quote('rel_' + name), quote('rel_' + table), ', '.join(quote(c) for c in columns)))
+
+def add_release(store: sqlite3.Connection, build: str, name: str):
+    """Add a built database as a new release; returns row statistics"""
+    if store.execute('SELECT 1 FROM releases WHERE name = ?', (name,)).fetchone():
+        raise ValueError("Release %s already exists in the store" % name)
+    store.execute('ATTACH DATABASE ? AS build', (build,))
+    try:
+        # Compressed text would give content keys that depend on the dictionaries
+        if is_compressed(store, 'build'):
+            raise ValueError("%s is compressed; add the build to the store before compressing it" % build)
+        schema = Schema(store, 'build', storable=True)
+        cur = store.execute('INSERT INTO releases (name, source) VALUES (?, ?)', (name, build))
+        release = cur.lastrowid
+        idmaps = defaultdict(dict)
+        for table in schema.entity_order():
+            rows = store.execute('SELECT %s FROM build.%s ORDER BY id' % (
+                ', '.join(quote(c) for c in schema.columns[table]), quote(table))).fetchall()
+            idmaps[table] = _assign_ids(store, schema, table, rows, idmaps)
+        stats = {"added": 0, "closed": 0, "kept": 0}
+        changed = {} # table: (rows closed, rows added)
+        for table in schema.tables:
+            cols = schema.columns[table]
+            collist = ', '.join(quote(c) for c in cols)
+            _create_table(store, schema, table)
+            store.execute('INSERT INTO rel_release_tables (release, name) VALUES (?, ?)', (release, table))
+            rows = store.execute('SELECT %s FROM build.%s' % (collist, quote(table))).fetchall()
+            rows = set(_remap(schema, table, rows, idmaps))
+            current = {tuple(r[1:]): r[0] for r in store.execute(
+                'SELECT rowid, %s FROM %s WHERE valid_to IS NULL' % (collist, quote('rel_' + table)))}
+            closed = [(release, rowid) for row, rowid in current.items() if row not in rows]
+            added = [row + (release,) for row in rows if row not in current]
+            store.executemany('UPDATE %s SET valid_to = ? WHERE rowid = ?' % quote('rel_' + table), closed)
+            store.executemany('INSERT INTO %s (%s, valid_from) VALUES (%s)' % (
+                quote('rel_' + table), collist, ', '.join('?' * (len(cols) + 1))), added)
+            stats["added"] += len(added)
+            stats["closed"] += len(closed)
+            stats["kept"] += len(rows) - len(added)
+            changed[table] = ([row for row, rowid in current.items() if row not in rows], [row[:-1] for row in added])
+        # Tables the build no longer has are empty from this release on
+        for table, in store.execute('SELECT name FROM rel_tables').fetchall():
+            if table not in schema.tables:
+                stats["closed"] += store.execute('UPDATE %s SET valid_to = ? WHERE valid_to IS NULL' % quote('rel_' + table),
+                                                 (release,)).rowcount
+        stats["changes"] = _record_changes(store, schema, release, changed)
+        store.commit()
+    except Exception:
+        store.rollback()
+        raise
+    finally:
+        store.execute('DETACH DATABASE build')
+    return stats
+
+def _record_changes(store: sqlite3.Connection, schema: Schema, release: int, changed) -> int:
+    """Add the changes of a release to rel_changes; returns their number"""
+    ops = defaultdict(dict) # entity: {key: op}
+    updated = defaultdict(set) # entity: keys of entities whose rows or references changed
+    indirect = defaultdict(set) # other entity table: changed store ids
+    for table, (closed, added) in changed.items():
+        cols = schema.columns[table]
+        if schema.is_entity(table):
+            i = cols.index('id')
+            old, new = {r[i] for r in closed}, {r[i] for r in added}
+            if table in CHANGE_ENTITIES:
+                entity = CHANGE_ENTITIES[table]
+                ops[entity].update((k, 'insert') for k in new - old)
+                ops[entity].update((k, 'delete') for k in old - new)
+                updated[entity].update(old & new)
+            else:
+                indirect[table].update(old | new)
+        elif table in CHANGE_ENTITIES:
+            key = lambda r: ':'.join(str(r[cols.index(c)]) for c in schema.pk[table])
+            old, new = {key(r) for r in closed}, {key(r) for r in added}
+            ops[CHANGE_ENTITIES[table]].update([(k, 'insert') for k in new - old] + [(k, 'delete') for k in old - new])
+        # A changed row changes the entities it refers to, before and after
+        for c in cols:
+            target = schema.target(table, c)
+            if target in CHANGE_ENTITIES and target != table:
+                updated[CHANGE_ENTITIES[target]].update(r[cols.index(c)] for r in closed + added)
+    # Entities that refer to a changed entity of another table (a renamed value, an edited comment) change too
+    for other, ids in indirect.items():
+        store.execute('CREATE TEMP TABLE IF NOT EXISTS changed_ids (id INTEGER PRIMARY KEY)')
+        store.execute('DELETE FROM temp.changed_ids')
+        store.executemany('INSERT INTO temp.changed_ids VALUES (?)', [(i,) for i in ids])
+        for table in schema.tables:
+            refs = [c for c in schema.columns[table] if schema.target(table, c) == other]
+            listed = [c for c in schema.columns[table] if schema.target(table, c) in CHANGE_ENTITIES]
+            for ref in refs:
+                for c in listed:
+                    entity = CHANGE_ENTITIES[schema.target(table, c)]
+                    updated[entity].update(k for k, in store.execute(
+                        'SELECT DISTINCT %s FROM %s WHERE valid_to IS NULL AND %s IN (SELECT id FROM temp.changed_ids)' % (
+                            quote(c), quote('rel_' + table), quote(ref))))
+    for entity, keys in updated.items():
+        for k in keys:
+            ops[entity].setdefault(k, 'update')
+    rows = [(release, entity, str(k), op) for entity in sorted(ops)
+            for k, op in sorted(ops[entity].items(), key=lambda item: (item[1], str(item[0])))]
+    store.executemany('INSERT INTO rel_changes (release, entity, key, op) VALUES (?, ?, ?, ?)', rows)
+    return len(rows)
+
+def changes_since(store: sqlite3.Connection, since: int = 0, after: int = 0, limit: int = 1000, entity: str = None):
+    """([(cursor, release, entity, key, op), ...], cursor of the next page or None) for the releases after since"""
+    # Changes are logged in release order, so the page starts at the first change after since
+    first = store.execute('SELECT MIN(id) FROM rel_changes WHERE release > ?', (since,)).fetchone()[0]
+    if first is None:
+        return [], None
+    after = max(after, first - 1)
+    where = ' AND entity = ?' if entity else ''
+    params = [since, after] + ([entity] if entity else []) + [limit]
+    rows = store.execute('SELECT id, release, entity, key, op FROM rel_changes WHERE release > ? AND id > ?%s '
+                         'ORDER BY id LIMIT ?' % where, params).fetchall()
+    return rows, rows[-1][0] if len(rows) == limit else None
+
+def release_id(store: sqlite3.Connection, name: str) -> int:
+    row = store.execute('SELECT id FROM releases WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        raise KeyError("No release %s in the store" % name)
+    return row[0]
+
+def release_tables(store: sqlite3.Connection, release: int):
+    """[(name, sql), ...] of the tables of a release"""
+    return store.execute('''SELECT name, sql FROM rel_tables WHERE name IN (SELECT name FROM rel_release_tables WHERE release = ?)
+                            OR NOT EXISTS (SELECT 1 FROM rel_release_tables WHERE release = ?) ORDER BY name''',
+                         (release, release)).fetchall()
+
+def create_views(conn: sqlite3.Connection, name: str, schema: str = 'temp', prefix: str = ''):
+    """Create views named like the original tables that show one release"""
+    release = release_id(conn, name)
+    for table, _ in release_tables(conn, release):
+        cols = [r[1] for r in conn.execute('PRAGMA table_info(%s)' % quote('rel_' + table))][:-2]
+        conn.execute('DROP VIEW IF EXISTS %s.%s' % (schema, quote(prefix + table)))
+        conn.execute('CREATE VIEW %s.%s AS SELECT %s FROM %s WHERE valid_from <= %d AND (valid_to IS NULL OR valid_to > %d)' % (
+            schema, quote(prefix + table), ', '.join(quote(c) for c in cols), quote('rel_' + table), release, release))
+
+def open_release(path: str, name: str) -> sqlite3.Connection:
+    """Open the store read-only with one release visible under the original table names"""
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    create_views(conn, name)
+    return conn
+
+def extract_release(store: sqlite3.Connection, name: str, output: str):
+    """Write one release out as a standalone database with the original schema, indexes and triggers"""
+    release = release_id(store, name)
+    path = [r[2] for r in store.execute('PRAGMA database_list') if r[1] == 'main'][0]
+    tables = release_tables(store, release)
+    objects = store.execute("SELECT sql FROM rel_objects WHERE tbl IN (%s) ORDER BY type = 'trigger', name" % ', '.join(
+        '?' * len(tables)), [t for t, _ in tables]).fetchall()
+    out = sqlite3.connect(output)
+    try:
+        out.execute('ATTACH DATABASE ? AS store', ('file:%s?mode=ro' % path,))
+        for table, sql in tables:
+            out.execute(sql)
+            cols = [r[1] for r in out.execute('PRAGMA store.table_info(%s)' % quote('rel_' + table))][:-2]
+            collist = ', '.join(quote(c) for c in cols)
+            out.execute('INSERT INTO main.%s (%s) SELECT %s FROM store.%s WHERE valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)' % (
+                quote(table), collist, collist, quote('rel_' + table)), (release, release))
+        # Triggers last, so that they do not fire on the copied rows
+        for sql, in objects:
+            out.execute(sql)
+        out.commit()
+        out.execute('DETACH DATABASE store')
+    finally:
+        out.close()
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Manage a store of several database releases")
+    argparser.add_argument("store", help="release store file")
+    commands = argparser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="add a built database as a new release")
+    add.add_argument("build")
+    add.add_argument("name")
+    commands.add_parser("list", help="list releases and row counts")
+    extract = commands.add_parser("extract", help="write one release to a standalone database")
+    extract.add_argument("name")
+    extract.add_argument("output")
+    changes = commands.add_parser("changes", help="list the changes of the releases after a given one")
+    changes.add_argument("--since", help="release the consumer already has (default: list all changes)")
+    changes.add_argument("--entity", choices=sorted(CHANGE_ENTITIES.values()))
+    changes.add_argument("--after", type=int, default=0, help="cursor printed at the end of the previous page")
+    changes.add_argument("--limit", type=int, default=1000)
+    args = argparser.parse_args()
+
+    store = connect(args.store)
+    if args.command == "add":
+        stats = add_release(store, args.build, args.name)
+        print("%d rows added, %d rows closed, %d rows shared, %d changes logged" % (
+            stats["added"], stats["closed"], stats["kept"], stats["changes"]))
+    elif args.command == "list":
+        tables = [t for t, in store.execute('SELECT name FROM rel_tables')]
+        for rid, name, source, created in store.execute('SELECT id, name, source, created FROM releases ORDER BY id').fetchall():
+            rows = sum(store.execute('SELECT COUNT(*) FROM %s WHERE valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)' % quote('rel_' + t),
+                                     (rid, rid)).fetchone()[0] for t in tables)
+            print("%s\t%s\t%s\t%d rows" % (name, created, source, rows))
+        stored = sum(store.execute('SELECT COUNT(*) FROM %s' % quote('rel_' + t)).fetchone()[0] for t in tables)
+        print("%d rows stored" % stored)
+    elif args.command == "extract":
+        extract_release(store, args.name, args.output)
+    elif args.command == "changes":
+        names = dict(store.execute('SELECT id, name FROM releases'))
+        rows, cursor = changes_since(store, release_id(store, args.since) if args.since else 0,
+                                     args.after, args.limit, args.entity)
+        for _, release, entity, key, op in rows:
+            print("%s\t%s\t%s\t%s" % (names[release], entity, key, op))
+        if cursor is not None:
+            print("# next page: --after %d" % cursor)
+    store.close()
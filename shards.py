@@ -0,0 +1,191 @@
+# Sharded parallel build.
+#
+# Units are matched to dictionary rows within their semantic field, so both
+# CSV tables are partitioned by semfield1_ed into shards that are built by
+# separate make-sqlite.py processes. The shard databases are then merged into
+# the final database with ATTACH and INSERT ... SELECT:
+#
+# * tables with a UNIQUE key (semfields, parameters, sources, ...) are merged
+#   on that key, so every shard's copy of a vocabulary entry maps to one row;
+# * all other entity tables get their ids shifted past the rows merged so far;
+# * association tables are copied with every id column remapped.
+#
+# Hyperlinks can point into another shard, so the shards only record them in
+# pending_links (make-sqlite.py --defer-links) and they are resolved once all
+# units are merged, with the same rules as in a single-process build.
+#
+#     python make-sqlite.py --jobs 8
+
+import os
+import sys
+import csv
+import time
+import shutil
+import sqlite3
+import tempfile
+import subprocess
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from releases import Schema, quote
+
+MAKE_SQLITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'make-sqlite.py')
+
+def read_csv(path: str):
+    with open(path) as file:
+        reader = csv.DictReader(file, delimiter=',')
+        return reader.fieldnames, list(reader)
+
+def partition(syntax, data, n: int):
+    """Split the rows of both tables into at most n shards of whole semantic fields"""
+    fields = defaultdict(lambda: ([], []))
+    for row in syntax:
+        fields[row["semfield1_ed"]][0].append(row)
+    for row in data:
+        fields[row["semfield1_ed"]][1].append(row)
+    # Largest fields first, each into the currently smallest shard
+    shards = [[[], [], 0] for _ in range(min(n, len(fields)))]
+    for kw in sorted(fields, key=lambda kw: -sum(map(len, fields[kw]))):
+        shard = min(shards, key=lambda shard: shard[2])
+        shard[0].extend(fields[kw][0])
+        shard[1].extend(fields[kw][1])
+        shard[2] += len(fields[kw][0]) + len(fields[kw][1])
+    # Keep the CSV order of rows, and shards in the order of their first unit
+    order = {id(row): i for i, row in enumerate(syntax)}
+    dataorder = {id(row): i for i, row in enumerate(data)}
+    shards = [(sorted(s, key=lambda r: order[id(r)]), sorted(d, key=lambda r: dataorder[id(r)]))
+              for s, d, _ in shards if s]
+    return sorted(shards, key=lambda shard: order[id(shard[0][0])])
+
+def _write_csv(path: str, fieldnames, rows):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def build_shard(workdir: str, i: int, syntax_fields, syntax, data_fields, data, sources: str):
+    syntax_file = os.path.join(workdir, 'syntax_%d.csv' % i)
+    data_file = os.path.join(workdir, 'data_%d.csv' % i)
+    output = os.path.join(workdir, 'shard_%d' % i)
+    _write_csv(syntax_file, syntax_fields, syntax)
+    _write_csv(data_file, data_fields, data)
+    result = subprocess.run([sys.executable, MAKE_SQLITE, '--syntax', syntax_file, '--data', data_file,
+                             '--output', output, '--sources', sources, '--defer-links', '--no-parse-cache'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("Shard %d failed:\n%s" % (i, result.stderr))
+    return output + '.db', result.stdout
+
+def _remapped(schema: Schema, table: str, column: str) -> str:
+    target = schema.target(table, column)
+    if target is None:
+        return 's.%s' % quote(column)
+    return '(SELECT new FROM temp.%s WHERE old = s.%s)' % (quote('map_' + target), quote(column))
+
+def merge_shard(conn: sqlite3.Connection, schema: Schema):
+    """Copy the attached database 'shard' into main, remapping all ids"""
+    for table in schema.entity_order():
+        cols = [c for c in schema.columns[table] if c != 'id']
+        mapping = quote('map_' + table)
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS %s (old INTEGER PRIMARY KEY, new INTEGER)' % mapping)
+        conn.execute('DELETE FROM temp.%s' % mapping)
+        exprs = {c: _remapped(schema, table, c) for c in cols}
+        if table in schema.unique:
+            match = ' AND '.join('m.%s IS %s' % (quote(c), exprs[c]) for c in schema.unique[table])
+            conn.execute('INSERT INTO main.%s (%s) SELECT %s FROM shard.%s AS s WHERE NOT EXISTS (SELECT 1 FROM main.%s AS m WHERE %s) ORDER BY s.id' % (
+                quote(table), ', '.join(map(quote, cols)), ', '.join(exprs.values()), quote(table), quote(table), match))
+            conn.execute('INSERT INTO temp.%s SELECT s.id, m.id FROM shard.%s AS s JOIN main.%s AS m ON %s' % (
+                mapping, quote(table), quote(table), match))
+        else:
+            offset = conn.execute('SELECT COALESCE(MAX(id), 0) FROM main.%s' % quote(table)).fetchone()[0]
+            conn.execute('INSERT INTO temp.%s SELECT id, id + %d FROM shard.%s' % (mapping, offset, quote(table)))
+            conn.execute('INSERT INTO main.%s (id, %s) SELECT s.id + %d, %s FROM shard.%s AS s' % (
+                quote(table), ', '.join(map(quote, cols)), offset, ', '.join(exprs.values()), quote(table)))
+    for table in schema.tables:
+        if schema.is_entity(table):
+            continue
+        cols = schema.columns[table]
+        select = 'SELECT %s FROM shard.%s AS s' % (', '.join(_remapped(schema, table, c) for c in cols), quote(table))
+        if table == 'pending_links':
+            conn.execute('INSERT INTO temp.pending_links %s' % select)
+        elif schema.pk[table]:
+            conn.execute('INSERT OR IGNORE INTO main.%s (%s) %s' % (quote(table), ', '.join(map(quote, cols)), select))
+        else: # no key to deduplicate on, e.g. parameters_to_formtypes
+            conn.execute('INSERT INTO main.%s (%s) %s EXCEPT SELECT %s FROM main.%s' % (
+                quote(table), ', '.join(map(quote, cols)), select, ', '.join(map(quote, cols)), quote(table)))
+
+def resolve_links(conn: sqlite3.Connection):
+    """Turn pending hyperlinks of all shards into units_to_units rows"""
+    linktype = conn.execute("SELECT id FROM unitlinktypes WHERE keyword = 'hyperlink'").fetchone()
+    if linktype is None:
+        return 0
+    candidates = defaultdict(list)
+    for uid, linker, semfield in conn.execute('''
+            SELECT u.id, u.linker, s.keyword FROM units AS u LEFT JOIN semfields AS s ON s.id = u.semfield_id
+            WHERE u.linker IN (SELECT hyperlink FROM temp.pending_links) ORDER BY u.id'''):
+        candidates[linker].append((uid, semfield))
+    links = []
+    for source_id, hyperlink, semfield in conn.execute('SELECT * FROM temp.pending_links ORDER BY rowid').fetchall():
+        refunits = candidates[hyperlink]
+        if len(refunits) == 0:
+            print("WARNING! Referenced unit %s not found" % hyperlink)
+            continue
+        if len(refunits) > 1:
+            refunits = [u for u in refunits if u[1] == semfield]
+            if len(refunits) == 0:
+                print("WARNING! No referenced unit %s with semfield %s" % (hyperlink, semfield))
+            if len(refunits) > 1:
+                print("WARNING! More than one referenced unit %s with semfield %s" % (hyperlink, semfield))
+        if len(refunits) > 0:
+            links.append((source_id, refunits[0][0], linktype[0]))
+    conn.executemany('INSERT OR IGNORE INTO units_to_units (source_id, target_id, unitlinktype_id) VALUES (?, ?, ?)', links)
+    return len(links)
+
+def merge(output: str, shard_files):
+    if os.path.exists(output):
+        os.remove(output)
+    conn = sqlite3.connect(output)
+    first = sqlite3.connect(shard_files[0])
+    objects = first.execute('''SELECT type, name, sql FROM sqlite_master
+                               WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' AND tbl_name != 'pending_links' ''').fetchall()
+    first.close()
+    for kind, name, sql in objects:
+        if kind == 'table':
+            conn.execute(sql)
+    conn.execute('CREATE TEMP TABLE pending_links (source_id INTEGER, hyperlink TEXT, semfield TEXT)')
+    for path in shard_files:
+        conn.execute('ATTACH DATABASE ? AS shard', (path,))
+        merge_shard(conn, Schema(conn, 'shard'))
+        conn.commit()
+        conn.execute('DETACH DATABASE shard')
+    links = resolve_links(conn)
+    # Indexes and triggers are created once the bulk inserts are done
+    for kind, name, sql in objects:
+        if kind != 'table':
+            conn.execute(sql)
+    conn.commit()
+    conn.close()
+    return links
+
+def build(syntax_file: str, data_file: str, filename: str, jobs: int):
+    start = time.perf_counter()
+    syntax_fields, syntax = read_csv(syntax_file)
+    data_fields, data = read_csv(data_file)
+    shards = partition(syntax, data, jobs)
+    workdir = tempfile.mkdtemp(prefix='ruslinkers-shards-')
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(build_shard, workdir, i, syntax_fields, s, data_fields, d, data_file)
+                       for i, (s, d) in enumerate(shards)]
+            results = [f.result() for f in futures]
+        built = time.perf_counter()
+        for (s, d), (path, output) in zip(shards, results):
+            print("Shard %s (line numbers within the shard):" % ', '.join(sorted({r["semfield1_ed"] for r in s})))
+            print(output, end='')
+        links = merge('%s.db' % filename, [path for path, _ in results])
+    finally:
+        shutil.rmtree(workdir)
+    done = time.perf_counter()
+    print("Built %d shards in %.1fs with %d processes, merged in %.1fs (%d hyperlinks)" % \
+        (len(shards), built - start, jobs, done - built, links))
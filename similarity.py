@@ -0,0 +1,200 @@
+# Similarity search over the unit x feature matrix.
+#
+# Every unit is a binary row over features taken from the database:
+#
+#   param    parameter values of the unit (units_to_parametervalues)
+#   form     parameter values of its forms, e.g. the correlative position
+#            (forms_to_parametervalues), prefixed with the form type
+#   semfield main and extra semantic fields, and subfields
+#
+# The matrix is a scipy CSR matrix cached next to the database in
+# <db>.similarity/ as plain .npy files, which are memory-mapped on load. The
+# cache is rebuilt when the database file changes. Jaccard and cosine scores
+# for one unit or a batch of units come from one sparse product with the
+# whole matrix.
+#
+#     python similarity.py ruslinkers-new4.db "потому что" -k 10
+#
+# Requires numpy and scipy.
+
+import os
+import json
+import sqlite3
+import argparse
+
+import numpy as np
+import scipy.sparse as sp
+
+GROUPS = ('param', 'form', 'semfield')
+
+# Every query returns (unit id, feature group, feature name)
+FEATURES = '''
+    SELECT up.unit_id, 'param', p.keyword || '=' || pv.keyword
+    FROM units_to_parametervalues AS up
+    JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+    JOIN parameters AS p ON p.id = pv.parameter_id
+UNION
+    SELECT f.unit_id, 'form', ft.keyword || ':' || p.keyword || '=' || pv.keyword
+    FROM forms_to_parametervalues AS fp
+    JOIN forms AS f ON f.id = fp.form_id
+    JOIN formtypes AS ft ON ft.id = f.formtype_id
+    JOIN parametervalues AS pv ON pv.id = fp.parametervalue_id
+    JOIN parameters AS p ON p.id = pv.parameter_id
+UNION
+    SELECT u.id, 'semfield', 'semfield=' || s.keyword
+    FROM units AS u JOIN semfields AS s ON s.id = u.semfield_id
+UNION
+    SELECT us.unit_id, 'semfield', 'semfield=' || s.keyword
+    FROM units_to_semfields AS us JOIN semfields AS s ON s.id = us.semfield_id
+UNION
+    SELECT ms.meaning_id, 'semfield', 'subfield=' || s.keyword
+    FROM meanings_to_subfields AS ms JOIN subfields AS s ON s.id = ms.subfield_id
+'''
+
+class SimilarityIndex:
+    """Binary unit x feature matrix with vectorized top-k queries"""
+
+    def __init__(self, matrix: sp.csr_matrix, unit_ids: np.ndarray, features, groups):
+        self.matrix = matrix
+        self.unit_ids = unit_ids
+        self.features = features
+        self.groups = np.asarray([GROUPS.index(g) for g in groups], dtype=np.int8)
+        self.rows = {int(uid): i for i, uid in enumerate(unit_ids)}
+        self.sizes = np.asarray(matrix.sum(axis=1)).ravel()
+
+    @classmethod
+    def build(cls, conn: sqlite3.Connection):
+        unit_ids = np.asarray([r[0] for r in conn.execute('SELECT id FROM units ORDER BY id')], dtype=np.int64)
+        rows = {int(uid): i for i, uid in enumerate(unit_ids)}
+        features = {}
+        groups = []
+        coo_rows, coo_cols = [], []
+        for uid, group, feature in conn.execute(FEATURES):
+            if uid not in rows:
+                continue
+            if feature not in features:
+                features[feature] = len(features)
+                groups.append(group)
+            coo_rows.append(rows[uid])
+            coo_cols.append(features[feature])
+        matrix = sp.csr_matrix((np.ones(len(coo_rows), dtype=np.float32), (coo_rows, coo_cols)),
+                               shape=(len(unit_ids), len(features)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return cls(matrix, unit_ids, list(features), groups)
+
+    def save(self, path: str, signature):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'data.npy'), self.matrix.data)
+        np.save(os.path.join(path, 'indices.npy'), self.matrix.indices)
+        np.save(os.path.join(path, 'indptr.npy'), self.matrix.indptr)
+        np.save(os.path.join(path, 'unit_ids.npy'), self.unit_ids)
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            json.dump({'signature': signature, 'shape': self.matrix.shape, 'features': self.features,
+                       'groups': [GROUPS[g] for g in self.groups]}, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, signature=None):
+        """Memory-map a saved index; None if missing or saved for another database"""
+        try:
+            with open(os.path.join(path, 'meta.json')) as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return None
+        if signature is not None and meta['signature'] != signature:
+            return None
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in ('data', 'indices', 'indptr', 'unit_ids')}
+        matrix = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(meta['shape']), copy=False)
+        return cls(matrix, arrays['unit_ids'], meta['features'], meta['groups'])
+
+    def restrict(self, groups):
+        """Index over the features of some groups only"""
+        keep = np.isin(self.groups, [GROUPS.index(g) for g in groups])
+        matrix = self.matrix[:, np.flatnonzero(keep)].tocsr()
+        return SimilarityIndex(matrix, self.unit_ids, [f for f, k in zip(self.features, keep) if k],
+                               [GROUPS[g] for g in self.groups[keep]])
+
+    def scores(self, unit_ids, metric: str = 'jaccard') -> np.ndarray:
+        """Dense (len(unit_ids) x units) matrix of similarity scores"""
+        rows = np.asarray([self.rows[int(uid)] for uid in unit_ids])
+        query = self.matrix[rows]
+        # |A & B| for every pair in one sparse product
+        inter = (query @ self.matrix.T).toarray()
+        qsizes = self.sizes[rows][:, None]
+        if metric == 'jaccard':
+            union = qsizes + self.sizes[None, :] - inter
+            return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        if metric == 'cosine':
+            norm = np.sqrt(qsizes * self.sizes[None, :])
+            return np.divide(inter, norm, out=np.zeros_like(inter), where=norm > 0)
+        raise ValueError("Unknown metric %s" % metric)
+
+    def top_k(self, unit_ids, k: int = 10, metric: str = 'jaccard', batch: int = 1024):
+        """For every query unit, [(unit id, score)] of the k most similar other units"""
+        unit_ids = list(unit_ids)
+        results = []
+        # Scores are dense per batch, so large batches are split up
+        for i in range(0, len(unit_ids), batch):
+            results.extend(self._top_k(unit_ids[i:i+batch], k, metric))
+        return results
+
+    def _top_k(self, unit_ids, k: int, metric: str):
+        scores = self.scores(unit_ids, metric)
+        rows = [self.rows[int(uid)] for uid in unit_ids]
+        scores[np.arange(len(rows)), rows] = -1 # never return the unit itself
+        k = min(k, scores.shape[1] - 1)
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(scores, best, axis=1).argsort(axis=1)[:, ::-1]
+        best = np.take_along_axis(best, order, axis=1)
+        return [[(int(self.unit_ids[j]), float(scores[i, j])) for j in best[i]] for i in range(len(rows))]
+
+    def shared_features(self, a: int, b: int):
+        fa = set(self.matrix[self.rows[a]].indices)
+        fb = set(self.matrix[self.rows[b]].indices)
+        return [self.features[f] for f in sorted(fa & fb)]
+
+def _signature(path: str):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def open_index(path: str) -> SimilarityIndex:
+    """Load the cached index of a database, building it if needed"""
+    cache = path + '.similarity'
+    index = SimilarityIndex.load(cache, _signature(path))
+    if index is None:
+        conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+        index = SimilarityIndex.build(conn)
+        conn.close()
+        index.save(cache, _signature(path))
+        index = SimilarityIndex.load(cache)
+    return index
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Find the linkers most similar to a given one")
+    argparser.add_argument("database")
+    argparser.add_argument("linker", nargs='+', help="linker(s) to look up")
+    argparser.add_argument("-k", type=int, default=10)
+    argparser.add_argument("--metric", choices=["jaccard", "cosine"], default="jaccard")
+    argparser.add_argument("--groups", default=','.join(GROUPS),
+                           help="feature groups to compare on (default: %(default)s)")
+    argparser.add_argument("--shared", action="store_true", help="list the features shared with each result")
+    args = argparser.parse_args()
+
+    index = open_index(args.database)
+    groups = args.groups.split(',')
+    if set(groups) != set(GROUPS):
+        index = index.restrict(groups)
+    conn = sqlite3.connect('file:%s?mode=ro' % args.database, uri=True)
+    names = dict(conn.execute('''SELECT u.id, u.linker || ' (' || COALESCE(s.keyword, '') || ')'
+                                 FROM units AS u LEFT JOIN semfields AS s ON s.id = u.semfield_id'''))
+    queries = [uid for linker in args.linker
+               for uid, in conn.execute('SELECT id FROM units WHERE linker = ? ORDER BY id', (linker,))]
+    if not queries:
+        print("No unit %s" % ', '.join(args.linker))
+    for uid, results in zip(queries, index.top_k(queries, args.k, args.metric)):
+        print("%s:" % names[uid])
+        for other, score in results:
+            print("  %.3f  %s" % (score, names[other]))
+            if args.shared:
+                print("         %s" % ', '.join(index.shared_features(uid, other)))
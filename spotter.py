@@ -0,0 +1,334 @@
+# Aho-Corasick linker spotter for running text.
+#
+# The patterns are every Unit.linker and every Form of type phonvar,
+# mainpart and correl. Linkers are written with a small notation, which
+# expand() turns into plain word sequences:
+#
+#   если... то            components of discontinuous linkers ("..." or "…")
+#   но/однако, (а/но)     alternatives
+#   в другом (случае)     optional words
+#   то; так; тогда        alternative lists
+#   чем [сравн. степень]  editorial notes in brackets, dropped
+#
+# Only single-component patterns are matched here (see discontinuous.py for
+# the others). The automaton works on words instead of characters: text is
+# lowercased, ё is read as е, and split into words (hyphenated words such as
+# всё-таки are one word), so matches always start and end at word
+# boundaries. Commas and dashes between words are ignored; sentence
+# punctuation ends all partial matches.
+#
+# The compiled automaton is written next to the database as <db>.spotter by
+# make-sqlite.py and loaded with Spotter.load(). The file holds the plain
+# tables of the automaton and FORMAT, so it loads from any module and files
+# of another format are compiled again. scan() and scan_stream()
+# yield (offset, length, unit ids) with character offsets into the text.
+#
+#     python spotter.py ruslinkers-new4.db corpus.txt
+#     python spotter.py ruslinkers-new4.db --bench 2G
+
+import os
+import re
+import sys
+import time
+import pickle
+import random
+import sqlite3
+import argparse
+import tempfile
+
+from collections import deque
+from typing import Iterator, List, Tuple
+
+FORMTYPES = ('phonvar', 'mainpart', 'correl')
+
+# Format of the .spotter files; bump it when save() writes something else
+FORMAT = 2
+
+# Form texts that are notes rather than text to look for
+NOT_PATTERNS = {'дублирование'}
+
+TOKEN = re.compile(r"(\w+(?:-\w+)*)|([.!?…;:])")
+WORD = re.compile(r"\w+(?:-\w+)*")
+
+def normalize(text: str) -> str:
+    """Lowercase and replace ё by е, keeping character offsets"""
+    lowered = text.lower()
+    if len(lowered) != len(text): # a few characters lowercase to two
+        lowered = ''.join(c.lower()[:1] for c in text)
+    return lowered.replace('ё', 'е')
+
+def _split_top(text: str, sep: str) -> List[str]:
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(text):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth = max(0, depth - 1)
+        elif c == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+def _expand_component(text: str) -> List[str]:
+    alternatives = _split_top(text, '/')
+    if len(alternatives) > 1:
+        return [v for a in alternatives for v in _expand_component(a)]
+    start = text.find('(')
+    if start < 0:
+        return [text]
+    depth = 0
+    for end in range(start, len(text)):
+        if text[end] == '(':
+            depth += 1
+        elif text[end] == ')':
+            depth -= 1
+            if depth == 0:
+                break
+    else:
+        return [text.replace('(', ' ')]
+    before, inner, after = text[:start], text[start+1:end], text[end+1:]
+    return [before + ' ' + middle + ' ' + rest
+            for middle in [''] + _expand_component(inner)
+            for rest in _expand_component(after)]
+
+def words(text: str) -> Tuple[str, ...]:
+    return tuple(WORD.findall(normalize(text)))
+
+def expand(text: str) -> List[List[Tuple[str, ...]]]:
+    """Variants of a linker, each a list of components, each a tuple of words"""
+    text = re.sub(r'\[[^\]]*\]', ' ', text).replace('_', ' ').replace('…', '...')
+    variants = []
+    for alternative in _split_top(text, ';'):
+        components = [c for c in re.split(r'\.{2,}', alternative) if c.strip()]
+        expanded = [[words(v) for v in _expand_component(c)] for c in components]
+        combos = [[]]
+        for options in expanded:
+            combos = [combo + [option] for combo in combos for option in dict.fromkeys(options) if option]
+        for combo in combos:
+            if combo and combo not in variants:
+                variants.append(combo)
+    return variants
+
+def patterns(conn: sqlite3.Connection):
+    """(unit id, formtype or 'linker', text) of everything that names a unit"""
+    yield from ((uid, 'linker', text) for uid, text in conn.execute('SELECT id, linker FROM units'))
+    yield from conn.execute('''
+        SELECT f.unit_id, ft.keyword, f.text FROM forms AS f JOIN formtypes AS ft ON ft.id = f.formtype_id
+        WHERE ft.keyword IN (%s)''' % ', '.join('?' * len(FORMTYPES)), FORMTYPES)
+
+class Automaton:
+    """Aho-Corasick automaton over words"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()] # per state: ((length in words, value), ...)
+
+    def add(self, sequence: Tuple[str, ...], value):
+        state = 0
+        for word in sequence:
+            nxt = self.goto[state].get(word)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][word] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = nxt
+        if (len(sequence), value) not in self.out[state]:
+            self.out[state] += ((len(sequence), value),)
+
+    def finalize(self):
+        """Compute failure links and merge the outputs reachable through them"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and word not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(word, 0)
+                self.out[nxt] += self.out[self.fail[nxt]]
+        self._index()
+
+    def _index(self):
+        self.vocabulary = frozenset(w for g in self.goto for w in g)
+
+class Spotter:
+    def __init__(self, automaton: Automaton, maxlen: int):
+        self.automaton = automaton
+        self.maxlen = maxlen
+
+    @classmethod
+    def compile(cls, conn: sqlite3.Connection):
+        values = {}
+        for uid, _, text in patterns(conn):
+            if text is None or text.strip() in NOT_PATTERNS:
+                continue
+            for variant in expand(text):
+                if len(variant) == 1:
+                    values.setdefault(variant[0], set()).add(uid)
+        automaton = Automaton()
+        for sequence, uids in values.items():
+            automaton.add(sequence, tuple(sorted(uids)))
+        automaton.finalize()
+        return cls(automaton, max(map(len, values), default=1))
+
+    def save(self, path: str):
+        # Plain lists, dicts and tuples only: a pickled Spotter would name the module it was
+        # compiled in, which is __main__ when compiled by running this file
+        data = {'format': FORMAT, 'goto': self.automaton.goto, 'fail': self.automaton.fail,
+                'out': self.automaton.out, 'maxlen': self.maxlen}
+        with open(path, 'wb') as file:
+            pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> "Spotter":
+        """Spotter saved by save(); ValueError if the file has another format"""
+        with open(path, 'rb') as file:
+            try:
+                data = pickle.load(file)
+            except (pickle.UnpicklingError, AttributeError, ImportError, EOFError) as e:
+                raise ValueError("%s is not a compiled spotter of format %d: %s" % (path, FORMAT, e))
+        if not isinstance(data, dict) or data.get('format') != FORMAT:
+            raise ValueError("%s has format %s, expected %d; compile it again" % (
+                path, data.get('format') if isinstance(data, dict) else 'unknown', FORMAT))
+        automaton = Automaton()
+        automaton.goto, automaton.fail, automaton.out = data['goto'], data['fail'], data['out']
+        automaton._index()
+        return cls(automaton, data['maxlen'])
+
+    @classmethod
+    def load_compiled(cls, path: str, conn: sqlite3.Connection = None) -> "Spotter":
+        """The spotter of a database from its .spotter file if that is current, else compiled again
+
+        A spotter compiled again is written to the .spotter file, unless it is
+        compiled from conn, an open connection to the database."""
+        compiled = os.path.splitext(path)[0] + '.spotter'
+        if os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(path):
+            try:
+                return cls.load(compiled)
+            except ValueError as e:
+                print("WARNING: %s" % e, file=sys.stderr)
+        if conn is not None:
+            return cls.compile(conn)
+        return cls.load(compile_database(path))
+
+    def _scan(self, text: str, base: int, context):
+        """Scan text starting at offset base; context is [state, starts of the last words]"""
+        goto, fail, out, vocabulary = self.automaton.goto, self.automaton.fail, self.automaton.out, self.automaton.vocabulary
+        state, starts = context
+        for m in TOKEN.finditer(normalize(text)):
+            word = m.group(1)
+            if word is None or word not in vocabulary:
+                # A word no pattern contains, or the end of a sentence
+                state = 0
+                starts.clear()
+                continue
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            starts.append(base + m.start())
+            if out[state]:
+                end = base + m.end()
+                for length, uids in out[state]:
+                    start = starts[-length]
+                    yield start, end - start, uids
+        context[0] = state
+
+    def scan(self, text: str) -> Iterator[Tuple[int, int, tuple]]:
+        """(offset, length, unit ids) of every match, overlapping ones included"""
+        return self._scan(text, 0, [0, deque(maxlen=self.maxlen)])
+
+    def scan_stream(self, file, chunk_size: int = 1 << 20) -> Iterator[Tuple[int, int, tuple]]:
+        """Like scan() over a text file object read in chunks"""
+        context = [0, deque(maxlen=self.maxlen)]
+        base, rest = 0, ''
+        while True:
+            chunk = file.read(chunk_size)
+            text = rest + chunk
+            if not chunk:
+                yield from self._scan(text, base, context)
+                return
+            # Words may continue in the next chunk, so stop at the last space
+            cut = max(text.rfind(' '), text.rfind('\n')) + 1
+            if cut == 0:
+                rest = text
+                continue
+            yield from self._scan(text[:cut], base, context)
+            base += cut
+            rest = text[cut:]
+
+def longest(matches):
+    """Leftmost-longest matches that do not overlap each other"""
+    kept = []
+    end = 0
+    for offset, length, uids in sorted(matches, key=lambda m: (m[0], -m[1])):
+        if offset >= end:
+            kept.append((offset, length, uids))
+            end = offset + length
+    return kept
+
+def compile_database(path: str) -> str:
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    spotter = Spotter.compile(conn)
+    conn.close()
+    output = os.path.splitext(path)[0] + '.spotter'
+    spotter.save(output)
+    return output
+
+def synthetic_text(conn: sqlite3.Connection, size: int, seed: int = 0) -> Iterator[str]:
+    """Chunks of random text built from the example sentences, size bytes in total"""
+    rng = random.Random(seed)
+    sentences = [t for t, in conn.execute("SELECT text FROM examples WHERE typeof(text) = 'text'")]
+    written = 0
+    while written < size:
+        chunk = '\n'.join(rng.choice(sentences) for _ in range(1000)) + '\n'
+        written += len(chunk.encode())
+        yield chunk
+
+def bench(path: str, size: int):
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    spotter = Spotter.compile(conn)
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+        for chunk in synthetic_text(conn, size):
+            file.write(chunk)
+    conn.close()
+    try:
+        nbytes = os.path.getsize(file.name)
+        start = time.perf_counter()
+        count = 0
+        with open(file.name) as text:
+            for _ in spotter.scan_stream(text):
+                count += 1
+        elapsed = time.perf_counter() - start
+        print("%.1f MB scanned in %.1f s: %.2f MB/s, %d matches" % (nbytes / 1e6, elapsed, nbytes / 1e6 / elapsed, count))
+    finally:
+        os.remove(file.name)
+
+def _size(text: str) -> int:
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Find linkers in running text")
+    argparser.add_argument("database")
+    argparser.add_argument("text", nargs='?', help="text file to scan (default: standard input)")
+    argparser.add_argument("--longest", action="store_true", help="drop matches inside longer matches")
+    argparser.add_argument("--bench", metavar="SIZE", help="measure throughput on SIZE (e.g. 2G) of synthetic text")
+    args = argparser.parse_args()
+
+    if args.bench:
+        bench(args.database, _size(args.bench))
+        sys.exit()
+    spotter = Spotter.load_compiled(args.database)
+    file = open(args.text) if args.text else sys.stdin
+    matches = spotter.scan_stream(file)
+    if args.longest:
+        matches = longest(list(matches))
+    for offset, length, uids in matches:
+        print("%d\t%d\t%s" % (offset, length, ','.join(map(str, uids))))
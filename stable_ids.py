@@ -0,0 +1,139 @@
+# Deterministic ids for a built database.
+#
+# make-sqlite.py numbers rows in the order of the CSV tables, so inserting a
+# row shifts the ids of everything after it. This pass gives every entity an
+# id derived from its content key instead: the key columns of releases.KEYS
+# (with foreign keys replaced by the stable ids of what they point to), plus
+# for units the set of their subfields. Entities with identical keys are told
+# apart by their order of occurrence. The key is hashed into [2**31, 2**53),
+# which keeps ids apart from autoincrement ids and exact in JSON numbers;
+# the rare collisions are resolved by probing upwards in key order.
+#
+# All id and foreign key columns are then rewritten in place, so an entity
+# that did not change keeps its id from one build to the next.
+#
+#     python stable_ids.py ruslinkers-new4.db
+
+import json
+import hashlib
+import sqlite3
+import argparse
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from releases import KEYS, Schema, quote, _remap
+
+ID_BASE = 1 << 31
+ID_LIMIT = 1 << 53
+
+# Entities whose key also includes the entities linked to them through an
+# association table: {table: linked table}
+LINKED_KEYS = {
+    'units': 'subfields',
+}
+
+def _hash_id(table: str, key) -> int:
+    data = json.dumps([table] + list(key), ensure_ascii=False).encode()
+    h = int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+    return ID_BASE + h % (ID_LIMIT - ID_BASE)
+
+def _linked(conn: sqlite3.Connection, schema: Schema, table: str, other: str, idmaps):
+    """{id of table: sorted stable ids of the linked rows of other}"""
+    linked = defaultdict(list)
+    for t in schema.tables:
+        # Association tables only: derived tables such as unit_fields also refer to both
+        if schema.is_entity(t) or len(schema.columns[t]) != 2:
+            continue
+        own = [c for c in schema.columns[t] if schema.target(t, c) == table]
+        far = [c for c in schema.columns[t] if schema.target(t, c) == other]
+        if len(own) == 1 and len(far) == 1:
+            for a, b in conn.execute('SELECT %s, %s FROM %s' % (quote(own[0]), quote(far[0]), quote(t))):
+                linked[a].append(idmaps[other].get(b, b))
+    return {k: tuple(sorted(v)) for k, v in linked.items()}
+
+@contextmanager
+def without_triggers(conn: sqlite3.Connection):
+    """Drop the triggers for the duration of a bulk rewrite of already validated rows
+
+    The drop and the rewrite are one transaction: if the rewrite raises, it is
+    rolled back with the drop, and the triggers are there again either way."""
+    # The validation triggers would see half-rewritten rows, and the
+    # parametermap triggers would recompute a map for every rewritten row
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    try:
+        for name, _ in triggers:
+            conn.execute('DROP TRIGGER %s' % quote(name))
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        # Only missing after a rewrite that committed before failing
+        existing = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        for name, sql in triggers:
+            if name not in existing:
+                conn.execute(sql)
+
+def assign_ids(conn: sqlite3.Connection, schema: Schema):
+    """{table: {current id: stable id}} for every entity table"""
+    idmaps = defaultdict(dict)
+    for table in schema.entity_order():
+        cols = schema.columns[table]
+        keycols = [c for c in KEYS.get(table, cols) if c in cols and c != 'id']
+        rows = conn.execute('SELECT %s FROM %s ORDER BY id' % (', '.join(map(quote, cols)), quote(table))).fetchall()
+        linked = _linked(conn, schema, table, LINKED_KEYS[table], idmaps) if table in LINKED_KEYS else None
+        occurrences = defaultdict(list) # key -> current ids in build order
+        for row, orig in zip(_remap(schema, table, rows, idmaps), rows):
+            key = tuple(row[cols.index(c)] for c in keycols)
+            if linked is not None:
+                key += (linked.get(orig[cols.index('id')], ()),)
+            occurrences[key].append(orig[cols.index('id')])
+        keyed = []
+        for key, olds in occurrences.items():
+            # Entities with the same key keep their relative order, as tools pairing them by occurrence expect
+            hashes = sorted(_hash_id(table, key + (n,)) for n in range(1, len(olds) + 1))
+            keyed.extend((h, key, n, old) for n, (h, old) in enumerate(zip(hashes, olds), 1))
+        used = set()
+        # Collisions go to the next free id; taking keys in hash order makes that independent of row order
+        for new, key, occurrence, old in sorted(keyed, key=lambda k: (k[0], json.dumps(k[1:3], ensure_ascii=False))):
+            while new in used:
+                new = new + 1 if new + 1 < ID_LIMIT else ID_BASE
+            used.add(new)
+            idmaps[table][old] = new
+    return idmaps
+
+def apply_ids(conn: sqlite3.Connection, schema: Schema, idmaps):
+    """Rewrite every id and foreign key column according to idmaps"""
+    for table, mapping in idmaps.items():
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS %s (old INTEGER PRIMARY KEY, new INTEGER)' % quote('ids_' + table))
+        conn.execute('DELETE FROM temp.%s' % quote('ids_' + table))
+        conn.executemany('INSERT INTO temp.%s VALUES (?, ?)' % quote('ids_' + table), mapping.items())
+    with without_triggers(conn):
+        for table in schema.tables:
+            for column in schema.columns[table]:
+                target = schema.target(table, column)
+                if target not in idmaps:
+                    continue
+                # Negative ids in between, so no UNIQUE constraint sees two rows with the same id
+                conn.execute('UPDATE %s SET %s = -(SELECT new FROM temp.%s WHERE old = %s) WHERE %s IN (SELECT old FROM temp.%s)' % (
+                    quote(table), quote(column), quote('ids_' + target), quote(column), quote(column), quote('ids_' + target)))
+                conn.execute('UPDATE %s SET %s = -%s WHERE %s < 0' % (quote(table), quote(column), quote(column), quote(column)))
+
+def stabilize(path: str) -> int:
+    """Give every entity of a built database its deterministic id; returns the number of entities"""
+    conn = sqlite3.connect(path)
+    schema = Schema(conn)
+    idmaps = assign_ids(conn, schema)
+    apply_ids(conn, schema, idmaps)
+    conn.commit()
+    conn.close()
+    return sum(map(len, idmaps.values()))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Replace the ids of a built database by ids derived from content")
+    argparser.add_argument("database")
+    args = argparser.parse_args()
+    print("%d entities renumbered" % stabilize(args.database))
@@ -0,0 +1,387 @@
+# Static site of a built database, to be served from a CDN.
+#
+# Every page is written as JSON and as HTML:
+#
+#   index.*               the semantic fields with their subfields, the parameters with their values
+#   units/<id>.*          the unit's document as dump.py writes it
+#   semfields/<id>.*      the units of a semantic field, from unit_fields (see closure.py)
+#   subfields/<id>.*      the units of a subfield
+#   values/<id>.*         the units and forms with a parameter value (not for hidden parameters)
+#
+# Lists of units are in alphabetical order (collation.py). The pages are
+# rendered in batches of one kind by a pool of forked processes, and every
+# process opens its own read-only connection (memimage.connect, so an image
+# preloaded with --preload is shared by the workers). Unit pages use the
+# batched section queries of dump.py; hidden comments are left out.
+#
+# .site-manifest.json in the output directory keeps the SHA-256 of every page
+# of the last generation, and a fingerprint of what every page was rendered
+# from: for a unit the section hashes of dbdiff.py plus the ids of its link
+# targets, for the other pages the rows of FINGERPRINTS. Only the pages whose
+# fingerprint changed, or whose files are missing, are rendered again, and a
+# page with the same hash is not written again, so its modification time
+# stays and a sync to the CDN uploads the changed pages only; pages of
+# entities that are gone are removed. The index is always rendered. --full
+# renders everything, which is needed after a change of the templates unless
+# FORMAT is raised with it.
+#
+#     python static_site.py build ruslinkers-new4.db site --workers 4
+#     python static_site.py bench ruslinkers-new4.db --workers 1,2,4
+#
+# bench generates the whole site into a temporary directory with every number
+# of workers, then generates it again over itself, where no page changes and
+# only the index is rendered.
+
+import os
+import sys
+import json
+import html
+import time
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+
+from collections import defaultdict
+
+import dump
+import dbdiff
+import memimage
+from collation import sort_key
+
+KINDS = ('index', 'units', 'semfields', 'subfields', 'values')
+BATCH = 100
+MANIFEST = '.site-manifest.json'
+# Version of the templates: a manifest of another version renders every page again
+FORMAT = 1
+
+IDS = {
+    'units': 'SELECT id FROM units ORDER BY id',
+    'semfields': 'SELECT id FROM semfields ORDER BY id',
+    'subfields': 'SELECT id FROM subfields ORDER BY id',
+    'values': '''SELECT pv.id FROM parametervalues AS pv JOIN parameters AS p ON p.id = pv.parameter_id
+                 WHERE NOT p.hidden ORDER BY pv.id''',
+}
+
+# Rows every page but the index is rendered from, by the id of its entity first
+FINGERPRINTS = {
+    'units': list(dbdiff.SECTIONS.values()) + ['SELECT source_id, target_id FROM units_to_units'],
+    'semfields': [
+        'SELECT id, keyword, name FROM semfields',
+        '''SELECT uf.semfield_id, uf.unit_id, u.linker, uf.role FROM unit_fields AS uf
+           JOIN units AS u ON u.id = uf.unit_id WHERE uf.subfield_id IS NULL''',
+    ],
+    'subfields': [
+        'SELECT s.id, s.keyword, s.name, s.semfield_id, f.keyword FROM subfields AS s LEFT JOIN semfields AS f ON f.id = s.semfield_id',
+        '''SELECT uf.subfield_id, uf.unit_id, u.linker, uf.role FROM unit_fields AS uf
+           JOIN units AS u ON u.id = uf.unit_id WHERE uf.subfield_id IS NOT NULL''',
+    ],
+    'values': [
+        'SELECT pv.id, pv.keyword, pv.name, p.keyword, p.name FROM parametervalues AS pv JOIN parameters AS p ON p.id = pv.parameter_id',
+        'SELECT up.parametervalue_id, u.id, u.linker FROM units_to_parametervalues AS up JOIN units AS u ON u.id = up.unit_id',
+        '''SELECT fp.parametervalue_id, f.id, f.text, ft.keyword, u.id, u.linker FROM forms_to_parametervalues AS fp
+           JOIN forms AS f ON f.id = fp.form_id JOIN formtypes AS ft ON ft.id = f.formtype_id JOIN units AS u ON u.id = f.unit_id''',
+    ],
+}
+
+# State of a worker process: connection, output directory, hashes of the last generation
+_worker = {}
+
+def _init(path: str, output: str, manifest):
+    _worker['conn'] = memimage.connect(path)
+    _worker['sections'] = dump._sections()
+    _worker['output'], _worker['manifest'] = output, manifest
+
+def _in(ids) -> str:
+    return ', '.join('%d' % i for i in ids)
+
+def _alphabetical(units):
+    return sorted(units, key=lambda u: (sort_key(u['linker']), u['id']))
+
+def _page(title: str, body: str, root: str = '../') -> str:
+    return ('<!DOCTYPE html>\n<html lang="ru">\n<head><meta charset="utf-8"><title>%s</title></head>\n'
+            '<body>\n<p><a href="%sindex.html">Указатель</a></p>\n<h1>%s</h1>\n%s</body>\n</html>\n'
+            % (html.escape(title), root, html.escape(title), body))
+
+def _unit_list(units) -> str:
+    items = ''.join('<li><a href="../units/%d.html">%s</a>%s</li>\n' % (
+        u['id'], html.escape(u['linker']), ' (%s)' % html.escape(u['role']) if 'role' in u else '') for u in units)
+    return '<ul>\n%s</ul>\n' % items
+
+def _texts(title: str, items) -> str:
+    if not items:
+        return ''
+    return '<h2>%s</h2>\n<ul>\n%s</ul>\n' % (title, ''.join('<li>%s</li>\n' % html.escape(i['text']) for i in items))
+
+def _values(values) -> str:
+    rows = []
+    for v in values:
+        rows.append('<li>%s: %s%s%s</li>\n' % (html.escape(v['parameter']), html.escape(v['value']),
+                                                _texts('Примеры', v['examples']), _texts('Комментарии', v['comments'])))
+    return '<ul>\n%s</ul>\n' % ''.join(rows) if rows else ''
+
+def _unit_html(doc) -> str:
+    body = ['<p>Семантическое поле: %s</p>\n' % html.escape(doc['semfield'] or '')]
+    if doc['subfields']:
+        body.append('<p>Подполя: %s</p>\n' % html.escape(', '.join(doc['subfields'])))
+    for source, meanings in sorted(doc['meanings'].items(), key=lambda m: m[0] or ''):
+        body.append(_texts('Значения (%s)' % (source or '—'), [{'text': m['meaning'] or ''} for m in meanings]))
+    body.append(_values(doc['parameters']))
+    for form in doc['forms']:
+        body.append('<h2>%s: %s</h2>\n%s' % (html.escape(form['type']), html.escape(form['text']), _values(form['parameters'])))
+    body.append(_texts('Примеры', doc['examples']))
+    body.append(_texts('Комментарии', doc['comments']))
+    if doc['links']:
+        body.append('<h2>Ссылки</h2>\n<ul>\n%s</ul>\n' % ''.join('<li>%s: <a href="%d.html">%s</a></li>\n' % (
+            html.escape(l['type']), l['target'], html.escape(l['linker'])) for l in doc['links']))
+    return _page(doc['linker'], ''.join(body))
+
+def render_units(conn: sqlite3.Connection, ids, sections):
+    """{page path: (document, HTML)} of the units with the given ids"""
+    pages = {}
+    for _ in dump.batches(conn, len(ids), ids):
+        for doc in dump.documents(conn, sections):
+            pages['units/%d' % doc['id']] = (doc, _unit_html(doc))
+    return pages
+
+def _field_units(conn: sqlite3.Connection, column: str, ids):
+    units = defaultdict(list)
+    for field_id, unit_id, linker, role in conn.execute('''
+            SELECT uf.%s, uf.unit_id, u.linker, uf.role FROM unit_fields AS uf JOIN units AS u ON u.id = uf.unit_id
+            WHERE uf.%s IN (%s)%s''' % (column, column, _in(ids), ' AND uf.subfield_id IS NULL' if column == 'semfield_id' else '')):
+        units[field_id].append({'id': unit_id, 'linker': linker, 'role': role})
+    return units
+
+def render_semfields(conn: sqlite3.Connection, ids, sections=None):
+    units = _field_units(conn, 'semfield_id', ids)
+    pages = {}
+    for sid, keyword, name in conn.execute('SELECT id, keyword, name FROM semfields WHERE id IN (%s)' % _in(ids)):
+        doc = {'id': sid, 'keyword': keyword, 'name': name, 'units': _alphabetical(units[sid])}
+        pages['semfields/%d' % sid] = (doc, _page(name or keyword, _unit_list(doc['units'])))
+    return pages
+
+def render_subfields(conn: sqlite3.Connection, ids, sections=None):
+    units = _field_units(conn, 'subfield_id', ids)
+    pages = {}
+    for sid, keyword, name, semfield_id, semfield in conn.execute('''
+            SELECT s.id, s.keyword, s.name, s.semfield_id, f.keyword FROM subfields AS s
+            LEFT JOIN semfields AS f ON f.id = s.semfield_id WHERE s.id IN (%s)''' % _in(ids)):
+        doc = {'id': sid, 'keyword': keyword, 'name': name, 'semfield': {'id': semfield_id, 'keyword': semfield},
+               'units': _alphabetical(units[sid])}
+        link = '<p><a href="../semfields/%d.html">%s</a></p>\n' % (semfield_id, html.escape(semfield)) if semfield else ''
+        pages['subfields/%d' % sid] = (doc, _page(name or keyword, link + _unit_list(doc['units'])))
+    return pages
+
+def render_values(conn: sqlite3.Connection, ids, sections=None):
+    units, forms = defaultdict(list), defaultdict(list)
+    for pv_id, unit_id, linker in conn.execute('''
+            SELECT up.parametervalue_id, u.id, u.linker FROM units_to_parametervalues AS up
+            JOIN units AS u ON u.id = up.unit_id WHERE up.parametervalue_id IN (%s)''' % _in(ids)):
+        units[pv_id].append({'id': unit_id, 'linker': linker})
+    for pv_id, form_id, text, formtype, unit_id, linker in conn.execute('''
+            SELECT fp.parametervalue_id, f.id, f.text, ft.keyword, u.id, u.linker FROM forms_to_parametervalues AS fp
+            JOIN forms AS f ON f.id = fp.form_id JOIN formtypes AS ft ON ft.id = f.formtype_id
+            JOIN units AS u ON u.id = f.unit_id WHERE fp.parametervalue_id IN (%s)''' % _in(ids)):
+        forms[pv_id].append({'id': form_id, 'text': text, 'type': formtype, 'unit': unit_id, 'linker': linker})
+    pages = {}
+    for pv_id, keyword, name, parameter, parameter_name in conn.execute('''
+            SELECT pv.id, pv.keyword, pv.name, p.keyword, p.name FROM parametervalues AS pv
+            JOIN parameters AS p ON p.id = pv.parameter_id WHERE pv.id IN (%s)''' % _in(ids)):
+        doc = {'id': pv_id, 'keyword': keyword, 'name': name, 'parameter': parameter, 'parameter_name': parameter_name,
+               'units': _alphabetical(units[pv_id]),
+               'forms': sorted(forms[pv_id], key=lambda f: (sort_key(f['text']), f['id']))}
+        body = _unit_list(doc['units'])
+        if doc['forms']:
+            body += '<h2>Формы</h2>\n<ul>\n%s</ul>\n' % ''.join('<li>%s (%s) — <a href="../units/%d.html">%s</a></li>\n' % (
+                html.escape(f['text']), html.escape(f['type']), f['unit'], html.escape(f['linker'])) for f in doc['forms'])
+        pages['values/%d' % pv_id] = (doc, _page('%s: %s' % (parameter_name or parameter, name or keyword), body))
+    return pages
+
+def render_index(conn: sqlite3.Connection, ids=None, sections=None):
+    semfields = {}
+    for sid, keyword, name in conn.execute('SELECT id, keyword, name FROM semfields ORDER BY keyword'):
+        semfields[sid] = {'id': sid, 'keyword': keyword, 'name': name, 'subfields': []}
+    for sid, keyword, name, semfield_id in conn.execute('SELECT id, keyword, name, semfield_id FROM subfields ORDER BY keyword'):
+        if semfield_id in semfields:
+            semfields[semfield_id]['subfields'].append({'id': sid, 'keyword': keyword, 'name': name})
+    parameters = {}
+    for pid, keyword, name, pv_id, value, value_name in conn.execute('''
+            SELECT p.id, p.keyword, p.name, pv.id, pv.keyword, pv.name FROM parameters AS p
+            JOIN parametervalues AS pv ON pv.parameter_id = p.id WHERE NOT p.hidden ORDER BY p.keyword, pv.keyword'''):
+        parameters.setdefault(pid, {'keyword': keyword, 'name': name, 'values': []})['values'].append(
+            {'id': pv_id, 'keyword': value, 'name': value_name})
+    doc = {'semfields': list(semfields.values()), 'parameters': list(parameters.values())}
+    body = ['<h2>Семантические поля</h2>\n<ul>\n']
+    for s in doc['semfields']:
+        body.append('<li><a href="semfields/%d.html">%s</a>%s</li>\n' % (s['id'], html.escape(s['name'] or s['keyword']), ''.join(
+            '<br>\n&nbsp;&nbsp;<a href="subfields/%d.html">%s</a>' % (sf['id'], html.escape(sf['name'] or sf['keyword']))
+            for sf in s['subfields'])))
+    body.append('</ul>\n<h2>Параметры</h2>\n<ul>\n')
+    for p in doc['parameters']:
+        body.append('<li>%s: %s</li>\n' % (html.escape(p['name'] or p['keyword']), ', '.join(
+            '<a href="values/%d.html">%s</a>' % (v['id'], html.escape(v['name'] or v['keyword'])) for v in p['values'])))
+    body.append('</ul>\n')
+    return {'index': (doc, _page('Коннекторы русского языка', ''.join(body), root=''))}
+
+RENDER = {'index': render_index, 'units': render_units, 'semfields': render_semfields,
+          'subfields': render_subfields, 'values': render_values}
+
+def fingerprints(conn: sqlite3.Connection, kind: str):
+    """{id: fingerprint} of the pages of a kind"""
+    hashes = defaultdict(hashlib.sha256)
+    # Compressed values are compared as text: another build compresses them differently
+    value = 'quote(plain(c%d))' if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'zstd_dictionaries'").fetchone() \
+        else 'quote(c%d)'
+    for n, sql in enumerate(FINGERPRINTS[kind]):
+        width = len(conn.execute('SELECT * FROM (%s) LIMIT 0' % sql).description)
+        columns = ', '.join('c%d' % i for i in range(width))
+        # SQLite joins the rows of an entity; Python hashes one string per entity and query
+        rows = conn.execute('''WITH q (%s) AS (%s) SELECT c0, group_concat(%s, char(30)) FROM (SELECT * FROM q ORDER BY %s)
+                               GROUP BY c0''' % (columns, sql, " || char(31) || ".join(value % i for i in range(1, width)), columns))
+        for entity, text in rows:
+            hashes[entity].update(b'%d\0%s\0' % (n, text.encode()))
+    return {entity: h.hexdigest() for entity, h in hashes.items()}
+
+def _rendered(output: str, pages, name: str) -> bool:
+    return all(name + ext in pages and os.path.exists(os.path.join(output, name + ext)) for ext in ('.json', '.html'))
+
+def tasks(conn: sqlite3.Connection, batch: int = BATCH, output: str = None, old=None):
+    """([(kind, ids), ...], {kind: {id: fingerprint}}, [pages kept as they are])
+
+    The index comes first, then every kind in batches. Given the output directory and
+    its manifest, entities whose fingerprint and pages are unchanged are left out."""
+    old = old or {'pages': {}}
+    result = [('index', [])]
+    current, kept = {}, []
+    for kind, sql in IDS.items():
+        ids = [i for i, in conn.execute(sql)]
+        current[kind] = fingerprints(conn, kind)
+        previous = old.get('fingerprints', {}).get(kind, {})
+        if output is not None:
+            unchanged = [i for i in ids if previous.get(str(i)) == current[kind].get(i) and
+                         _rendered(output, old['pages'], '%s/%d' % (kind, i))]
+            kept += ['%s/%d%s' % (kind, i, ext) for i in unchanged for ext in ('.json', '.html')]
+            ids = sorted(set(ids) - set(unchanged))
+        result += [(kind, ids[i:i + batch]) for i in range(0, len(ids), batch)]
+    return result, current, kept
+
+def _write(name: str, data: bytes):
+    """(page file, hash, written) of a rendered page, which is written unless it is unchanged"""
+    digest = hashlib.sha256(data).hexdigest()
+    target = os.path.join(_worker['output'], name)
+    if _worker['manifest'].get(name) == digest and os.path.exists(target):
+        return name, digest, False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target + '.tmp', 'wb') as file:
+        file.write(data)
+    os.replace(target + '.tmp', target)
+    return name, digest, True
+
+def _render(task):
+    """(kind, seconds, [_write() results]) of a task"""
+    kind, ids = task
+    start = time.perf_counter()
+    files = []
+    for name, (doc, page) in RENDER[kind](_worker['conn'], ids, _worker['sections']).items():
+        files.append(_write(name + '.json', json.dumps(doc, ensure_ascii=False).encode()))
+        files.append(_write(name + '.html', page.encode()))
+    return kind, time.perf_counter() - start, files
+
+def read_manifest(output: str):
+    """{'format', 'pages': {page file: hash}, 'fingerprints': {kind: {id: fingerprint}}} of the last generation"""
+    try:
+        with open(os.path.join(output, MANIFEST)) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return {'pages': {}}
+    if manifest.get('format') != FORMAT:
+        # Written by other templates, or before the fingerprints (page hashes only)
+        return {'pages': manifest.get('pages', manifest)}
+    return manifest
+
+def generate(path: str, output: str, workers: int = 1, batch: int = BATCH, full: bool = False):
+    """Render the site of a database into output; returns a report with page counts and timings
+
+    Only the pages whose fingerprint changed are rendered, unless full is set."""
+    start = time.perf_counter()
+    old = read_manifest(output)
+    conn = memimage.connect(path)
+    work, current, kept = tasks(conn, batch, None if full else output, old)
+    conn.close()
+    if workers > 1:
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        with context.Pool(workers, _init, (path, output, old['pages'])) as pool:
+            results = pool.map(_render, work, chunksize=1)
+    else:
+        _init(path, output, old['pages'])
+        results = [_render(task) for task in work]
+        _worker['conn'].close()
+    manifest = {name: old['pages'][name] for name in kept}
+    report = {'pages': 0, 'written': 0, 'unchanged': 0, 'skipped': len(kept), 'removed': 0,
+              'kinds': {kind: {'pages': 0, 'seconds': 0.0} for kind in KINDS}}
+    for kind, seconds, files in results:
+        report['kinds'][kind]['pages'] += len(files)
+        report['kinds'][kind]['seconds'] += seconds
+        for name, digest, written in files:
+            manifest[name] = digest
+            report['written' if written else 'unchanged'] += 1
+    report['pages'] = len(manifest)
+    for name in old['pages'].keys() - manifest.keys():
+        try:
+            os.remove(os.path.join(output, name))
+        except FileNotFoundError:
+            pass
+        report['removed'] += 1
+    with open(os.path.join(output, MANIFEST + '.tmp'), 'w') as file:
+        json.dump({'format': FORMAT, 'pages': manifest, 'fingerprints': current}, file, sort_keys=True, indent=0)
+    os.replace(os.path.join(output, MANIFEST + '.tmp'), os.path.join(output, MANIFEST))
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+def print_report(report):
+    print("%d pages: %d written, %d unchanged, %d not rendered, %d removed in %.2f s (%.0f pages/s)" % (
+        report['pages'], report['written'], report['unchanged'], report['skipped'], report['removed'], report['seconds'],
+        report['pages'] / report['seconds'] if report['seconds'] else 0))
+    for kind, r in report['kinds'].items():
+        print("  %-10s %6d pages %8.2f s rendering" % (kind, r['pages'], r['seconds']))
+
+def bench(path: str, workers, batch: int = BATCH):
+    """[(workers, full generation report, unchanged generation report), ...]"""
+    results = []
+    for n in workers:
+        output = tempfile.mkdtemp(prefix='static-site-')
+        try:
+            results.append((n, generate(path, output, n, batch), generate(path, output, n, batch)))
+        finally:
+            shutil.rmtree(output)
+    return results
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description="Render a built database as a static site of JSON and HTML pages")
+    argparser.add_argument("command", choices=["build", "bench"])
+    argparser.add_argument("database")
+    argparser.add_argument("output", nargs='?', help="output directory (build)")
+    argparser.add_argument("--workers", default=str(os.cpu_count() or 1),
+                           help="worker processes; a comma-separated list for bench (default: %(default)s)")
+    argparser.add_argument("--batch", type=int, default=BATCH, help="pages per task (default: %(default)s)")
+    argparser.add_argument("--full", action="store_true", help="build: render every page, not only the changed ones")
+    argparser.add_argument("--preload", action="store_true", help="read the database from an in-memory image (memimage.py)")
+    args = argparser.parse_args()
+
+    if args.preload:
+        memimage.preload(args.database)
+    workers = [int(n) for n in args.workers.split(',')]
+    if args.command == "build":
+        if not args.output:
+            argparser.error("build needs an output directory")
+        os.makedirs(args.output, exist_ok=True)
+        print_report(generate(args.database, args.output, workers[0], args.batch, args.full))
+    else:
+        print("%8s %8s %10s %12s %10s" % ('workers', 'pages', 'full s', 'pages/s', 'again s'))
+        for n, full, again in bench(args.database, workers, args.batch):
+            print("%8d %8d %10.2f %12.0f %10.2f" % (n, full['pages'], full['seconds'], full['pages'] / full['seconds'],
+                                                    again['seconds']))
+            if again['written']:
+                print("WARNING: %d pages were written again although nothing changed" % again['written'], file=sys.stderr)
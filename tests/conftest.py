@@ -0,0 +1,86 @@
+# Fixtures shared by the tests: small slices of the source tables and
+# databases built from them with make-sqlite.py.
+
+import os
+import csv
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MAKE_SQLITE = os.path.join(ROOT, 'make-sqlite.py')
+
+# Units of a slice
+UNITS = 40
+# Columns of the syntactic table that a slice gives a value to at least once
+COVERED = [
+    'linker', 'semfield1_ed', 'source', 'subfield1_ed', 'parts.num', 'parts.order', 'linker_position', 'clause.order',
+    'dep.clause.type', 'indep.sentence', 'linker_position_exclusivity', 'parts.order.example', 'position.example',
+    'clause.order.example', 'clause order comments', 'indep.sentence.example', 'inferential.example', 'illoc example',
+    'metatext example', 'mainpart', 'expansion', 'comp.oblig', 'correl', 'correl.oblig', 'correl.oblig.example',
+    'correl.position', 'correl.position.example', 'comment',
+]
+
+def read_table(name: str):
+    """(header, rows) of a source table"""
+    with open(os.path.join(ROOT, name), newline='') as file:
+        rows = list(csv.reader(file))
+    return rows[0], rows[1:]
+
+def write_table(path: str, header, rows) -> str:
+    with open(path, 'w', newline='') as file:
+        csv.writer(file).writerows([header] + list(rows))
+    return path
+
+def pick(header, rows, units: int = UNITS):
+    """Rows that give a value to every covered column, then the first rows up to units"""
+    picked = []
+    for name in COVERED:
+        column = header.index(name)
+        if not any(row[column] not in ('', 'NA') for row in picked):
+            picked += [row for row in rows if row[column] not in ('', 'NA')][:1]
+    picked += [row for row in rows if row not in picked][:units - len(picked)]
+    return picked
+
+def write_slice(directory: str, syntax_rows=None):
+    """Write a slice of the syntactic table and the dictionary rows of its meanings; returns both paths"""
+    header, rows = read_table('syntax_aug2024.csv')
+    rows = pick(header, rows) if syntax_rows is None else syntax_rows
+    column = header.index('id')
+    meanings = {mid.strip() for row in rows for mid in row[column].split(';')}
+    syntax_file = write_table(os.path.join(directory, 'syntax.csv'), header, rows)
+    header, data = read_table('data_aug2024.csv')
+    data_file = write_table(os.path.join(directory, 'data.csv'), header, [row for row in data if row[0] in meanings])
+    return syntax_file, data_file
+
+def build(syntax_file: str, data_file: str, output: str, *options) -> str:
+    """Build a database with make-sqlite.py; returns its path"""
+    subprocess.run([sys.executable, MAKE_SQLITE, '--syntax', syntax_file, '--data', data_file, '--output', output]
+                   + list(options), check=True, stdout=subprocess.DEVNULL)
+    return output + '.db'
+
+@pytest.fixture(scope='session')
+def tables(tmp_path_factory):
+    """(syntax file, data file) of the default slice"""
+    return write_slice(str(tmp_path_factory.mktemp('tables')))
+
+@pytest.fixture(scope='session')
+def built(tables, tmp_path_factory):
+    """Plain database built from the default slice; tests must not change it"""
+    return build(*tables, str(tmp_path_factory.mktemp('built') / 'fixture'))
+
+@pytest.fixture(scope='session')
+def built_compressed(tables, tmp_path_factory):
+    """Compressed database built from the default slice; tests must not change it"""
+    return build(*tables, str(tmp_path_factory.mktemp('built') / 'compressed'), '--compress')
+
+@pytest.fixture
+def database(built, tmp_path):
+    """Copy of the built database that a test may change"""
+    path = str(tmp_path / 'fixture.db')
+    shutil.copy(built, path)
+    return path
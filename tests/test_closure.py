@@ -0,0 +1,47 @@
+# Units by semantic field: the closure table and its pages.
+
+import sqlite3
+
+import pytest
+
+import closure
+
+def _all(conn, semfield_id, subfield_id=None, roles=closure.ROLES, limit=3):
+    rows, cursor = [], 0
+    while cursor is not None:
+        page, cursor = closure.page(conn, semfield_id, subfield_id, roles, after=cursor, limit=limit)
+        rows += page
+    return rows
+
+def test_closure_covers_every_membership(built):
+    conn = sqlite3.connect(built)
+    main = set(conn.execute('SELECT semfield_id, id FROM units WHERE semfield_id IS NOT NULL'))
+    extra = set(conn.execute('SELECT semfield_id, unit_id FROM units_to_semfields'))
+    sub = set(conn.execute('''SELECT sf.semfield_id, ms.meaning_id FROM meanings_to_subfields AS ms
+                              JOIN subfields AS sf ON sf.id = ms.subfield_id WHERE sf.semfield_id IS NOT NULL'''))
+    assert main and sub
+    fields = dict(((f, u), r) for f, u, r in conn.execute(
+        'SELECT semfield_id, unit_id, role FROM unit_fields WHERE subfield_id IS NULL'))
+    assert set(fields) == main | extra | sub
+    # The strongest role wins
+    for key, role in fields.items():
+        assert role == ('main' if key in main else 'extra' if key in extra else 'sub')
+
+def test_pages(built):
+    conn = sqlite3.connect(built)
+    (semfield_id, keyword), = conn.execute('''SELECT s.id, s.keyword FROM semfields AS s JOIN unit_fields AS uf ON uf.semfield_id = s.id
+                                              GROUP BY s.id ORDER BY COUNT(*) DESC LIMIT 1''')
+    rows = _all(conn, semfield_id)
+    assert len(rows) > 3
+    assert rows == conn.execute('''SELECT uf.unit_id, u.linker, uf.role FROM unit_fields AS uf JOIN units AS u ON u.id = uf.unit_id
+                                   WHERE uf.semfield_id = ? AND uf.subfield_id IS NULL ORDER BY uf.unit_id''',
+                                (semfield_id,)).fetchall()
+    assert _all(conn, semfield_id, roles=('main',)) == [r for r in rows if r[2] == 'main']
+    assert closure.units_in_field(conn, keyword, limit=len(rows) + 1) == (rows, None)
+
+    (subfield_id, sub_keyword), = conn.execute('SELECT id, keyword FROM subfields WHERE id IN (SELECT subfield_id FROM unit_fields) LIMIT 1')
+    sub_rows = _all(conn, *closure.resolve(conn, sub_keyword, subfield=True))
+    assert sub_rows and {u for u, _, _ in sub_rows} == {u for u, in conn.execute(
+        'SELECT meaning_id FROM meanings_to_subfields WHERE subfield_id = ?', (subfield_id,))}
+    with pytest.raises(KeyError):
+        closure.resolve(conn, 'нет такого поля')
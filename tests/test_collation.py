@@ -0,0 +1,48 @@
+# Russian collation of linkers and the keyset-paginated browse index.
+
+import sqlite3
+
+import collation
+
+def _sorted(texts):
+    return sorted(texts, key=collation.sort_key)
+
+def test_word_by_word():
+    assert _sorted(['абы', 'а-то', 'а вот', 'а']) == ['а', 'а вот', 'а-то', 'абы']
+    assert _sorted(['в_то_время_как', 'в силу того что', 'вдобавок']) == ['в силу того что', 'в_то_время_как', 'вдобавок']
+    assert _sorted(['Тем не менее', 'так что', 'то... то']) == ['так что', 'Тем не менее', 'то... то']
+
+def test_yo():
+    # ё is е at the primary level and comes after it only where the words are equal
+    assert _sorted(['ещё', 'еще', 'ею', 'едва']) == ['едва', 'еще', 'ещё', 'ею']
+    assert _sorted(['всё же', 'все же', 'все-таки']) == ['все же', 'всё же', 'все-таки']
+
+def test_leading_particles():
+    key = collation.sort_key('(а/но) с другой (стороны)')
+    assert collation.letter(key) == 'С'
+    assert _sorted(['(а/но) с другой (стороны)', 'раз', 'так']) == ['раз', '(а/но) с другой (стороны)', 'так']
+    # Only particles: filed under the words inside
+    assert collation.letter(collation.sort_key('(и)')) == 'И'
+    assert collation.letter(collation.sort_key('1) ...')) == collation.OTHER
+
+def test_browse_pages(built):
+    conn = sqlite3.connect(built)
+    expected = sorted(collation.entries(conn), key=lambda e: (e[0], e[1]))
+    assert conn.execute('SELECT COUNT(*) FROM browse_keys').fetchone()[0] == len(expected)
+    rows, cursor = [], None
+    while True:
+        page, cursor = collation.page(conn, after=cursor, limit=7)
+        rows += page
+        if cursor is None:
+            break
+    assert [(unit_id, form_id, text) for unit_id, form_id, text, _ in rows] == \
+        [(unit_id, form_id, text) for _, unit_id, form_id, text in expected]
+    # A letter jump starts at the first entry filed under the letter
+    letters = collation.letters(conn)
+    assert sum(count for _, count in letters) == len(expected)
+    for name, _ in letters:
+        if name == collation.OTHER:
+            continue
+        page, _ = collation.page(conn, letter=name, limit=1)
+        first = next(e for e in expected if collation.letter(e[0]) == name)
+        assert page[0][:2] == first[1:3]
@@ -0,0 +1,33 @@
+# Compressed builds read back like plain ones.
+
+import sqlite3
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import compression
+from models import Example, Meaning
+
+def test_orm_reads_compressed_text_without_setup(built, built_compressed):
+    # A new process has no dictionaries loaded until an engine connects
+    compression._decompressors.clear()
+    texts = {}
+    for path in (built, built_compressed):
+        engine = create_engine('sqlite:///%s' % path)
+        with Session(engine) as session:
+            texts[path] = (sorted(e.text for e in session.scalars(select(Example))),
+                           sorted(m.meaning or '' for m in session.scalars(select(Meaning))))
+        engine.dispose()
+    assert texts[built] == texts[built_compressed]
+    conn = sqlite3.connect(built_compressed)
+    assert conn.execute("SELECT COUNT(*) FROM examples WHERE typeof(text) = 'blob'").fetchone()[0] > 0
+    conn.close()
+
+def test_full_text_index_matches_words(built_compressed):
+    conn = sqlite3.connect(built_compressed)
+    compression.load_dictionaries(conn)
+    rowid, text = next((rowid, compression.decompress(text)) for rowid, text in conn.execute(
+        "SELECT id, text FROM examples WHERE typeof(text) = 'blob'"))
+    word = max(text.replace('ё', 'е').split(), key=len).strip('.,!?:;«»"()')
+    assert rowid in compression.search(conn, 'examples', 'text', '"%s"' % word, limit=1000)
+    conn.close()
@@ -0,0 +1,12 @@
+# SQL functions of db.connect().
+
+import db
+
+def test_plain_and_normalize(built, built_compressed):
+    texts = []
+    for path in (built, built_compressed):
+        conn = db.connect(path)
+        texts.append(conn.execute('SELECT id, plain(text), normalize(plain(text)) FROM examples ORDER BY id').fetchall())
+        conn.close()
+    assert texts[0] == texts[1]
+    assert all(isinstance(text, str) and normal == text.lower().replace('ё', 'е') for _, text, normal in texts[1])
@@ -0,0 +1,49 @@
+# Discontinuous matching of multi-component linkers.
+
+import sqlite3
+
+import discontinuous
+
+TEMPLATES = [
+    (1, (('если',), ('то',)), {}),
+    (2, (('не', 'только'), ('но', 'и')), {}),
+    (3, (('чем',), ('тем',)), {'correl': 1, 'position': 'initial'}),
+]
+
+def _found(matcher, text: str):
+    return [(a.unit_id, [text[o:o + n] for o, n in a.spans]) for a in matcher.match_sentence(text)]
+
+def test_components_in_order():
+    m = discontinuous.Matcher(TEMPLATES)
+    assert _found(m, 'Если он придёт, то мы уйдём.') == [(1, ['Если', 'то'])]
+    assert _found(m, 'Он не только пел, но и плясал.') == [(2, ['не только', 'но и'])]
+    assert _found(m, 'То ли дождь, если верить им.') == []
+
+def test_shortest_match_and_window():
+    m = discontinuous.Matcher(TEMPLATES)
+    text = 'Если бы, если он придёт, то мы уйдём.'
+    found = m.match_sentence(text)
+    assert [text[o:o + n] for o, n in found[0].spans] == ['если', 'то']
+    assert found[0].spans[0][0] == text.index('если')
+    assert not discontinuous.Matcher(TEMPLATES, window=10).match_sentence('Если он придёт завтра, то мы уйдём.')
+
+def test_position_bonus_and_best():
+    m = discontinuous.Matcher(TEMPLATES)
+    initial, = m.match_sentence('Чем дальше, тем лучше.')
+    inside, = m.match_sentence('Чем дальше тем лучше.')
+    assert initial.score > inside.score
+    # Overlapping analyses are dropped
+    analyses = [discontinuous.Analysis(1, ((0, 4), (10, 2)), 2.0), discontinuous.Analysis(2, ((10, 2), (20, 2)), 1.0),
+                discontinuous.Analysis(3, ((30, 3), (40, 3)), 0.5)]
+    assert [a.unit_id for a in discontinuous.best(analyses)] == [1, 3]
+
+def test_templates_of_database(built):
+    conn = sqlite3.connect(built)
+    templates = list(discontinuous.templates(conn))
+    m = discontinuous.Matcher.compile(conn)
+    conn.close()
+    assert templates
+    # A sentence made of the components of a template with words between them matches its unit
+    for uid, sequence, _ in templates[:20]:
+        text = ' слово '.join(' '.join(component) for component in sequence) + '.'
+        assert uid in [a.unit_id for a in m.match_sentence(text)], (uid, text)
@@ -0,0 +1,98 @@
+# Batched edits: validation of a whole batch, rejection and partial application.
+
+import json
+import sqlite3
+
+import pytest
+
+import edits
+
+def _unit_values(conn, unit: int, parameter: str):
+    return sorted(v for v, in conn.execute('''
+        SELECT pv.keyword FROM units_to_parametervalues AS up JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id WHERE up.unit_id = ? AND p.keyword = ?''', (unit, parameter)))
+
+def _parametermap(conn, table: str, id: int):
+    return json.loads(conn.execute('SELECT parametermap FROM %s WHERE id = ?' % table, (id,)).fetchone()[0] or '{}')
+
+def _dump(conn):
+    tables = [t for t, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    return {t: sorted(conn.execute('SELECT * FROM %s' % t), key=repr) for t in tables}
+
+@pytest.fixture
+def linked(database):
+    """(connection, unit, other unit) of the database copy"""
+    conn = sqlite3.connect(database)
+    # Two units whose parts.order is set, and a hyperlink between them
+    unit, other = [u for u, in conn.execute('''
+        SELECT up.unit_id FROM units_to_parametervalues AS up JOIN parametervalues AS pv ON pv.id = up.parametervalue_id
+        JOIN parameters AS p ON p.id = pv.parameter_id WHERE p.keyword = 'parts.order' ORDER BY up.unit_id LIMIT 2''')]
+    conn.execute('''INSERT INTO units_to_units (source_id, target_id, unitlinktype_id)
+                    SELECT ?, ?, id FROM unitlinktypes WHERE keyword = 'hyperlink' ''', (unit, other))
+    conn.commit()
+    yield conn, unit, other
+    conn.close()
+
+def test_batch_applied(linked):
+    conn, unit, other = linked
+    target = [u for u, in conn.execute('SELECT id FROM units WHERE id NOT IN (?, ?) LIMIT 1', (unit, other))][0]
+    new = 'nobreak' if _unit_values(conn, unit, 'parts.order') == ['discont'] else 'discont'
+    applied, errors = edits.apply(conn, [
+        {'op': 'set', 'unit': unit, 'parameter': 'parts.order', 'value': new},
+        {'op': 'add_example', 'unit': unit, 'text': 'Пример для теста.', 'parameter': 'parts.order', 'value': new},
+        {'op': 'add_form', 'unit': unit, 'formtype': 'correl', 'text': 'то', 'values': {'correl.position': ['free']}},
+        {'op': 'retarget', 'unit': unit, 'target': other, 'new_target': target},
+    ])
+    assert (applied, errors) == (4, [])
+    # The single-valued parameter is replaced, and the parameter map follows
+    assert _unit_values(conn, unit, 'parts.order') == [new]
+    assert _parametermap(conn, 'units', unit)['parts.order'] == [new]
+    example, = conn.execute('''SELECT e.id FROM examples AS e JOIN examples_to_unit_parametervalues AS ep ON ep.example_id = e.id
+                               WHERE e.text = 'Пример для теста.' AND ep.unit_id = ?''', (unit,)).fetchone()
+    form, = conn.execute("SELECT id FROM forms WHERE unit_id = ? AND text = 'то'", (unit,)).fetchone()
+    assert _parametermap(conn, 'forms', form) == {'correl.position': ['free']}
+    # New rows get stable ids like the built ones
+    assert example >= 1 << 31 and form >= 1 << 31
+    assert conn.execute('SELECT target_id FROM units_to_units WHERE source_id = ?', (unit,)).fetchall() == [(target,)]
+    assert not conn.execute('PRAGMA foreign_key_check').fetchall()
+
+def test_batch_rejected(linked):
+    conn, unit, other = linked
+    before = _dump(conn)
+    changes = [
+        {'op': 'set', 'unit': unit, 'parameter': 'linker_position', 'value': 'nonexistent'},
+        {'op': 'rename', 'unit': unit},
+        {'op': 'set', 'unit': 1, 'parameter': 'parts.order', 'value': 'discont'},
+        {'op': 'set', 'unit': unit, 'parameter': 'parts.order', 'value': 'discont'},
+        {'op': 'set', 'unit': unit, 'parameter': 'parts.order', 'value': 'nobreak'},
+        {'op': 'set', 'unit': unit, 'parameter': 'correl.position', 'value': 'free'},
+        {'op': 'remove', 'unit': other, 'parameter': 'correl.position'},
+        {'op': 'add_example', 'unit': unit, 'text': ' '},
+        {'op': 'retarget', 'unit': other, 'target': unit, 'new_target': unit},
+        {'op': 'set', 'unit': unit, 'parameter': 'linker_position'},
+    ]
+    applied, errors = edits.apply(conn, changes)
+    assert applied == 0
+    messages = dict(errors)
+    assert sorted(messages) == list(range(len(changes)))
+    assert 'no value nonexistent' in messages[0]
+    assert 'unknown operation' in messages[1]
+    assert messages[2] == 'no unit 1'
+    assert 'single-valued' in messages[3] and 'single-valued' in messages[4]
+    assert 'does not classify units' in messages[5]
+    assert 'is not set' in messages[6]
+    assert 'empty text' in messages[7]
+    assert 'no hyperlink' in messages[8]
+    assert 'needs value' in messages[9]
+    assert _dump(conn) == before
+
+def test_partial(linked):
+    conn, unit, other = linked
+    value = _unit_values(conn, other, 'parts.order')
+    applied, errors = edits.apply(conn, [
+        {'op': 'remove', 'unit': other, 'parameter': 'parts.order'},
+        {'op': 'set', 'unit': unit, 'parameter': 'parts.order', 'value': 'nonexistent'},
+    ], partial=True)
+    assert applied == 1 and [n for n, _ in errors] == [1]
+    assert value and _unit_values(conn, other, 'parts.order') == []
+    assert 'parts.order' not in _parametermap(conn, 'units', other)
@@ -0,0 +1,43 @@
+# Parameter maps of units and forms: built with the database and kept in sync
+# with the mapping tables by triggers.
+
+import json
+import sqlite3
+
+from collections import defaultdict
+
+def _maps(conn, owner_table, mapping_table, owner_col):
+    """{owner id: parameter map} computed from the mapping table, and {owner id: stored map}"""
+    expected = defaultdict(lambda: defaultdict(list))
+    for owner, parameter, value in conn.execute('''
+            SELECT m.%s, p.keyword, pv.keyword FROM %s AS m JOIN parametervalues AS pv ON pv.id = m.parametervalue_id
+            JOIN parameters AS p ON p.id = pv.parameter_id ORDER BY p.keyword, pv.keyword''' % (owner_col, mapping_table)):
+        expected[owner][parameter].append(value)
+    stored = {owner: json.loads(m) if m else {} for owner, m in conn.execute('SELECT id, parametermap FROM %s' % owner_table)}
+    return {owner: dict(expected.get(owner, {})) for owner in stored}, stored
+
+def test_built_maps(built):
+    conn = sqlite3.connect(built)
+    for tables in (('units', 'units_to_parametervalues', 'unit_id'), ('forms', 'forms_to_parametervalues', 'form_id')):
+        expected, stored = _maps(conn, *tables)
+        assert stored == expected
+        assert any(stored.values())
+
+def test_triggers_follow_edits(database):
+    conn = sqlite3.connect(database)
+    # A mapping whose parameter has another value to change it to
+    unit, value, other = conn.execute('''
+        SELECT m.unit_id, m.parametervalue_id, MIN(o.id) FROM units_to_parametervalues AS m
+        JOIN parametervalues AS pv ON pv.id = m.parametervalue_id
+        JOIN parametervalues AS o ON o.parameter_id = pv.parameter_id AND o.id != pv.id
+        GROUP BY m.unit_id, m.parametervalue_id LIMIT 1''').fetchone()
+    for sql, params in (
+            ('DELETE FROM units_to_parametervalues WHERE unit_id = ? AND parametervalue_id = ?', (unit, value)),
+            ('INSERT INTO units_to_parametervalues (unit_id, parametervalue_id) VALUES (?, ?)', (unit, value)),
+            ('UPDATE units_to_parametervalues SET parametervalue_id = ? WHERE unit_id = ? AND parametervalue_id = ?',
+             (other, unit, value))):
+        before = conn.execute('SELECT parametermap FROM units WHERE id = ?', (unit,)).fetchone()
+        conn.execute(sql, params)
+        assert conn.execute('SELECT parametermap FROM units WHERE id = ?', (unit,)).fetchone() != before
+        expected, stored = _maps(conn, 'units', 'units_to_parametervalues', 'unit_id')
+        assert stored == expected
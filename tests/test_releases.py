@@ -0,0 +1,68 @@
+# Release store: adding builds, extracting releases, the change log.
+
+import os
+import sqlite3
+
+import pytest
+
+from conftest import UNITS, build, pick, read_table, write_slice
+
+import dbdiff
+import releases
+
+def test_extract_keeps_duplicate_references(database, tmp_path):
+    store = releases.connect(str(tmp_path / 'store.db'))
+    releases.add_release(store, database, 'r1')
+    releases.extract_release(store, 'r1', str(tmp_path / 'r1.db'))
+    conn = sqlite3.connect(str(tmp_path / 'r1.db'))
+    for review, table in (('example_duplicates', 'examples'), ('comment_duplicates', 'comments')):
+        rows, members, clusters = conn.execute('''
+            SELECT COUNT(*), COUNT(m.id), COUNT(c.id) FROM %s AS d
+            LEFT JOIN %s AS m ON m.id = d.row_id LEFT JOIN %s AS c ON c.id = d.cluster_id''' % (review, table, table)).fetchone()
+        assert rows == members == clusters
+    assert conn.execute('SELECT COUNT(*) FROM example_duplicates').fetchone()[0] > 0
+
+def _second_build(directory):
+    """A build of the default slice without its last unit and with another comment on its first; (path, removed linker)"""
+    header, rows = read_table('syntax_aug2024.csv')
+    rows = pick(header, rows)
+    removed = rows.pop()
+    rows[0][header.index('comment')] = 'Комментарий для теста'
+    return build(*write_slice(directory, rows), os.path.join(directory, 'second')), removed[header.index('linker')]
+
+def test_releases_and_changes(built, tmp_path):
+    second, removed = _second_build(str(tmp_path))
+    store = releases.connect(str(tmp_path / 'store.db'))
+    first = releases.add_release(store, built, 'r1')
+    assert first['closed'] == 0 and first['kept'] == 0
+    stats = releases.add_release(store, second, 'r2')
+    assert stats['closed'] > 0 and stats['kept'] > stats['added']
+    with pytest.raises(ValueError):
+        releases.add_release(store, second, 'r2')
+    store.close()
+
+    for name, units in (('r1', UNITS), ('r2', UNITS - 1)):
+        conn = releases.open_release(str(tmp_path / 'store.db'), name)
+        assert conn.execute('SELECT COUNT(*) FROM units').fetchone()[0] == units
+        assert bool(conn.execute('SELECT 1 FROM units WHERE linker = ?', (removed,)).fetchone()) == (name == 'r1')
+        conn.close()
+
+    store = releases.connect(str(tmp_path / 'store.db'))
+    r1 = releases.release_id(store, 'r1')
+    changes, cursor = releases.changes_since(store, r1, entity='unit')
+    assert cursor is None
+    ops = [op for _, _, _, _, op in changes]
+    assert ops.count('delete') == 1 and 'insert' not in ops and 'update' in ops
+    # Paging gives the same changes
+    paged, cursor = [], 0
+    while cursor is not None:
+        page, cursor = releases.changes_since(store, r1, after=cursor, limit=2, entity='unit')
+        paged += page
+    assert paged == changes
+    assert releases.changes_since(store, releases.release_id(store, 'r2')) == ([], None)
+
+    # Extracted releases have the content of their builds
+    for name, path in (('r1', built), ('r2', second)):
+        releases.extract_release(store, name, str(tmp_path / (name + '.db')))
+        report = dbdiff.diff(sqlite3.connect(path), sqlite3.connect(str(tmp_path / (name + '.db'))))
+        assert (report['summary']['added'], report['summary']['removed'], report['summary']['changed']) == (0, 0, 0)
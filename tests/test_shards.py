@@ -0,0 +1,17 @@
+# Sharded build: the merged shards give the database of a single-process build.
+
+import sqlite3
+
+import dbdiff
+
+from conftest import build
+
+def test_sharded_build_matches_sequential(built, tables, tmp_path):
+    sharded = build(*tables, str(tmp_path / 'sharded'), '--jobs', '3')
+    old, new = sqlite3.connect(built), sqlite3.connect(sharded)
+    report = dbdiff.diff(old, new)
+    assert (report['summary']['added'], report['summary']['removed'], report['summary']['changed']) == (0, 0, 0)
+    assert not report['vocabularies']
+    for table in ('units_to_units', 'forms', 'examples', 'unit_fields', 'example_highlights'):
+        count = 'SELECT COUNT(*) FROM %s' % table
+        assert old.execute(count).fetchone() == new.execute(count).fetchone()
@@ -0,0 +1,72 @@
+# Linker spotter: matching, compiling, saving and loading.
+
+import io
+import os
+import sqlite3
+
+import annotate
+import spotter
+
+# а is the first linker of the source tables
+TEXT = 'Он ушёл, а она осталась.'
+
+def _matches(s: spotter.Spotter, text: str):
+    return [(offset, length) for offset, length, _ in spotter.longest(s.scan(text))]
+
+def test_load_compiled(database, capsys):
+    compiled = os.path.splitext(database)[0] + '.spotter'
+    conn = sqlite3.connect('file:%s?mode=ro' % database, uri=True)
+    # Compiled from the connection: nothing is written
+    s = spotter.Spotter.load_compiled(database, conn)
+    assert not os.path.exists(compiled)
+    assert _matches(s, TEXT) == [(9, 1)]
+    # Compiled from the file: written next to it and loaded from there afterwards
+    assert _matches(spotter.Spotter.load_compiled(database), TEXT) == _matches(s, TEXT)
+    assert os.path.exists(compiled)
+    assert _matches(spotter.Spotter.load(compiled), TEXT) == _matches(s, TEXT)
+    # A file of another format is compiled again, with a warning
+    with open(compiled, 'wb') as file:
+        file.write(b'not a spotter')
+    assert _matches(spotter.Spotter.load_compiled(database, conn), TEXT) == _matches(s, TEXT)
+    assert 'WARNING' in capsys.readouterr().err
+    conn.close()
+
+def test_annotate_load_writes_nothing(database):
+    annotate.load(database)
+    assert not os.path.exists(os.path.splitext(database)[0] + '.spotter')
+    assert annotate._spotter is not None
+
+def _spotter(*linkers):
+    """Spotter of the given linkers, unit ids counted from 1"""
+    automaton = spotter.Automaton()
+    sequences = [variant[0] for linker in linkers for variant in spotter.expand(linker)]
+    for uid, linker in enumerate(linkers, 1):
+        for variant in spotter.expand(linker):
+            automaton.add(variant[0], (uid,))
+    automaton.finalize()
+    return spotter.Spotter(automaton, max(map(len, sequences)))
+
+def test_longest_match_wins():
+    s = _spotter('потому', '(и) потому что')
+    text = 'Он молчал, и потому что боялся, и потому.'
+    assert [(text[o:o + n], uids) for o, n, uids in spotter.longest(s.scan(text))] == \
+        [('и потому что', (2,)), ('потому', (1,))]
+
+def test_case_yo_and_hyphens():
+    s = _spotter('всё же/все-таки')
+    text = 'ВСЁ ЖЕ он пришёл, Все-таки поздно, все же.'
+    assert [text[o:o + n] for o, n, _ in spotter.longest(s.scan(text))] == ['ВСЁ ЖЕ', 'Все-таки', 'все же']
+    # A part of a hyphenated word is not a match
+    assert not list(_spotter('таки').scan(text))
+
+def test_sentence_ends_break_matches():
+    s = _spotter('потому что')
+    assert not list(s.scan('Он знал потому. Что делать?'))
+    assert not list(s.scan('Не потому; что устал'))
+    # Commas are not sentence ends
+    assert len(list(s.scan('Не потому, что устал'))) == 1
+
+def test_stream_matches_scan():
+    s = _spotter('потому что', 'а', 'всё же')
+    text = ' '.join(['Он ушёл, а она осталась, потому что всё же устала.'] * 50)
+    assert list(s.scan_stream(io.StringIO(text), chunk_size=17)) == list(s.scan(text))
@@ -0,0 +1,30 @@
+# Stable ids: an entity keeps its id when the CSV rows are reordered or
+# other rows are added.
+
+import sqlite3
+
+from conftest import UNITS, build, pick, read_table, write_slice
+
+QUERIES = {
+    'units': 'SELECT u.id, u.linker, s.keyword FROM units AS u LEFT JOIN semfields AS s ON s.id = u.semfield_id',
+    'forms': 'SELECT f.id, f.text, f.unit_id FROM forms AS f',
+    'examples': 'SELECT id, text FROM examples',
+    'parametervalues': 'SELECT id, keyword FROM parametervalues',
+}
+
+def _rows(path: str):
+    conn = sqlite3.connect(path)
+    rows = {table: set(conn.execute(sql)) for table, sql in QUERIES.items()}
+    conn.close()
+    return rows
+
+def test_ids_survive_reordering_and_additions(built, tmp_path):
+    header, rows = read_table('syntax_aug2024.csv')
+    picked = pick(header, rows)
+    added = [row for row in rows if row not in picked][UNITS]
+    reordered = build(*write_slice(str(tmp_path), [added] + picked[::-1]), str(tmp_path / 'reordered'))
+    old, new = _rows(built), _rows(reordered)
+    assert len(new['units']) == UNITS + 1
+    for table in QUERIES:
+        assert old[table] <= new[table], table
+    assert all(i >= 1 << 31 for i, *_ in new['units'])
@@ -0,0 +1,37 @@
+# Incremental generation of static_site.py: a second run renders the pages
+# of what changed only and gives the same site as a full run.
+
+import os
+import sqlite3
+import filecmp
+
+import static_site
+
+def _files(directory: str):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, names in os.walk(directory) for name in names if name != static_site.MANIFEST)
+
+def test_renders_changed_pages_only(database, tmp_path):
+    site, full = str(tmp_path / 'site'), str(tmp_path / 'full')
+    first = static_site.generate(database, site)
+    assert first['written'] == first['pages'] and first['skipped'] == 0
+
+    again = static_site.generate(database, site)
+    assert again['written'] == 0
+    assert sum(kind['pages'] for kind in again['kinds'].values()) == again['kinds']['index']['pages']
+
+    conn = sqlite3.connect(database)
+    unit = conn.execute('SELECT MIN(id) FROM units').fetchone()[0]
+    conn.execute("UPDATE units SET linker = linker || ' (new)' WHERE id = ?", (unit,))
+    conn.commit()
+    conn.close()
+    changed = static_site.generate(database, site)
+    assert changed['kinds']['units']['pages'] >= 2
+    assert changed['kinds']['units']['pages'] < first['kinds']['units']['pages']
+    with open(os.path.join(site, 'units', '%d.json' % unit)) as file:
+        assert ' (new)' in file.read()
+
+    static_site.generate(database, full, full=True)
+    assert _files(site) == _files(full)
+    _, mismatch, errors = filecmp.cmpfiles(site, full, _files(full), shallow=False)
+    assert not mismatch and not errors
@@ -0,0 +1,43 @@
+# Watch mode: rebuilding the changed groups of rows into a preview database
+# gives the database of a full build.
+
+import sqlite3
+
+import dbdiff
+import watch
+
+from conftest import build, pick, read_table, write_slice
+
+def test_changed_keys():
+    old = ([{'linker': 'а', 'semfield1_ed': 'f'}, {'linker': 'и', 'semfield1_ed': 'f'}],
+           [{'edit form': '', 'form': 'но', 'semfield1_ed': 'f', 'hyperlink': 'а'}])
+    new = ([{'linker': 'а', 'semfield1_ed': 'g'}, {'linker': 'и', 'semfield1_ed': 'f'}], old[1])
+    # The moved unit under both keys, and the unit linking to it
+    assert watch.changed_keys(old, new) == {('а', 'f'), ('а', 'g'), ('но', 'f')}
+    assert watch.changed_keys(old, old) == set()
+
+def test_update_matches_full_build(database, tables, tmp_path):
+    header, rows = read_table('syntax_aug2024.csv')
+    rows = pick(header, rows)
+    removed = rows.pop()
+    rows[0][header.index('comment')] = 'Комментарий для теста'
+    (tmp_path / 'new').mkdir()
+    new_tables = write_slice(str(tmp_path / 'new'), rows)
+
+    fields, old = watch._read(tables)
+    new_fields, new = watch._read(new_tables)
+    assert new_fields == fields
+    keys = watch.changed_keys(old, new)
+    assert (removed[header.index('linker')], removed[header.index('semfield1_ed')]) in keys
+    (tmp_path / 'work').mkdir()
+    before = watch._hashes(database)
+    watch.update(database, str(tmp_path / 'work'), fields, new, keys, new_tables[1])
+    after = watch._hashes(database)
+    assert len(after) == len(before) - 1
+    assert sum(after[u] != before[u] for u in after.keys() & before.keys()) >= 1
+
+    full = build(*new_tables, str(tmp_path / 'full'))
+    report = dbdiff.diff(sqlite3.connect(full), sqlite3.connect(database))
+    assert (report['summary']['added'], report['summary']['removed'], report['summary']['changed']) == (0, 0, 0)
+    # Unchanged units keep their ids, and new ones get those of the full build
+    assert set(after) <= set(before) and set(after) == {u for u, in sqlite3.connect(full).execute('SELECT id FROM units')}
@@ -0,0 +1,297 @@
+# Incremental rebuilds of a preview database while the CSV tables are edited.
+#
+# Rows are grouped the way make-sqlite.py matches them: a syntax row by its
+# linker and semantic field, a dictionary row by its edit form (or form) and
+# semantic field. When a table is saved, the groups whose rows changed, and
+# the groups with hyperlinks to their linkers, are built alone as a small
+# shard (as in shards.py) and swapped into the preview database:
+#
+# * the units of those groups are deleted with their forms, meanings and
+#   association rows, then examples and comments nobody uses any more;
+# * the shard gets stable ids (stable_ids.py), example highlights
+#   (highlights.py), its field closure (closure.py) and browse index
+#   (collation.py). Entities that did not change have the same id in the
+#   shard as in the preview database, so its rows are copied with INSERT OR
+#   IGNORE;
+# * the shard's hyperlinks are resolved against the whole database.
+#
+# The shard is built by running make-sqlite.py in a process forked from the
+# watcher, which has SQLAlchemy and the models imported already. Saves are
+# debounced, and every update reports the unit ids it added, removed or
+# changed together with the warnings of the build.
+#
+# The preview can drift from a full build in what depends on row order
+# across groups (which semantic field a shared subfield belongs to, the
+# hidden flag of a comment used twice), and units share one row for the same
+# example text where a full build may have several. The near-duplicate review
+# table (neardup.py) is not updated; rebuild fully before a release.
+#
+# An update that fails leaves the preview database as it was, triggers
+# included. After every update the linker spotter (spotter.py) is compiled
+# again from the preview database.
+#
+#     python make-sqlite.py --watch
+
+import os
+import io
+import sys
+import csv
+import time
+import runpy
+import shutil
+import sqlite3
+import tempfile
+import traceback
+import subprocess
+
+from contextlib import redirect_stdout
+
+import dbdiff
+import shards
+import closure
+import collation
+import spotter
+import highlights
+import stable_ids
+
+from releases import Schema, quote
+
+# Entities that are shared between units and go when the last one does
+SHARED = ('examples', 'comments')
+
+DEBOUNCE = 0.3
+POLL = 0.1
+
+def syntax_key(row):
+    return row["linker"], row["semfield1_ed"]
+
+def data_key(row):
+    return row["edit form"] or row["form"], row["semfield1_ed"]
+
+def _groups(rows, key):
+    groups = {}
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+    return groups
+
+def changed_keys(old, new):
+    """Group keys whose rows differ between two (syntax, data) snapshots"""
+    keys = set()
+    for i, key in enumerate((syntax_key, data_key)):
+        before, after = _groups(old[i], key), _groups(new[i], key)
+        keys.update(k for k in before.keys() | after.keys() if before.get(k) != after.get(k))
+    # Units linking to a changed linker are rebuilt too, so their hyperlinks are resolved again
+    linkers = {linker for linker, _ in keys}
+    for snapshot in (old, new):
+        keys.update(data_key(row) for row in snapshot[1] if row["hyperlink"] in linkers)
+    return keys
+
+def _fork_build(argv):
+    """(return code, output) of make-sqlite.py run in a forked process"""
+    if not hasattr(os, 'fork'):
+        result = subprocess.run([sys.executable, shards.MAKE_SQLITE] + argv, capture_output=True, text=True)
+        return result.returncode, result.stdout + result.stderr
+    log = tempfile.TemporaryFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+            sys.argv = [shards.MAKE_SQLITE] + argv
+            runpy.run_path(shards.MAKE_SQLITE, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            code = e.code or 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    log.seek(0)
+    return os.waitstatus_to_exitcode(status), log.read().decode()
+
+def _delete_units(conn: sqlite3.Connection, schema: Schema, unit_ids):
+    """Delete units with everything that belongs to them; returns the deleted unit ids"""
+    doomed = {}
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS doomed_units (id INTEGER PRIMARY KEY)')
+    conn.execute('DELETE FROM temp.doomed_units')
+    conn.executemany('INSERT OR IGNORE INTO temp.doomed_units VALUES (?)', ((i,) for i in unit_ids))
+    doomed['units'] = 'SELECT id FROM temp.doomed_units'
+    # Entities owned by a doomed entity (forms and meanings of a unit)
+    for table in schema.entity_order():
+        owners = [c for c in schema.columns[table] if c != 'id' and schema.target(table, c) in doomed]
+        if owners and table not in doomed:
+            doomed[table] = 'SELECT id FROM %s WHERE %s' % (quote(table), ' OR '.join(
+                '%s IN (%s)' % (quote(c), doomed[schema.target(table, c)]) for c in owners))
+    for table in schema.tables:
+        if schema.is_entity(table):
+            continue
+        refs = [c for c in schema.columns[table] if schema.target(table, c) in doomed]
+        if refs:
+            conn.execute('DELETE FROM %s WHERE %s' % (quote(table), ' OR '.join(
+                '%s IN (%s)' % (quote(c), doomed[schema.target(table, c)]) for c in refs)))
+    # Owned entities first, the units last
+    for table in reversed(list(doomed)):
+        if table != 'units':
+            conn.execute('DELETE FROM %s WHERE id IN (%s)' % (quote(table), doomed[table]))
+    deleted = [r[0] for r in conn.execute('SELECT id FROM units WHERE id IN (SELECT id FROM temp.doomed_units)')]
+    conn.execute('DELETE FROM units WHERE id IN (SELECT id FROM temp.doomed_units)')
+    for table in SHARED:
+        refs = [(t, c) for t in schema.tables for c in schema.columns[t]
+                if not (t == table and c == 'id') and schema.target(t, c) == table]
+        if not refs:
+            continue
+        conn.execute('DELETE FROM %s WHERE %s' % (quote(table), ' AND '.join(
+            'id NOT IN (SELECT %s FROM %s WHERE %s IS NOT NULL)' % (quote(c), quote(t), quote(c)) for t, c in refs)))
+    return deleted
+
+def _copy_shard(conn: sqlite3.Connection, schema: Schema):
+    """Copy the attached database 'shard' into main; its ids are already stable"""
+    for table in schema.entity_order() + [t for t in schema.tables if not schema.is_entity(t)]:
+        cols = ', '.join(map(quote, schema.columns[table]))
+        if table == 'pending_links':
+            conn.execute('INSERT INTO temp.pending_links SELECT %s FROM shard.pending_links' % cols)
+        elif schema.pk[table] or table in schema.unique:
+            conn.execute('INSERT OR IGNORE INTO main.%s (%s) SELECT %s FROM shard.%s' % (quote(table), cols, cols, quote(table)))
+        else: # no key to deduplicate on, e.g. parameters_to_formtypes
+            conn.execute('INSERT INTO main.%s (%s) SELECT %s FROM shard.%s EXCEPT SELECT %s FROM main.%s' % (
+                quote(table), cols, cols, quote(table), cols, quote(table)))
+
+def update(database: str, workdir: str, fields, snapshot, keys, sources: str):
+    """Rebuild the groups with the given keys into the database; returns the warnings"""
+    syntax = [row for row in snapshot[0] if syntax_key(row) in keys]
+    # Dictionary rows without a unit add nothing, but would warn about fields missing from the shard
+    units = {syntax_key(row) for row in syntax}
+    data = [row for row in snapshot[1] if data_key(row) in units]
+    syntax_file = os.path.join(workdir, 'syntax.csv')
+    data_file = os.path.join(workdir, 'data.csv')
+    output = os.path.join(workdir, 'shard')
+    shards._write_csv(syntax_file, fields[0], syntax)
+    shards._write_csv(data_file, fields[1], data)
+    if os.path.exists(output + '.db'):
+        os.remove(output + '.db')
+    code, log = _fork_build(['--syntax', syntax_file, '--data', data_file, '--output', output,
+                             '--sources', sources, '--defer-links', '--no-parse-cache'])
+    if code != 0:
+        raise RuntimeError("Build of the changed rows failed:\n%s" % log)
+    stable_ids.stabilize(output + '.db')
+    highlights.store_database(output + '.db')
+    closure.build_database(output + '.db')
+    collation.build_database(output + '.db')
+    warnings = [line for line in log.splitlines() if line.startswith('WARNING')]
+
+    conn = sqlite3.connect(database)
+    try:
+        schema = Schema(conn)
+        unit_ids = [uid for uid, linker, semfield in conn.execute('''
+            SELECT u.id, u.linker, s.keyword FROM units AS u JOIN semfields AS s ON s.id = u.semfield_id''')
+            if (linker, semfield) in keys]
+        conn.execute('ATTACH DATABASE ? AS shard', (output + '.db',))
+        # Nothing is changed unless everything is: the deletes, the copy and the triggers are one transaction
+        with stable_ids.without_triggers(conn):
+            _delete_units(conn, schema, unit_ids)
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS pending_links (source_id INTEGER, hyperlink TEXT, semfield TEXT)')
+            conn.execute('DELETE FROM temp.pending_links')
+            _copy_shard(conn, Schema(conn, 'shard'))
+            out = io.StringIO()
+            with redirect_stdout(out):
+                shards.resolve_links(conn)
+            warnings += out.getvalue().splitlines()
+        conn.commit()
+        conn.execute('DETACH DATABASE shard')
+    finally:
+        conn.close()
+    # The automaton of annotate.py and highlights.py is compiled from the linkers of the whole database
+    spotter.compile_database(database)
+    return warnings
+
+def _read(paths):
+    fields, rows = zip(*(shards.read_csv(path) for path in paths))
+    return fields, rows
+
+def _stamp(paths):
+    return tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) if os.path.exists(p) else None for p in paths)
+
+def _hashes(database: str):
+    conn = sqlite3.connect(database)
+    hashes = dbdiff.section_hashes(conn)
+    conn.close()
+    return hashes
+
+def _full_build(syntax_file: str, data_file: str, filename: str, jobs: int):
+    # make-sqlite.py adds to an existing database
+    if os.path.exists('%s.db' % filename):
+        os.remove('%s.db' % filename)
+    subprocess.run([sys.executable, shards.MAKE_SQLITE, '--syntax', syntax_file, '--data', data_file,
+                    '--output', filename, '--jobs', str(jobs)], check=True)
+
+def watch(syntax_file: str, data_file: str, filename: str, jobs: int = 1, debounce: float = DEBOUNCE):
+    database = '%s.db' % filename
+    paths = (syntax_file, data_file)
+    if not os.path.exists(database) or os.path.getmtime(database) < max(map(os.path.getmtime, paths)):
+        print("Building %s" % database)
+        _full_build(syntax_file, data_file, filename, jobs)
+    # The forked builds start with everything imported
+    import sqlalchemy.orm
+    import sqlalchemy_utils
+    import models
+    sqlalchemy.orm.configure_mappers()
+
+    fields, snapshot = _read(paths)
+    hashes = _hashes(database)
+    stamp = _stamp(paths)
+    workdir = tempfile.mkdtemp(prefix='ruslinkers-watch-')
+    print("Watching %s and %s (Ctrl-C to stop)" % paths)
+    try:
+        while True:
+            time.sleep(POLL)
+            if _stamp(paths) == stamp:
+                continue
+            # Wait until the editor has finished writing
+            while True:
+                stamp = _stamp(paths)
+                time.sleep(debounce)
+                if _stamp(paths) == stamp:
+                    break
+            start = time.perf_counter()
+            try:
+                new_fields, new_snapshot = _read(paths)
+            except (OSError, csv.Error, UnicodeDecodeError) as e:
+                print("WARNING: cannot read the tables: %s" % e)
+                continue
+            if new_fields != fields:
+                print("Columns changed, rebuilding %s" % database)
+                try:
+                    _full_build(syntax_file, data_file, filename, jobs)
+                except subprocess.CalledProcessError:
+                    print("WARNING: the build failed, fix the tables and save again")
+                    continue
+                fields, snapshot, hashes = new_fields, new_snapshot, _hashes(database)
+                continue
+            keys = changed_keys(snapshot, new_snapshot)
+            if not keys:
+                continue
+            try:
+                warnings = update(database, workdir, fields, new_snapshot, keys, data_file)
+            except (RuntimeError, KeyError, sqlite3.Error) as e:
+                print("WARNING: update failed, the preview is unchanged: %s" % e)
+                continue
+            snapshot = new_snapshot
+            before, hashes = hashes, _hashes(database)
+            added = sorted(hashes.keys() - before.keys())
+            removed = sorted(before.keys() - hashes.keys())
+            changed = sorted(u for u in hashes.keys() & before.keys() if hashes[u] != before[u])
+            print("%s: %d groups rebuilt in %.2fs; units added %s, removed %s, changed %s" % (
+                time.strftime('%H:%M:%S'), len(keys), time.perf_counter() - start, added, removed, changed))
+            for warning in warnings:
+                print("  %s" % warning)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutil.rmtree(workdir)